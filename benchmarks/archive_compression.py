@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Measures compression time, decompression time and size of binary archives for several compression settings.
+
+Best run on real temporary roots, which can be obtained with `orc install -B --keep-tmproot <component>`. Example:
+
+    python3 benchmarks/archive_compression.py --tree "$ORCHESTRA_DOTDIR/tmproot/<build>/$ORCHESTRA_ROOT"
+
+If --tree is not given a synthetic tree is generated (see extract_binary_archive.py).
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+from loguru import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from orchestra.actions.archive import Compression, create_archive, extract_archive  # noqa: E402
+from extract_binary_archive import generate_tree, parse_size  # noqa: E402
+
+DEFAULT_MATRIX = "xz:1,xz:6,xz:9,zstd:3,zstd:10,zstd:19,gzip:6"
+
+
+def tree_size(root):
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            total += os.lstat(os.path.join(dirpath, filename)).st_size
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tree", action="append", help="Directory to archive, can be repeated")
+    parser.add_argument("--synthetic-size", default="256M", help="Size of the synthetic tree used without --tree")
+    parser.add_argument("--workdir", default="/tmp/orchestra-compression-benchmark", help="Scratch directory")
+    parser.add_argument("--matrix", default=DEFAULT_MATRIX, help=f"Compression settings (default: {DEFAULT_MATRIX})")
+    args = parser.parse_args()
+    logger.remove()
+
+    trees = args.tree
+    if not trees:
+        synthetic_tree = os.path.join(args.workdir, "synthetic-tree")
+        if not os.path.exists(synthetic_tree):
+            generate_tree(synthetic_tree, parse_size(args.synthetic_size))
+        trees = [synthetic_tree]
+
+    os.makedirs(args.workdir, exist_ok=True)
+    destination = os.path.join(args.workdir, "extracted")
+
+    for tree in trees:
+        uncompressed_size = tree_size(tree)
+        print(f"{tree} ({uncompressed_size / 1024**2:.1f} MB)")
+        print(f"{'compression':<12}{'size (MB)':>12}{'ratio':>8}{'compress':>12}{'decompress':>12}")
+        for spec in args.matrix.split(","):
+            compression = Compression(spec)
+            archive_path = os.path.join(args.workdir, f"archive.tar{compression.extension}")
+            if os.path.exists(archive_path):
+                os.unlink(archive_path)
+
+            entries = sorted(e for e in os.listdir(tree) if not e.startswith("."))
+            start = time.monotonic()
+            create_archive(tree, archive_path, entries, compression)
+            compress_time = time.monotonic() - start
+
+            shutil.rmtree(destination, ignore_errors=True)
+            start = time.monotonic()
+            extract_archive(archive_path, destination)
+            decompress_time = time.monotonic() - start
+            shutil.rmtree(destination, ignore_errors=True)
+
+            archive_size = os.path.getsize(archive_path)
+            os.unlink(archive_path)
+            print(
+                f"{str(compression):<12}{archive_size / 1024**2:>12.1f}{uncompressed_size / archive_size:>8.2f}"
+                f"{compress_time:>11.2f}s{decompress_time:>11.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
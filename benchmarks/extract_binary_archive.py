@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Compares the binary archive extraction engine with plain `tar xaf` (the previous implementation).
+
+A synthetic tree of the requested size is generated, archived with each compression format and then extracted with
+both methods. Example:
+
+    python3 benchmarks/extract_binary_archive.py --size 1G --workdir /var/tmp/orchestra-bench
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+from loguru import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from orchestra.actions.archive import extract_archive  # noqa: E402
+
+COMPRESSORS = {
+    "xz": ["xz", "-T0", "-6"],
+    "zst": ["zstd", "-T0", "-19"],
+    "gz": ["gzip", "-6"],
+}
+
+
+def parse_size(size: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+def generate_tree(root, total_size, seed=0):
+    """Generates a tree resembling an install root: many small text-like files and some large binary-like ones"""
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz_", k=rng.randint(2, 12))) for _ in range(4096)]
+    written = 0
+    index = 0
+    while written < total_size:
+        directory = os.path.join(root, f"dir{index % 97}", f"sub{index % 13}")
+        os.makedirs(directory, exist_ok=True)
+        if index % 50 == 0:
+            # Large, poorly compressible file (e.g. a shared library)
+            size = min(rng.randint(4, 32) * 1024**2, total_size - written)
+            data = rng.randbytes(size // 2) + b"\0" * (size - size // 2)
+        else:
+            size = min(rng.randint(1, 64) * 1024, total_size - written)
+            data = b" ".join(rng.choices(words, k=size // 7))[:size]
+        with open(os.path.join(directory, f"file{index}"), "wb") as f:
+            f.write(data)
+        written += len(data)
+        index += 1
+    return index
+
+
+def create_archive(tree, archive_path, compressor):
+    with open(archive_path, "wb") as out:
+        tar = subprocess.Popen(["tar", "c", "-C", tree, "."], stdout=subprocess.PIPE)
+        subprocess.run(compressor, stdin=tar.stdout, stdout=out, check=True)
+        tar.stdout.close()
+        if tar.wait() != 0:
+            raise Exception("tar failed")
+
+
+def timed(fn):
+    start = time.monotonic()
+    fn()
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1G", help="Uncompressed size of the synthetic tree (default: 1G)")
+    parser.add_argument("--workdir", default="/tmp/orchestra-extract-benchmark", help="Scratch directory")
+    parser.add_argument("--formats", default="xz,zst,gz", help="Comma separated compression formats")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs for each measurement")
+    args = parser.parse_args()
+    logger.remove()
+
+    tree = os.path.join(args.workdir, "tree")
+    destination = os.path.join(args.workdir, "extracted")
+    if not os.path.exists(tree):
+        print(f"Generating {args.size} synthetic tree in {tree}")
+        files = generate_tree(tree, parse_size(args.size))
+        print(f"Generated {files} files")
+
+    print(f"{'format':<8}{'archive size':>14}{'tar xaf':>12}{'orchestra':>12}{'speedup':>10}")
+    for archive_format in args.formats.split(","):
+        archive_path = os.path.join(args.workdir, f"archive.tar.{archive_format}")
+        if not os.path.exists(archive_path):
+            create_archive(tree, archive_path, COMPRESSORS[archive_format])
+
+        def run_tar():
+            os.makedirs(destination)
+            subprocess.run(["tar", "xaf", archive_path], cwd=destination, check=True)
+
+        def run_orchestra():
+            extract_archive(archive_path, destination)
+
+        results = {}
+        for name, fn in [("tar", run_tar), ("orchestra", run_orchestra)]:
+            timings = []
+            for _ in range(args.repeat):
+                shutil.rmtree(destination, ignore_errors=True)
+                timings.append(timed(fn))
+            results[name] = min(timings)
+        shutil.rmtree(destination, ignore_errors=True)
+
+        archive_size = os.path.getsize(archive_path) / 1024**2
+        print(
+            f"{archive_format:<8}{archive_size:>11.1f} MB"
+            f"{results['tar']:>11.2f}s{results['orchestra']:>11.2f}s"
+            f"{results['tar'] / results['orchestra']:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
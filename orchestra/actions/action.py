@@ -1,13 +1,15 @@
 import os.path
-from collections import OrderedDict
-from typing import Set
+from collections import ChainMap, OrderedDict
+from typing import List, Optional, Set
 
 from loguru import logger
 
 # Only used for type hints, package-relative import not possible due to circular reference
 import orchestra.model.configuration
+from .compiler_cache import compiler_cache_environment
 from .util import run_user_script, run_internal_script, get_script_output
 from .util import try_run_internal_script, try_get_script_output
+from .util import run_internal_subprocess, try_get_subprocess_output
 
 
 class Action:
@@ -16,6 +18,7 @@ class Action:
         self.config: "orchestra.model.configuration.Configuration" = config
         self._explicit_dependencies: Set[Action] = set()
         self._script = script
+        self._cached_environment_layers: "List[OrderedDict[str, str]]" = None
 
     def run(self, pretend=False, explicitly_requested=False):
         logger.info(f"Executing {self}")
@@ -52,10 +55,24 @@ class Action:
         """Returns true if the action is satisfied."""
         raise NotImplementedError()
 
+    def run_summary(self) -> Optional[str]:
+        """Returns a line describing the outcome of the last run, reported once all the actions are done"""
+        return None
+
     @property
-    def environment(self) -> "OrderedDict[str, str]":
-        """Returns additional environment variables provided to the script to be run"""
-        return self.config.global_env()
+    def environment(self) -> "ChainMap[str, str]":
+        """Returns the environment variables provided to the script to be run.
+        The environment is a view over layers (global -> component -> build -> action-specific) which are computed only
+        once. Modifying the returned mapping does not affect the layers.
+        """
+        if self._cached_environment_layers is None:
+            self._cached_environment_layers = self._environment_layers()
+        return ChainMap({}, *reversed(self._cached_environment_layers), self.config.global_env_layer)
+
+    def _environment_layers(self) -> "List[OrderedDict[str, str]]":
+        """Returns the layers of environment variables added on top of the global environment, from the least to the
+        most specific"""
+        return []
 
     @property
     def _target_name(self):
@@ -94,17 +111,26 @@ class Action:
     def _try_get_script_output(self, script, cwd=None):
         return try_get_script_output(script, environment=self.environment, cwd=cwd)
 
+    # The following helpers execute argv directly, without spawning bash.
+    # The action environment is *not* passed: it can only be evaluated by a shell and internal commands must not
+    # depend on the user configuration anyway, so they inherit the environment orchestra was started with.
+
+    def _run_internal_subprocess(self, argv, cwd=None):
+        run_internal_subprocess(argv, cwd=cwd)
+
+    def _try_get_subprocess_output(self, argv, cwd=None):
+        return try_get_subprocess_output(argv, cwd=cwd)
+
 
 class ActionForComponent(Action):
     def __init__(self, name, component, script, config):
         super().__init__(name, script, config)
         self.component = component
 
-    @property
-    def environment(self) -> "OrderedDict[str, str]":
-        env = super().environment
-        env["SOURCE_DIR"] = self.source_dir
-        return env
+    def _environment_layers(self) -> "List[OrderedDict[str, str]]":
+        layer = OrderedDict()
+        layer["SOURCE_DIR"] = self.source_dir
+        return super()._environment_layers() + [layer]
 
     @property
     def _target_name(self):
@@ -120,12 +146,12 @@ class ActionForBuild(ActionForComponent):
         super().__init__(name, build.component, script, config)
         self.build = build
 
-    @property
-    def environment(self) -> "OrderedDict[str, str]":
-        env = super().environment
-        env["BUILD_DIR"] = self.build_dir
-        env["TMP_ROOT"] = self.tmp_root
-        return env
+    def _environment_layers(self) -> "List[OrderedDict[str, str]]":
+        layer = OrderedDict()
+        layer["BUILD_DIR"] = self.build_dir
+        layer["TMP_ROOT"] = self.tmp_root
+        layer.update(compiler_cache_environment(self.config, self.build.component.name))
+        return super()._environment_layers() + [layer]
 
     @property
     def build_dir(self) -> str:
@@ -133,7 +159,7 @@ class ActionForBuild(ActionForComponent):
 
     @property
     def tmp_root(self) -> str:
-        return os.path.join(super().environment["TMP_ROOTS"], self.build.safe_name)
+        return os.path.join(self.config.tmproot, self.build.safe_name)
 
     @property
     def _target_name(self):
@@ -0,0 +1,218 @@
+"""Binary archives creation and extraction.
+
+Archives are created by piping tar to a multi-threaded compressor, the format and level are configurable (see
+`Compression`).
+Archives are decompressed by an external decompressor, multi-threaded when possible, whose output is piped to GNU tar.
+The manifest of the extracted files is built from tar's verbose listing while it extracts, so no directory walk is
+needed afterwards.
+"""
+import codecs
+import os
+import re
+import shutil
+import stat
+import subprocess
+import tempfile
+from typing import Iterable, List, Optional
+
+from loguru import logger
+
+from .util import run_internal_subprocess
+from ..model.manifest import Manifest, ManifestEntry, ENTRY_TYPE_DIR, ENTRY_TYPE_FILE, ENTRY_TYPE_SYMLINK
+from ..util import OrchestraException
+
+# Matches a line of `tar -x -vv --quoting-style=c` output, e.g.:
+#   lrwxrwxrwx 0/0               0 2020-01-01 00:00 "lib" -> "lib64"
+#   hrw-r--r-- 0/0               0 2020-01-01 00:00 "bin/b" link to "bin/a"
+_quoted = r'"((?:[^"\\]|\\.)*)"'
+_listing_line_regex = re.compile(
+    rf"^(?P<type>.)(?P<permissions>\S{{9}})\S*\s+\S+\s+(?P<size>\S+)\s+\S+\s+\S+\s+{_quoted}(?: (?:->|link to) {_quoted})?$"
+)
+
+
+class Compression:
+    """Compression settings for binary archives, parsed from a `<format>[:<level>]` string, e.g. `zstd:19`"""
+
+    # format -> (archive extension, default level, minimum level, maximum level)
+    formats = {
+        "xz": (".xz", 6, 0, 9),
+        "zstd": (".zst", 19, 1, 22),
+        "gzip": (".gz", 6, 1, 9),
+    }
+
+    def __init__(self, spec: str):
+        format_name, _, level = spec.partition(":")
+        if format_name not in self.formats:
+            raise OrchestraException(
+                f"Unsupported binary archives compression format {format_name}, supported: {', '.join(self.formats)}"
+            )
+        self.format = format_name
+        self.extension, default_level, min_level, max_level = self.formats[format_name]
+        self.level = int(level) if level else default_level
+        if not min_level <= self.level <= max_level:
+            raise OrchestraException(f"Compression level for {format_name} must be between {min_level} and {max_level}")
+
+    def compressor_argv(self) -> List[str]:
+        """Returns the argv of the command compressing stdin to stdout"""
+        if self.format == "xz":
+            # Multi-threaded compression produces multi-block archives, which can also be decompressed in parallel
+            return ["xz", "--threads=0", f"-{self.level}"]
+        elif self.format == "zstd":
+            ultra = ["--ultra"] if self.level > 19 else []
+            return ["zstd", "--threads=0", "--quiet", *ultra, f"-{self.level}"]
+        else:
+            return [shutil.which("pigz") or "gzip", f"-{self.level}"]
+
+    def __str__(self):
+        return f"{self.format}:{self.level}"
+
+
+DEFAULT_COMPRESSION = "xz"
+
+# Extensions of the binary archives orchestra can extract, "" is for uncompressed archives
+ARCHIVE_EXTENSIONS = [extension for extension, *_ in Compression.formats.values()] + [""]
+
+
+def create_archive(source_dir, archive_path, entries: Iterable[str], compression: Compression):
+    """Creates a tar archive of `entries` (paths relative to `source_dir`).
+    Owner and group of the archived files are set to root.
+    """
+    argv = [
+        "tar",
+        "-c",
+        "-f",
+        archive_path,
+        f"--use-compress-program={' '.join(compression.compressor_argv())}",
+        "--owner=0",
+        "--group=0",
+        "--",
+        *entries,
+    ]
+    run_internal_subprocess(argv, cwd=source_dir)
+
+
+def decompressor_argv(archive_path, archive_name=None) -> Optional[List[str]]:
+    """Returns the argv of the command decompressing `archive_path` to stdout.
+    Returns None if the archive is not compressed.
+    :param archive_name: name whose extension determines the format, defaults to `archive_path`
+    """
+    if archive_name is None:
+        archive_name = archive_path
+    if archive_name.endswith(".xz"):
+        # Multi-block archives (the ones created by `xz -T`) are decompressed in parallel, others are not penalized
+        return ["xz", "--decompress", "--stdout", "--threads=0", archive_path]
+    elif archive_name.endswith(".zst"):
+        return ["zstd", "--decompress", "--stdout", "--quiet", archive_path]
+    elif archive_name.endswith(".gz"):
+        return [shutil.which("pigz") or "gzip", "--decompress", "--stdout", archive_path]
+    elif archive_name.endswith(".tar"):
+        return None
+    raise OrchestraException(f"Unsupported binary archive format: {archive_name}")
+
+
+def extract_archive(archive_path, destination, exclude: Iterable[str] = (), archive_name=None) -> Manifest:
+    """Extracts a tar archive to `destination` and returns the manifest of the extracted entries.
+    The manifest entries do not carry digests.
+    :param archive_path: path of the archive
+    :param destination: directory where the archive will be extracted. Created if it does not exist.
+    :param exclude: paths (relative to the archive root) to skip, together with their content
+    :param archive_name: name whose extension determines the format, for archives stored under a different name (e.g.
+                         git LFS objects). Defaults to `archive_path`
+    """
+    os.makedirs(destination, exist_ok=True)
+
+    decompressor = decompressor_argv(archive_path, archive_name)
+    tar_argv = ["tar", "-x", "-vv", "--quoting-style=c", "--utc", "-C", destination, "--anchored"]
+    for excluded_path in exclude:
+        tar_argv += [f"--exclude={excluded_path}", f"--exclude=./{excluded_path}"]
+    tar_argv += ["-f", "-" if decompressor else archive_path]
+
+    # Fixed locale, so that the listing format is predictable
+    environment = dict(os.environ, LC_ALL="C")
+
+    with tempfile.TemporaryFile() as decompressor_stderr, tempfile.TemporaryFile() as tar_stderr:
+        decompressor_process = None
+        tar_stdin = None
+        if decompressor:
+            logger.debug(f"The following program is going to be executed: {decompressor}")
+            decompressor_process = subprocess.Popen(decompressor, stdout=subprocess.PIPE, stderr=decompressor_stderr)
+            tar_stdin = decompressor_process.stdout
+
+        logger.debug(f"The following program is going to be executed: {tar_argv}")
+        tar_process = subprocess.Popen(
+            tar_argv, stdin=tar_stdin, stdout=subprocess.PIPE, stderr=tar_stderr, env=environment
+        )
+        if decompressor_process:
+            # Only tar must hold the read end of the pipe, so the decompressor gets SIGPIPE if tar dies
+            decompressor_process.stdout.close()
+
+        try:
+            manifest = _parse_listing(tar_process.stdout)
+        finally:
+            tar_process.stdout.close()
+            tar_returncode = tar_process.wait()
+            decompressor_returncode = decompressor_process.wait() if decompressor_process else 0
+
+        if decompressor_returncode != 0:
+            _log_output("decompressor", decompressor_stderr)
+            raise OrchestraException(f"Decompressing {archive_path} failed with return code {decompressor_returncode}")
+        if tar_returncode != 0:
+            _log_output("tar", tar_stderr)
+            raise OrchestraException(f"Extracting {archive_path} failed with return code {tar_returncode}")
+
+    return manifest
+
+
+def _parse_listing(stream) -> Manifest:
+    entries = []
+    # path -> (size, mode) of regular files, hardlinks share them with their target
+    files = {}
+    for raw_line in stream:
+        line = raw_line.decode("utf-8", errors="surrogateescape").rstrip("\n")
+        match = _listing_line_regex.match(line)
+        if match is None:
+            raise OrchestraException(f"Could not parse tar output: {line}")
+
+        entry_type, permissions, size, path, target = match.groups()
+        path = os.path.normpath(_unquote(path))
+        if path == ".":
+            continue
+
+        if entry_type == "d":
+            entries.append(ManifestEntry(path, ENTRY_TYPE_DIR))
+        elif entry_type == "l":
+            entries.append(ManifestEntry(path, ENTRY_TYPE_SYMLINK, target=_unquote(target)))
+        elif entry_type == "h":
+            # Hardlinks have no content of their own
+            size, mode = files.get(os.path.normpath(_unquote(target)), (None, None))
+            entries.append(ManifestEntry(path, ENTRY_TYPE_FILE, size=size, mode=mode))
+        else:
+            files[path] = (int(size) if size.isdigit() else None, _parse_permissions(permissions))
+            entries.append(ManifestEntry(path, ENTRY_TYPE_FILE, size=files[path][0], mode=files[path][1]))
+
+    return Manifest(entries)
+
+
+def _parse_permissions(permissions: str) -> int:
+    """Converts permissions in `ls -l` format (e.g. `rwsr-xr-x`) to mode bits"""
+    mode = 0
+    for index, char in enumerate(permissions):
+        if char not in "-ST":
+            mode |= 0o400 >> index
+    for index, special_bit in enumerate((stat.S_ISUID, stat.S_ISGID, stat.S_ISVTX)):
+        if permissions[index * 3 + 2] in "sStT":
+            mode |= special_bit
+    return mode
+
+
+def _unquote(quoted: str) -> str:
+    """Decodes a name quoted by tar's `c` quoting style (C escape sequences, including octal bytes)"""
+    if "\\" not in quoted:
+        return quoted
+    unescaped_bytes = codecs.escape_decode(quoted.encode("utf-8", errors="surrogateescape"))[0]
+    return unescaped_bytes.decode("utf-8", errors="surrogateescape")
+
+
+def _log_output(name, output_file):
+    output_file.seek(0)
+    logger.error(f"The {name} output was: \n{output_file.read().decode('utf-8', errors='replace')}")
@@ -0,0 +1,51 @@
+"""Background creation of binary archives (`--create-binary-archives`).
+
+Compressing a binary archive can take longer than building the component, so it is kept off the critical path: once
+the temporary root is final it is snapshotted (see tmproot.snapshot_tree) and the install action goes on merging it,
+letting its dependents start, while the archive is compressed from the snapshot by a small pool of threads.
+The executor waits for the pending archives before returning.
+"""
+import threading
+from concurrent import futures
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+# Compressors are multi-threaded already, a couple of archives at a time is enough to keep the CPUs busy
+_MAX_WORKERS = 2
+
+_pool: Optional[futures.ThreadPoolExecutor] = None
+# Pending archive creations -> the action creating them
+_pending: Dict[futures.Future, object] = {}
+_lock = threading.Lock()
+
+
+def submit_archive_creation(action, function: Callable[[], None]) -> futures.Future:
+    """Runs `function`, creating the binary archive of `action`, in background"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = futures.ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix="Archiver")
+        future = _pool.submit(function)
+        _pending[future] = action
+    return future
+
+
+def wait_for_archive_creations() -> List[object]:
+    """Waits for the pending archive creations
+    :returns: the actions whose binary archive could not be created
+    """
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if pending:
+        logger.info(f"Waiting for {len(pending)} binary archives to be created")
+
+    failed = []
+    for future, action in pending.items():
+        exception = future.exception()
+        if exception is not None:
+            logger.error(f"Creating the binary archive of {action} failed")
+            logger.error(str(exception))
+            failed.append(action)
+    return failed
@@ -0,0 +1,248 @@
+"""Size-bounded LRU cache of the binary archives available locally (`binary_archives_cache_size` option).
+
+The content of a fetched binary archive is kept in the LFS object store of its repository (and, for archives checked
+out by older orchestra versions or created locally, in the worktree file). Install actions record when they last used
+each archive; when the archives available locally exceed the budget the least recently used ones are evicted: their
+LFS object is deleted and the worktree file is reset to an LFS pointer, so they can be fetched again when needed.
+Checked out archives are evicted only if the upstream branch tracks them through LFS with the same content, archives
+which were not pushed (e.g. created with --create-binary-archives) could not be fetched again.
+LFS objects which are not referenced by any pointer in the worktree nor by the checked out tree (e.g. archives removed
+by `orc update`) are evicted first. Archives downloaded from HTTP repositories are simply deleted, archives stored in directories are never
+evicted.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from loguru import logger
+
+from .binary_archives_storage import GIT_LFS, HTTP
+from ..gitutils import lfs, upstream_commit
+from ..util import OrchestraException
+
+# File in the binary archives directory recording the last use of each archive
+USAGE_FILENAME = ".last-use.json"
+
+_archive_name_regex = re.compile(r"\.tar(\.[a-z0-9]+)?$")
+_size_regex = re.compile(r"^([0-9]+)([KMGT]?)$")
+_size_units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+_usage_lock = threading.Lock()
+
+
+class CachedArchive:
+    def __init__(self, archive_path, object_path, size, last_use, downloaded=False, pushed_oid=None):
+        """
+        :param archive_path: absolute path of the archive in the worktree, None for LFS objects no pointer refers to
+        :param object_path: absolute path of the LFS object, None if the archive is only checked out in the worktree
+        :param size: bytes used on disk
+        :param last_use: timestamp of the last use
+        :param downloaded: True if the archive was downloaded from an HTTP repository, evicting it deletes it
+        :param pushed_oid: for archives checked out in the worktree, the oid tracked by the upstream branch
+        """
+        self.archive_path = archive_path
+        self.object_path = object_path
+        self.size = size
+        self.last_use = last_use
+        self.downloaded = downloaded
+        self.pushed_oid = pushed_oid
+
+    def evict(self) -> bool:
+        """Evicts the archive, returns False if it cannot be fetched again and was left untouched"""
+        if self.downloaded:
+            os.unlink(self.archive_path)
+            return True
+        if self.archive_path is not None and lfs.read_pointer(self.archive_path) is None:
+            if not _reset_to_pointer(self.archive_path, self.pushed_oid):
+                return False
+        if self.object_path is not None and os.path.exists(self.object_path):
+            os.unlink(self.object_path)
+        return True
+
+
+def parse_size(spec: str) -> int:
+    """Parses a size in bytes, optionally followed by a K, M, G or T (binary) suffix"""
+    match = _size_regex.match(spec)
+    if match is None:
+        raise OrchestraException(f"Invalid size: {spec}")
+    return int(match.group(1)) * _size_units[match.group(2)]
+
+
+def record_binary_archive_use(config, archive_path):
+    """Records that the binary archive at `archive_path` was just used"""
+    with _usage_lock:
+        usage = _load_usage(config)
+        usage[os.path.relpath(archive_path, config.binary_archives_dir)] = time.time()
+        _save_usage(config, usage)
+
+
+def cached_binary_archives(config) -> List[CachedArchive]:
+    """Returns the binary archives whose content is available locally, in all the binary archives repositories"""
+    usage = _load_usage(config)
+    cached_archives = []
+    for storage in config.binary_archives_storages.values():
+        repo_path = storage.local_path
+        if storage.type == HTTP:
+            cached_archives.extend(_downloaded_archives(config, storage, usage))
+            continue
+        if storage.type != GIT_LFS or not os.path.isdir(os.path.join(repo_path, ".git")):
+            continue
+
+        checked_out_files = lfs.ls_files(repo_path)
+        if checked_out_files is None:
+            logger.warning(f"Could not list the LFS files of binary archive {storage.name}, not evicting its archives")
+            continue
+        upstream = upstream_commit(repo_path)
+        pushed_files = (lfs.ls_files(repo_path, upstream) if upstream is not None else None) or {}
+
+        # Objects of committed (or staged) archives may not have been pushed, they are never evicted as unreferenced
+        referenced_objects = {lfs.object_path(repo_path, oid) for oid in checked_out_files.values()}
+        for archive_path in _archives_in_worktree(repo_path):
+            relative_path = os.path.relpath(archive_path, config.binary_archives_dir)
+            pointer = lfs.read_pointer(archive_path)
+            if pointer is None:
+                pushed_oid = pushed_files.get(os.path.relpath(archive_path, repo_path))
+                if pushed_oid is None:
+                    # Not available from the remote, it could not be fetched again
+                    continue
+                stat_result = os.stat(archive_path)
+                last_use = usage.get(relative_path, stat_result.st_mtime)
+                object_path = lfs.object_path(repo_path, pushed_oid)
+                cached_archives.append(
+                    CachedArchive(archive_path, object_path, stat_result.st_size, last_use, pushed_oid=pushed_oid)
+                )
+                continue
+
+            object_path = lfs.object_path(repo_path, pointer[0])
+            referenced_objects.add(object_path)
+            try:
+                stat_result = os.stat(object_path)
+            except FileNotFoundError:
+                continue
+            last_use = usage.get(relative_path, stat_result.st_mtime)
+            cached_archives.append(CachedArchive(archive_path, object_path, stat_result.st_size, last_use))
+
+        for object_path in _lfs_objects(repo_path):
+            if object_path not in referenced_objects:
+                # Never used by an install, evicted first
+                cached_archives.append(CachedArchive(None, object_path, os.stat(object_path).st_size, 0))
+    return cached_archives
+
+
+def evict_binary_archives(config, max_size: int, keep: Iterable[str] = (), pretend=False) -> Tuple[int, int]:
+    """Evicts the least recently used binary archives until the ones available locally fit in `max_size` bytes
+    :param keep: absolute paths of archives that must not be evicted (e.g. the ones needed by the current plan)
+    :param pretend: only log what would be evicted
+    :returns: the number of evicted archives and the freed bytes
+    """
+    keep = {os.path.realpath(p) for p in keep}
+    cached_archives = cached_binary_archives(config)
+    total_size = sum(a.size for a in cached_archives)
+
+    evicted = 0
+    freed = 0
+    for archive in sorted(cached_archives, key=lambda a: a.last_use):
+        if total_size - freed <= max_size:
+            break
+        if archive.archive_path is not None and os.path.realpath(archive.archive_path) in keep:
+            continue
+        logger.debug(f"Evicting {archive.archive_path or archive.object_path} ({archive.size} bytes)")
+        if not pretend and not archive.evict():
+            logger.debug(f"Not evicting {archive.archive_path}, it differs from the one pushed upstream")
+            continue
+        evicted += 1
+        freed += archive.size
+
+    if not pretend:
+        _forget_missing_archives(config)
+    return evicted, freed
+
+
+def _downloaded_archives(config, storage, usage: Dict[str, float]) -> Iterable[CachedArchive]:
+    """Returns the archives downloaded from an HTTP repository, which can be downloaded again.
+    Archives created locally (which are not listed by the index of the repository) are not included.
+    """
+    try:
+        indexed_files = storage.indexed_files()
+    except ValueError:
+        return
+    for archive_path in _archives_in_worktree(storage.local_path):
+        if os.path.relpath(archive_path, storage.local_path) not in indexed_files:
+            continue
+        stat_result = os.stat(archive_path)
+        last_use = usage.get(os.path.relpath(archive_path, config.binary_archives_dir), stat_result.st_mtime)
+        yield CachedArchive(archive_path, None, stat_result.st_size, last_use, downloaded=True)
+
+
+def _archives_in_worktree(repo_path) -> Iterable[str]:
+    for dirpath, dirnames, filenames in os.walk(repo_path):
+        if dirpath == repo_path and ".git" in dirnames:
+            dirnames.remove(".git")
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if _archive_name_regex.search(filename) and not os.path.islink(path):
+                yield path
+
+
+def _lfs_objects(repo_path) -> Iterable[str]:
+    objects_dir = os.path.join(repo_path, ".git", "lfs", "objects")
+    for dirpath, dirnames, filenames in os.walk(objects_dir):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+
+def _reset_to_pointer(archive_path, expected_oid) -> bool:
+    """Replaces a checked out archive with its LFS pointer, unless its content does not match `expected_oid`
+    :returns: True if the archive was replaced
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(archive_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    if digest.hexdigest() != expected_oid:
+        return False
+    pointer = f"{lfs.POINTER_VERSION_LINE.decode()}\noid sha256:{digest.hexdigest()}\nsize {size}\n"
+    tmp_path = f"{archive_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(pointer)
+    os.chmod(tmp_path, os.stat(archive_path).st_mode)
+    os.replace(tmp_path, archive_path)
+    return True
+
+
+def _usage_path(config) -> str:
+    return os.path.join(config.binary_archives_dir, USAGE_FILENAME)
+
+
+def _load_usage(config) -> Dict[str, float]:
+    try:
+        with open(_usage_path(config)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.warning(f"Could not load the binary archives usage: {e}")
+        return {}
+
+
+def _save_usage(config, usage: Dict[str, float]):
+    os.makedirs(config.binary_archives_dir, exist_ok=True)
+    path = _usage_path(config)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(usage, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _forget_missing_archives(config):
+    with _usage_lock:
+        usage = _load_usage(config)
+        existing = {p: t for p, t in usage.items() if os.path.exists(os.path.join(config.binary_archives_dir, p))}
+        if len(existing) != len(usage):
+            _save_usage(config, existing)
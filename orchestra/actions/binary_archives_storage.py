@@ -0,0 +1,295 @@
+"""Storage backends of the binary archives repositories (`binary_archives_storage` configuration option).
+
+Every backend uses the same layout, `<architecture>/<component>/<build>/<commit>_<recursive hash>.tar.<ext>` (plus the
+manifest next to each archive), and exposes the archives it stores through a local directory with that layout:
+
+- `git-lfs` (default): a git repository whose archives are tracked by git LFS, cloned into the binary archives
+  directory. `orc update` pulls it, archives are fetched into the LFS object store.
+- `directory`: a local or network-mounted (e.g. NFS) directory, used in place. Nothing needs to be updated or fetched.
+- `http`: a static HTTP server exposing the layout, with an `index.json` at its root listing the files it serves.
+  `orc update` only downloads the index, archives are downloaded to the binary archives directory when needed.
+  `orc binary-archives write-index` generates the index for a directory to be published.
+"""
+import json
+import os
+import socket
+import threading
+import urllib.parse
+import urllib.request
+from typing import Iterable, List, Optional, Set
+
+from loguru import logger
+
+from .util import run_internal_subprocess, try_run_internal_subprocess
+from ..gitutils import is_root_of_git_repo
+from ..gitutils import lfs
+from ..model.manifest import manifest_path_for_archive
+from ..util import OrchestraException
+
+GIT_LFS = "git-lfs"
+DIRECTORY = "directory"
+HTTP = "http"
+STORAGE_TYPES = (GIT_LFS, DIRECTORY, HTTP)
+
+# Index listing the files served by a static HTTP binary archives repository
+INDEX_FILENAME = "index.json"
+
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds without an answer from an HTTP binary archives repository after which a download fails
+_DOWNLOAD_TIMEOUT = 60
+
+
+class BinaryArchivesStorage:
+    """Base class of the binary archives storage backends"""
+
+    type: str
+
+    # True if the archives are copies kept in the binary archives directory, which can be evicted (see
+    # actions/binary_archives_cache.py)
+    caches_locally = True
+
+    def __init__(self, name, url, config):
+        self.name = name
+        self.url = url
+        self.config = config
+
+    @property
+    def local_path(self) -> str:
+        """Returns the path of the local directory where the archives are available (or fetched), with the common
+        layout. New archives are created in this directory too.
+        """
+        return os.path.join(self.config.binary_archives_dir, self.name)
+
+    def update(self) -> bool:
+        """Refreshes the list of the archives available from the storage (run by `orc update`).
+        Returns a boolean value representing the operation success.
+        """
+        raise NotImplementedError()
+
+    def list_files(self) -> Set[str]:
+        """Returns the paths of the files the storage provides (relative to `local_path`), fetched or not"""
+        raise NotImplementedError()
+
+    def content_path(self, relative_path) -> Optional[str]:
+        """Returns the path of a local file holding the content of the file at `relative_path`, None if it needs to be
+        fetched first
+        """
+        path = os.path.join(self.local_path, relative_path)
+        return path if os.path.isfile(path) else None
+
+    def fetch(self, relative_paths: List[str]):
+        """Makes the content of the given files available locally, raises an exception on failure"""
+        raise NotImplementedError()
+
+    def fetch_manifest(self, relative_path) -> Optional[str]:
+        """Returns the path of a local file holding the manifest of the archive at `relative_path`, fetching only the
+        manifest if needed. Returns None if the archive has no manifest or it cannot be fetched.
+        """
+        return self.content_path(manifest_path_for_archive(relative_path))
+
+
+class GitLfsStorage(BinaryArchivesStorage):
+    type = GIT_LFS
+
+    def update(self) -> bool:
+        if os.path.exists(self.local_path):
+            logger.debug(f"Pulling binary archive {self.name}")
+            return self._pull()
+        else:
+            logger.info(f"Trying to clone binary archive from remote {self.name} ({self.url})")
+            return self._clone()
+
+    def list_files(self) -> Set[str]:
+        return scan_files(self.local_path)
+
+    def content_path(self, relative_path) -> Optional[str]:
+        return lfs.resolve(os.path.join(self.local_path, relative_path))
+
+    def fetch(self, relative_paths: List[str]):
+        lfs.fetch(self.local_path, checkout=False, include=relative_paths)
+        not_in_object_store = [p for p in relative_paths if self.content_path(p) is None]
+        if not_in_object_store:
+            # The LFS objects are not stored in the default location (e.g. lfs.storage is set)
+            lfs.checkout_files(self.local_path, include=not_in_object_store)
+
+    def _clone(self) -> bool:
+        env = os.environ.copy()
+        env["GIT_SSH_COMMAND"] = "ssh -oControlPath=~/.ssh/ssh-mux-%r@%h:%p -oControlMaster=auto -o ControlPersist=10"
+        env["GIT_LFS_SKIP_SMUDGE"] = "1"
+        returncode = try_run_internal_subprocess(
+            ["git", "clone", self.url, self.local_path],
+            environment=env,
+        )
+        return returncode == 0
+
+    def _pull(self) -> bool:
+        # This check is to ensure we are called with the path of an existing binary archive
+        # and don't clean/reset orchestra configuration
+        if not is_root_of_git_repo(self.local_path):
+            raise Exception(f"{self.local_path} is not the root of a git repo, aborting")
+        env = os.environ.copy()
+        env["GIT_LFS_SKIP_SMUDGE"] = "1"
+        # clean removes untracked files
+        run_internal_subprocess(["git", "clean", "-d", "--force"], cwd=self.local_path)
+        # reset restores tracked files to their committed version
+        run_internal_subprocess(["git", "reset", "--hard", "origin/master"], cwd=self.local_path, environment=env)
+        returncode = try_run_internal_subprocess(["git", "pull", "--ff-only"], environment=env, cwd=self.local_path)
+        return returncode == 0
+
+
+class DirectoryStorage(BinaryArchivesStorage):
+    """Archives stored in a (possibly network-mounted) directory, given as a path or a file:// URL"""
+
+    type = DIRECTORY
+    caches_locally = False
+
+    @property
+    def local_path(self) -> str:
+        parsed_url = urllib.parse.urlparse(self.url)
+        path = urllib.parse.unquote(parsed_url.path) if parsed_url.scheme == "file" else self.url
+        return os.path.expanduser(path)
+
+    def update(self) -> bool:
+        if not os.path.isdir(self.local_path):
+            logger.warning(f"Binary archives directory {self.local_path} does not exist")
+            return False
+        return True
+
+    def list_files(self) -> Set[str]:
+        return scan_files(self.local_path)
+
+    def fetch(self, relative_paths: List[str]):
+        missing = [p for p in relative_paths if self.content_path(p) is None]
+        if missing:
+            raise OrchestraException(f"Binary archives not found in {self.local_path}: {', '.join(missing)}")
+
+
+class HttpStorage(BinaryArchivesStorage):
+    """Archives served by a static HTTP server, listed by the `index.json` at its root"""
+
+    type = HTTP
+
+    @property
+    def index_path(self) -> str:
+        """Returns the path of the local copy of the index"""
+        return os.path.join(self.local_path, INDEX_FILENAME)
+
+    def update(self) -> bool:
+        logger.debug(f"Downloading the index of binary archive {self.name}")
+        try:
+            self._download(INDEX_FILENAME)
+            load_index(self.index_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not download the index of binary archive {self.name} ({self.url}): {e}")
+            return False
+        return True
+
+    def list_files(self) -> Set[str]:
+        """Returns the files listed by the index, and the ones available locally (e.g. archives created locally)"""
+        files = scan_files(self.local_path)
+        files.discard(INDEX_FILENAME)
+        try:
+            files.update(self.indexed_files())
+        except ValueError as e:
+            logger.warning(f"Ignoring invalid index of binary archive {self.name}: {e}")
+        return files
+
+    def indexed_files(self) -> Set[str]:
+        """Returns the files listed by the local copy of the index, empty if it was not downloaded"""
+        if not os.path.exists(self.index_path):
+            return set()
+        return set(load_index(self.index_path))
+
+    def fetch(self, relative_paths: List[str]):
+        indexed_files = self.indexed_files()
+        for relative_path in relative_paths:
+            to_download = [relative_path]
+            manifest_relative_path = manifest_path_for_archive(relative_path)
+            if manifest_relative_path in indexed_files:
+                to_download.append(manifest_relative_path)
+            for path in to_download:
+                if self.content_path(path) is not None:
+                    continue
+                logger.debug(f"Downloading {path} from binary archive {self.name}")
+                try:
+                    self._download(path)
+                except OSError as e:
+                    raise OrchestraException(f"Could not download {path} from {self.url}: {e}")
+
+    def fetch_manifest(self, relative_path) -> Optional[str]:
+        manifest_relative_path = manifest_path_for_archive(relative_path)
+        manifest_path = self.content_path(manifest_relative_path)
+        if manifest_path is not None or manifest_relative_path not in self.indexed_files():
+            return manifest_path
+        logger.debug(f"Downloading {manifest_relative_path} from binary archive {self.name}")
+        try:
+            self._download(manifest_relative_path)
+        except OSError as e:
+            logger.warning(f"Could not download {manifest_relative_path} from {self.url}: {e}")
+            return None
+        return self.content_path(manifest_relative_path)
+
+    def _download(self, relative_path):
+        url = f"{self.url.rstrip('/')}/{urllib.parse.quote(relative_path)}"
+        destination = os.path.join(self.local_path, relative_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Install actions and the prefetch pool may download the same file concurrently
+        tmp_destination = f"{destination}.{os.getpid()}.{threading.get_ident()}.download"
+        try:
+            with urllib.request.urlopen(url, timeout=_DOWNLOAD_TIMEOUT) as response, open(tmp_destination, "wb") as f:
+                for chunk in iter(lambda: response.read(_DOWNLOAD_CHUNK_SIZE), b""):
+                    f.write(chunk)
+            os.replace(tmp_destination, destination)
+        except socket.timeout:
+            # Reported like the other download errors by the callers
+            raise OSError(f"no answer from {url} within {_DOWNLOAD_TIMEOUT} seconds")
+        finally:
+            if os.path.exists(tmp_destination):
+                os.unlink(tmp_destination)
+
+
+_storage_classes = {cls.type: cls for cls in (GitLfsStorage, DirectoryStorage, HttpStorage)}
+
+
+def create_storage(name, url, storage_type, config) -> BinaryArchivesStorage:
+    if storage_type not in _storage_classes:
+        raise OrchestraException(f"Unknown storage type {storage_type} for binary archive {name}")
+    return _storage_classes[storage_type](name, url, config)
+
+
+def scan_files(root) -> Set[str]:
+    """Returns the paths of the files (and of the symlinks to existing files) in `root`, .git excluded"""
+    files = set()
+    if not os.path.isdir(root):
+        return files
+
+    pending_dirs = [("", root)]
+    while pending_dirs:
+        relative_dir_path, dir_path = pending_dirs.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                relative_path = os.path.join(relative_dir_path, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if relative_path != ".git":
+                        pending_dirs.append((relative_path, entry.path))
+                elif entry.is_file():
+                    files.add(relative_path)
+    return files
+
+
+def load_index(index_path) -> List[str]:
+    """Returns the files listed by an index, raises ValueError if it is not valid"""
+    with open(index_path) as f:
+        index = json.load(f)
+    if not isinstance(index, dict) or not isinstance(index.get("files"), list):
+        raise ValueError(f"{index_path} is not a binary archives index")
+    return index["files"]
+
+
+def write_index(root, files: Iterable[str]):
+    """Writes the index listing `files` (relative to `root`) to `root`/index.json"""
+    index_path = os.path.join(root, INDEX_FILENAME)
+    tmp_index_path = f"{index_path}.tmp"
+    with open(tmp_index_path, "w") as f:
+        json.dump({"files": sorted(files)}, f, indent=1)
+    os.replace(tmp_index_path, index_path)
@@ -0,0 +1,171 @@
+"""Bundles of installed components, to bootstrap a fresh orchestra root at once (`orc bundle`).
+
+A bundle is a compressed tar archive of the files installed by the solved dependency closure of some components,
+metadata (`share/orchestra/*.json`, `*.idx`, ...) included, so that installing it does not require running any
+action. Its first member is an index describing the bundled components, which can be read without decompressing the
+rest of the bundle.
+Bundles are installed into an empty root with a single streaming extraction (decompressed by a multi-threaded
+decompressor when possible).
+"""
+import json
+import os
+import subprocess
+import tarfile
+import tempfile
+from typing import Iterable
+
+from loguru import logger
+
+from .archive import Compression, decompressor_argv, extract_archive
+from .path_shim import update_path_shim
+from .tmproot import SKELETON_FILES
+from .util import run_internal_subprocess
+from ..model.install_metadata import is_installed, load_file_list
+from ..util import OrchestraException
+from ..version import __version__
+
+# Name of the bundle index, the first member of the archive
+BUNDLE_INDEX_FILENAME = ".orchestra-bundle.json"
+BUNDLE_FORMAT_VERSION = 1
+
+DEFAULT_BUNDLE_COMPRESSION = "zstd"
+
+
+def create_bundle(config, install_actions: Iterable, bundle_path, compression: Compression) -> dict:
+    """Creates a bundle of the components installed by `install_actions`, which must be installed in the root.
+    :param install_actions: the install actions of the solved dependency closure
+    :returns: the bundle index
+    """
+    install_actions = list(install_actions)
+    expected_suffix = f".tar{compression.extension}"
+    if not bundle_path.endswith(expected_suffix):
+        raise OrchestraException(f"The name of a {compression.format} bundle must end with {expected_suffix}")
+
+    not_installed = [
+        action.build.qualified_name
+        for action in install_actions
+        if not is_installed(
+            config,
+            action.component.name,
+            wanted_build=action.build.name,
+            wanted_recursive_hash=action.component.recursive_hash,
+        )
+    ]
+    if not_installed:
+        raise OrchestraException(
+            f"The following builds are not installed (or are outdated), run `orc install` first: "
+            f"{', '.join(sorted(not_installed))}"
+        )
+
+    orchestra_root = config.orchestra_root
+    paths = {f for f in SKELETON_FILES if os.path.lexists(os.path.join(orchestra_root, f))}
+    components = []
+    for action in install_actions:
+        # The file list includes the metadata files
+        file_list = (p.strip().lstrip("/") for p in load_file_list(action.component.name, config))
+        paths.update(p for p in file_list if p)
+        components.append(
+            {
+                "component": action.component.name,
+                "build": action.build.name,
+                "recursive_hash": action.component.recursive_hash,
+            }
+        )
+
+    # File lists do not always include the directories, archive them so their permissions are preserved
+    for path in list(paths):
+        parent = os.path.dirname(path)
+        while parent and parent not in paths:
+            paths.add(parent)
+            parent = os.path.dirname(parent)
+
+    index = {
+        "version": BUNDLE_FORMAT_VERSION,
+        "orchestra_version": __version__,
+        "components": components,
+        "files": len(paths),
+    }
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        with open(os.path.join(index_dir, BUNDLE_INDEX_FILENAME), "w") as f:
+            json.dump(index, f, indent=1)
+        file_list_path = os.path.join(index_dir, "files")
+        with open(file_list_path, "wb") as f:
+            # Sorted, so directories come before their content
+            for path in sorted(paths):
+                f.write(os.fsencode(path) + b"\0")
+
+        argv = [
+            "tar",
+            "-c",
+            "-f",
+            os.path.abspath(bundle_path),
+            f"--use-compress-program={' '.join(compression.compressor_argv())}",
+            "--owner=0",
+            "--group=0",
+            "-C",
+            index_dir,
+            BUNDLE_INDEX_FILENAME,
+            "-C",
+            orchestra_root,
+            "--no-recursion",
+            "--null",
+            f"--files-from={file_list_path}",
+        ]
+        run_internal_subprocess(argv)
+
+    return index
+
+
+def read_bundle_index(bundle_path) -> dict:
+    """Reads the index of a bundle, only decompressing its beginning"""
+    decompressor = decompressor_argv(bundle_path)
+    if decompressor is None:
+        with tarfile.open(bundle_path, mode="r:") as tar:
+            return _read_index_member(tar, bundle_path)
+
+    process = subprocess.Popen(decompressor, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+            return _read_index_member(tar, bundle_path)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def install_bundle(config, bundle_path) -> dict:
+    """Installs a bundle into the orchestra root, which must not contain any installed component
+    :returns: the bundle index
+    """
+    index = read_bundle_index(bundle_path)
+    if index.get("version") != BUNDLE_FORMAT_VERSION:
+        raise OrchestraException(f"Unsupported bundle format version {index.get('version')} ({bundle_path})")
+
+    metadata_dir = config.installed_component_metadata_dir
+    if os.path.isdir(metadata_dir) and any(n.endswith(".json") for n in os.listdir(metadata_dir)):
+        raise OrchestraException(
+            f"Bundles can only be installed into an empty root, {config.orchestra_root} already contains components"
+        )
+
+    logger.debug(f"Extracting {index['files']} files")
+    manifest = extract_archive(bundle_path, config.orchestra_root, exclude=[BUNDLE_INDEX_FILENAME])
+
+    missing = [c["component"] for c in index["components"] if not is_installed(config, c["component"])]
+    if missing:
+        raise OrchestraException(f"The bundle does not contain the metadata of {', '.join(missing)}")
+
+    if config.compact_path:
+        update_path_shim(config, (os.path.join(config.orchestra_root, e.path) for e in manifest.entries))
+
+    return index
+
+
+def _read_index_member(tar: tarfile.TarFile, bundle_path) -> dict:
+    member = tar.next()
+    if member is None or os.path.normpath(member.name) != BUNDLE_INDEX_FILENAME:
+        raise OrchestraException(f"{bundle_path} is not an orchestra bundle")
+    try:
+        return json.load(tar.extractfile(member))
+    except ValueError as e:
+        raise OrchestraException(f"Invalid bundle index in {bundle_path}: {e}")
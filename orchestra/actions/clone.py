@@ -8,6 +8,8 @@ class CloneAction(ActionForComponent):
     def __init__(self, component, repository, config):
         super().__init__("clone", component, None, config)
         self.repository = repository
+        # (HEAD fingerprint, branch info) of the local clone, see branch()
+        self._cached_local_branch = None
 
     @property
     def script(self):
@@ -29,16 +31,15 @@ class CloneAction(ActionForComponent):
         return script
 
     def is_satisfied(self):
-        return os.path.exists(self.environment["SOURCE_DIR"])
+        return os.path.exists(self.source_dir)
 
     def heads(self):
         """Returns a dictionary of branch names -> commit hash.
         This information is retrieved either from the local clone
         or from the first remote where the repository exists"""
         # Give priority to the local checkout
-        source_dir = self.environment["SOURCE_DIR"]
-        if os.path.exists(source_dir):
-            return gitutils.ls_remote(source_dir)
+        if os.path.exists(self.source_dir):
+            return gitutils.ls_remote(self.source_dir)
 
         return self.config.remote_heads_cache.heads(self.component)
 
@@ -47,9 +48,14 @@ class CloneAction(ActionForComponent):
         If a local clone exists the information regards the currently checked out branch,
         otherwise it is taken from the configured remotes.
         """
-        source_dir = self.environment["SOURCE_DIR"]
-        if gitutils.is_root_of_git_repo(source_dir):
-            return gitutils.current_branch_info(source_dir)
+        if gitutils.is_root_of_git_repo(self.source_dir):
+            # Binary archive lookups need the commit for each build, avoid invoking git until HEAD changes
+            fingerprint = gitutils.head_fingerprint(self.source_dir)
+            if fingerprint is None:
+                return gitutils.current_branch_info(self.source_dir)
+            if self._cached_local_branch is None or self._cached_local_branch[0] != fingerprint:
+                self._cached_local_branch = (fingerprint, gitutils.current_branch_info(self.source_dir))
+            return self._cached_local_branch[1]
 
         branches = self.heads()
         if branches:
@@ -0,0 +1,224 @@
+"""Compiler cache integration (`compiler_cache` configuration option).
+
+Builds run with a directory of wrappers prepended to PATH, named after the common compilers: for ccache they are
+symlinks to ccache (which then looks up the real compiler in PATH, skipping itself), for sccache they are small scripts
+invoking `sccache <real compiler>`. The cache is either shared by all the components or kept separately for each
+component, and its size is bounded by `max_size`.
+
+Hits and misses are counted for each install: ccache appends the result of every compilation to a stats log, while a
+dedicated sccache server is started for each install and queried once the install script is done.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from loguru import logger
+
+CCACHE = "ccache"
+SCCACHE = "sccache"
+COMPILER_CACHE_TOOLS = (CCACHE, SCCACHE)
+
+# Compilers replaced by wrappers
+WRAPPED_COMPILERS = ("cc", "c++", "gcc", "g++", "clang", "clang++")
+
+WRAPPERS_DIRNAME = "wrappers"
+SHARED_CACHE_DIRNAME = "shared"
+
+_SCCACHE_WRAPPER_TEMPLATE = """#!/bin/sh
+# Generated by orchestra, invokes the first {compiler} found in PATH (except this one) through sccache
+REAL_PATH=""
+IFS=:
+for DIR in $PATH; do
+  [ "$DIR" = "{wrappers_dir}" ] || REAL_PATH="${{REAL_PATH:+$REAL_PATH:}}$DIR"
+done
+unset IFS
+COMPILER="$(PATH="$REAL_PATH" command -v {compiler})" || exit 127
+exec "{sccache}" "$COMPILER" "$@"
+"""
+
+_ccache_hit_regex = re.compile(r"cache[_ ]hit")
+_ccache_miss_regex = re.compile(r"cache[_ ]miss")
+
+_wrappers_lock = threading.Lock()
+_missing_tool_reported = False
+
+
+class CompilerCacheStats:
+    def __init__(self, tool, hits=0, misses=0):
+        self.tool = tool
+        self.hits = hits
+        self.misses = misses
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def serialize(self):
+        return {"tool": self.tool, "hits": self.hits, "misses": self.misses}
+
+    def __str__(self):
+        hit_rate = self.hit_rate
+        hit_rate_str = f" ({hit_rate:.0%} hit rate)" if hit_rate is not None else ""
+        return f"{self.hits} hits, {self.misses} misses{hit_rate_str}"
+
+
+def compiler_cache_environment(config, component_name) -> "OrderedDict[str, str]":
+    """Returns the environment variables enabling the compiler cache for the builds of a component, empty if the
+    compiler cache is disabled or not available
+    """
+    env = OrderedDict()
+    tool = _tool(config)
+    if tool is None:
+        return env
+
+    options = config.compiler_cache
+    if options.get("per_component", False):
+        cache_dir = os.path.join(config.compiler_cache_dir, component_name.replace("/", "_"))
+    else:
+        cache_dir = os.path.join(config.compiler_cache_dir, SHARED_CACHE_DIRNAME)
+    max_size = options.get("max_size")
+
+    env["PATH"] = f"{_ensure_wrappers(config, tool)}:{config.global_env_layer['PATH']}"
+    if tool == CCACHE:
+        env["CCACHE_DIR"] = cache_dir
+        if max_size:
+            env["CCACHE_MAXSIZE"] = max_size
+    else:
+        env["SCCACHE_DIR"] = cache_dir
+        if max_size:
+            env["SCCACHE_CACHE_SIZE"] = max_size
+        env["RUSTC_WRAPPER"] = shutil.which(SCCACHE)
+    return env
+
+
+def install_environment(config, tmp_root) -> "OrderedDict[str, str]":
+    """Returns the environment variables to collect the statistics of an install using `tmp_root`"""
+    env = OrderedDict()
+    tool = _tool(config)
+    if tool == CCACHE:
+        env["CCACHE_STATSLOG"] = _ccache_stats_log_path(tmp_root)
+    elif tool == SCCACHE:
+        env["SCCACHE_SERVER_UDS"] = _sccache_socket_path(tmp_root)
+    return env
+
+
+def collect_stats(config, tmp_root) -> Optional[CompilerCacheStats]:
+    """Returns the statistics of the install using `tmp_root` which just completed, None if not available.
+    The sccache server dedicated to the install is stopped.
+    """
+    tool = _tool(config)
+    if tool == CCACHE:
+        return _ccache_stats(_ccache_stats_log_path(tmp_root))
+    elif tool == SCCACHE:
+        return _sccache_stats(_sccache_socket_path(tmp_root))
+    return None
+
+
+def parse_ccache_stats_log(content: str) -> CompilerCacheStats:
+    """Counts the hits and misses in a ccache stats log (CCACHE_STATSLOG).
+    Each compilation is a `# <source>` line followed by the statistics counters it incremented.
+    """
+    stats = CompilerCacheStats(CCACHE)
+    for invocation in re.split(r"^#.*$", content, flags=re.MULTILINE):
+        if _ccache_hit_regex.search(invocation):
+            stats.hits += 1
+        elif _ccache_miss_regex.search(invocation):
+            stats.misses += 1
+    return stats
+
+
+def parse_sccache_stats(serialized_stats: dict) -> CompilerCacheStats:
+    """Extracts the hits and misses from the output of `sccache --show-stats --stats-format=json`"""
+    stats = serialized_stats.get("stats", {})
+    return CompilerCacheStats(
+        SCCACHE,
+        hits=sum(stats.get("cache_hits", {}).get("counts", {}).values()),
+        misses=sum(stats.get("cache_misses", {}).get("counts", {}).values()),
+    )
+
+
+def _tool(config) -> Optional[str]:
+    global _missing_tool_reported
+    if not config.compiler_cache:
+        return None
+    tool = config.compiler_cache["tool"]
+    if shutil.which(tool) is None:
+        if not _missing_tool_reported:
+            logger.warning(f"Compiler cache {tool} not found in PATH, building without it")
+            _missing_tool_reported = True
+        return None
+    return tool
+
+
+def _ensure_wrappers(config, tool) -> str:
+    """Creates the directory of compiler wrappers for `tool`, returns its path"""
+    wrappers_dir = os.path.join(config.compiler_cache_dir, WRAPPERS_DIRNAME, tool)
+    tool_path = shutil.which(tool)
+    with _wrappers_lock:
+        os.makedirs(wrappers_dir, exist_ok=True)
+        for compiler in WRAPPED_COMPILERS:
+            wrapper_path = os.path.join(wrappers_dir, compiler)
+            if tool == CCACHE:
+                if os.path.islink(wrapper_path) and os.readlink(wrapper_path) == tool_path:
+                    continue
+                temporary_path = f"{wrapper_path}.tmp"
+                if os.path.lexists(temporary_path):
+                    os.unlink(temporary_path)
+                os.symlink(tool_path, temporary_path)
+            else:
+                content = _SCCACHE_WRAPPER_TEMPLATE.format(
+                    compiler=compiler, wrappers_dir=wrappers_dir, sccache=tool_path
+                )
+                if os.path.isfile(wrapper_path) and not os.path.islink(wrapper_path):
+                    with open(wrapper_path) as f:
+                        if f.read() == content:
+                            continue
+                temporary_path = f"{wrapper_path}.tmp"
+                with open(temporary_path, "w") as f:
+                    f.write(content)
+                os.chmod(temporary_path, 0o755)
+            os.replace(temporary_path, wrapper_path)
+    return wrappers_dir
+
+
+def _ccache_stats_log_path(tmp_root) -> str:
+    return os.path.join(tmp_root, ".compiler-cache-stats")
+
+
+def _sccache_socket_path(tmp_root) -> str:
+    # Unix socket paths are limited to ~100 characters, tmp_root may be longer
+    name = hashlib.sha1(tmp_root.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"orchestra-sccache-{name}.sock")
+
+
+def _ccache_stats(stats_log_path) -> CompilerCacheStats:
+    if not os.path.exists(stats_log_path):
+        return CompilerCacheStats(CCACHE)
+    with open(stats_log_path, errors="replace") as f:
+        return parse_ccache_stats_log(f.read())
+
+
+def _sccache_stats(socket_path) -> Optional[CompilerCacheStats]:
+    if not os.path.exists(socket_path):
+        # The server is started on the first compilation
+        return CompilerCacheStats(SCCACHE)
+
+    env = dict(os.environ, SCCACHE_SERVER_UDS=socket_path)
+    try:
+        result = subprocess.run(
+            [SCCACHE, "--show-stats", "--stats-format=json"], env=env, stdout=subprocess.PIPE, check=True
+        )
+        return parse_sccache_stats(json.loads(result.stdout))
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.warning(f"Could not get sccache statistics: {e}")
+        return None
+    finally:
+        subprocess.run([SCCACHE, "--stop-server"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -1,5 +1,7 @@
+import json
 import os
 from pathlib import Path
+from typing import Dict, Optional
 
 from loguru import logger
 
@@ -11,12 +13,46 @@ class ConfigureAction(ActionForBuild):
         super().__init__("configure", build, script, config)
 
     def is_satisfied(self):
-        # TODO: invalidate configure if self_hash (or even recursive_hash?) has changed
-        return os.path.exists(self._configure_successful_path)
+        return self.invalidation_reason() is None
+
+    def invalidation_reason(self) -> Optional[str]:
+        """Returns why the configure script needs to be run, or None if the build directory was configured with the
+        current build configuration, dependencies and source commit
+        """
+        if not self._configure_successful_path.exists():
+            return "the build was never configured successfully"
+
+        try:
+            with open(self._configure_successful_path) as f:
+                recorded_inputs = json.load(f)
+        except ValueError:
+            # Empty markers were written by older orchestra versions
+            return "the inputs of the previous configure were not recorded"
+
+        current_inputs = self._inputs()
+        if recorded_inputs.get("build_hash") != current_inputs["build_hash"]:
+            return "the build configuration changed"
+        if recorded_inputs.get("commit") != current_inputs["commit"]:
+            return f"the source commit changed from {recorded_inputs.get('commit')} to {current_inputs['commit']}"
+
+        recorded_dependencies = recorded_inputs.get("dependencies", {})
+        current_dependencies = current_inputs["dependencies"]
+        for name in sorted(set(recorded_dependencies) | set(current_dependencies)):
+            if name not in recorded_dependencies:
+                return f"dependency {name} was added"
+            if name not in current_dependencies:
+                return f"dependency {name} was removed"
+            if recorded_dependencies[name] != current_dependencies[name]:
+                return f"dependency {name} changed"
+        return None
 
     def _run(self, explicitly_requested=False):
         if self._configure_successful_path.exists():
-            logger.warning("This component was already successfully configured, rerunning configure script")
+            reason = self.invalidation_reason()
+            if reason is None:
+                logger.warning("This component was already successfully configured, rerunning configure script")
+            else:
+                logger.info(f"Rerunning configure script: {reason}")
             os.remove(self._configure_successful_path)
         elif os.path.exists(self.environment["BUILD_DIR"]):
             logger.warning("Previous configure probably failed, running configure script in a dirty environment")
@@ -27,10 +63,31 @@ class ConfigureAction(ActionForBuild):
         self._run_user_script(self.script)
 
         if self._configure_successful_path.parent.exists():
-            self._configure_successful_path.touch()
+            with open(self._configure_successful_path, "w") as f:
+                json.dump(self._inputs(), f)
         else:
             raise Exception(f"{self._configure_successful_path.parent} was not created by the configure script")
 
+    def _inputs(self) -> dict:
+        """Returns what the outcome of the configure script depends on, recorded in the marker file"""
+        return {
+            "build_hash": self.build.build_hash,
+            "commit": self.build.component.commit(),
+            "dependencies": self._dependencies_recursive_hashes(),
+        }
+
+    def _dependencies_recursive_hashes(self) -> Dict[str, str]:
+        components = {}
+        pending = list(self._explicit_dependencies)
+        while pending:
+            dependency = pending.pop()
+            if hasattr(dependency, "component"):
+                components[dependency.component.name] = dependency.component
+            else:
+                # AnyOfAction, all the alternatives are builds of the same component
+                pending.extend(dependency.actions)
+        return {name: component.recursive_hash for name, component in components.items()}
+
     @property
     def _configure_successful_path(self) -> Path:
         return Path(self.environment["BUILD_DIR"], ".configure_successful")
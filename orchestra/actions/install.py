@@ -1,20 +1,33 @@
 import glob
 import os
-import pathlib
-import stat
+import shutil
+import threading
 import time
+import uuid
 from collections import OrderedDict, defaultdict
-from textwrap import dedent
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from loguru import logger
 
 from .action import ActionForBuild
+from .archive_queue import submit_archive_creation
+from .archive import ARCHIVE_EXTENSIONS, DEFAULT_COMPRESSION, Compression, create_archive, extract_archive
+from .binary_archives_cache import record_binary_archive_use
+from .binary_archives_storage import BinaryArchivesStorage
+from .compiler_cache import CompilerCacheStats, collect_stats
+from .compiler_cache import install_environment as compiler_cache_install_environment
+from .lfs_prefetch import wait_for_prefetch
+from .merge import merge_tree
+from .object_store import ObjectStore, object_store
+from .path_shim import update_path_shim
+from .rpath import RPATH_PLACEHOLDER_PREFIX, fix_rpaths
+from .text_rewriter import asan_rules, ndebug_rules, pkgconfig_rules, rewrite_files
+from .tmproot import SKELETON_FILES, prepare_tmproot, discard_tree, snapshot_tree
+from .tmproot_scan import TmprootScan, scan_tmproot
 from .uninstall import uninstall
 from .util import run_user_script
-from ..gitutils import lfs
-from ..gitutils import get_worktree_root
 from ..model.install_metadata import (
+    load_file_list,
     load_metadata,
     init_metadata_from_build,
     save_metadata,
@@ -23,8 +36,32 @@ from ..model.install_metadata import (
     installed_component_license_path,
     installed_component_file_list_path,
     installed_component_metadata_path,
+    installed_component_manifest_path,
 )
-from ..util import OrchestraException
+from ..model.manifest import (
+    ENTRY_TYPE_DIR,
+    ENTRY_TYPE_FILE,
+    ENTRY_TYPE_SYMLINK,
+    Manifest,
+    ManifestEntry,
+    compute_missing_digests,
+    load_manifest,
+    manifest_path_for_archive,
+    save_manifest,
+)
+from ..util import OrchestraException, remove_tree
+
+
+# Paths that would be shared by multiple components, never installed
+CONFLICTING_PATHS = ["share/info", "share/locale"]
+
+# Prefix of the directories of the orchestra root where the files of the build being replaced by a direct binary
+# archive install are kept until the new build is in place
+ROLLBACK_DIRNAME_PREFIX = ".orchestra-rollback-"
+
+# Serializes the updates of the binary archive symlinks, which are also done by the threads creating binary archives in
+# background
+_binary_archive_symlinks_lock = threading.Lock()
 
 
 class InstallAction(ActionForBuild):
@@ -59,24 +96,41 @@ class InstallAction(ActionForBuild):
         self.no_merge = no_merge
         self.keep_tmproot = keep_tmproot
         self.run_tests = run_tests
+        # Compiler cache statistics of the last build from source, if the compiler cache is enabled
+        self.compiler_cache_stats: Optional[CompilerCacheStats] = None
 
     def _run(self, explicitly_requested=False):
-        tmp_root = self.environment["TMP_ROOT"]
-        orchestra_root = self.environment["ORCHESTRA_ROOT"]
-
-        logger.debug("Preparing temporary root directory")
-        self._prepare_tmproot()
+        orchestra_root = self.config.orchestra_root
+        self.compiler_cache_stats = None
 
-        pre_file_list = self._index_directory(tmp_root + orchestra_root, relative_to=tmp_root + orchestra_root)
+        previous_manifest = None if self.no_merge else self._previous_install_manifest()
 
         install_start_time = time.time()
+        # True if the files were installed in the root without going through the tmproot
+        installed_in_root = False
         if self.allow_binary_archive and self.binary_archive_exists():
-            self._install_from_binary_archive()
+            manifest = self._object_store_manifest()
+            if manifest is not None:
+                self._install_from_object_store(manifest)
+                installed_in_root = True
+            else:
+                # Differential reinstalls leave unchanged files alone, extracting everything to the root would not
+                manifest = self._direct_install_manifest() if previous_manifest is None else None
+                if manifest is not None:
+                    self._install_from_binary_archive_directly(manifest)
+                    installed_in_root = True
+                else:
+                    self._prepare_tmproot()
+                    manifest = self._install_from_binary_archive()
             source = "binary archives"
         elif self.allow_build:
-            self._build_and_install()
+            self._prepare_tmproot()
+            scan = self._build_and_install()
+            logger.debug("Indexing installed files")
+            compute_digests = self.create_binary_archive or self._keeps_installed_manifest
+            manifest = scan.to_manifest(compute_digests=compute_digests)
             if self.create_binary_archive:
-                self._create_binary_archive()
+                self._create_binary_archive(manifest)
             source = "build"
         else:
             raise OrchestraException(f"Could not find binary archive nor build: {self.build.qualified_name}")
@@ -85,22 +139,33 @@ class InstallAction(ActionForBuild):
         # Binary archive symlinks always need to be updated, not only when the binary archive is rebuilt
         self.update_binary_archive_symlink()
 
-        post_file_list = self._index_directory(tmp_root + orchestra_root, relative_to=tmp_root + orchestra_root)
-        post_file_list.append(
+        skeleton_files = set(SKELETON_FILES)
+        new_files = [f for f in manifest.file_list() if f not in skeleton_files]
+        if self._keeps_installed_manifest:
+            new_files.append(
+                os.path.relpath(installed_component_manifest_path(self.component.name, self.config), orchestra_root)
+            )
+        new_files.append(
             os.path.relpath(installed_component_file_list_path(self.component.name, self.config), orchestra_root)
         )
-        post_file_list.append(
+        new_files.append(
             os.path.relpath(installed_component_metadata_path(self.component.name, self.config), orchestra_root)
         )
-        new_files = [f for f in post_file_list if f not in pre_file_list]
 
         if not self.no_merge:
-            if is_installed(self.config, self.build.component.name):
-                logger.debug("Uninstalling previously installed build")
-                uninstall(self.build.component.name, self.config)
+            if self._keeps_installed_manifest:
+                compute_missing_digests(manifest, orchestra_root if installed_in_root else self._tmp_orchestra_root)
+
+            if previous_manifest is not None and not installed_in_root:
+                logger.debug("Replacing the files changed since the previously installed build")
+                self._differential_merge(previous_manifest, manifest)
+            elif not installed_in_root:
+                if is_installed(self.config, self.build.component.name):
+                    logger.debug("Uninstalling previously installed build")
+                    uninstall(self.build.component.name, self.config)
 
-            logger.debug("Merging installed files into orchestra root directory")
-            self._merge()
+                logger.debug("Merging installed files into orchestra root directory")
+                self._merge(manifest)
 
             self._update_metadata(
                 new_files,
@@ -108,8 +173,13 @@ class InstallAction(ActionForBuild):
                 source,
                 explicitly_requested,
             )
+            if self._keeps_installed_manifest:
+                save_manifest(manifest, installed_component_manifest_path(self.component.name, self.config))
+
+            if self.config.compact_path:
+                update_path_shim(self.config, (os.path.join(orchestra_root, f) for f in new_files))
 
-        if not self.keep_tmproot:
+        if not self.keep_tmproot and not installed_in_root:
             logger.debug("Cleaning up tmproot")
             self._cleanup_tmproot()
 
@@ -128,58 +198,209 @@ class InstallAction(ActionForBuild):
         metadata.manually_installed = metadata.manually_installed or set_manually_insalled
         metadata.install_time = install_time
         metadata.binary_archive_path = self.binary_archive_relative_path
+        stats = self.compiler_cache_stats
+        metadata.compiler_cache_stats = stats.serialize() if stats is not None else None
 
         save_metadata(metadata, self.config)
 
     def _prepare_tmproot(self):
-        script = dedent(
-            """
-            rm -rf "$TMP_ROOT"
-            mkdir -p "$TMP_ROOT"
-            mkdir -p "${TMP_ROOT}${ORCHESTRA_ROOT}/include"
-            mkdir -p "${TMP_ROOT}${ORCHESTRA_ROOT}/lib64"{,/include,/pkgconfig}
-            test -e "${TMP_ROOT}${ORCHESTRA_ROOT}/lib" || ln -s lib64 "${TMP_ROOT}${ORCHESTRA_ROOT}/lib"
-            test -L "${TMP_ROOT}${ORCHESTRA_ROOT}/lib"
-            mkdir -p "${TMP_ROOT}${ORCHESTRA_ROOT}/bin"
-            mkdir -p "${TMP_ROOT}${ORCHESTRA_ROOT}/usr/"{lib,include}
-            mkdir -p "${TMP_ROOT}${ORCHESTRA_ROOT}/share/"{info,doc,man,orchestra}
-            touch "${TMP_ROOT}${ORCHESTRA_ROOT}/share/info/dir"
-            mkdir -p "${TMP_ROOT}${ORCHESTRA_ROOT}/libexec"
-            """
-        )
-        self._run_internal_script(script)
+        logger.debug("Preparing temporary root directory")
+        prepare_tmproot(self.config, self.tmp_root)
 
-    def _install_from_binary_archive(self):
+    def _install_from_binary_archive(self) -> Manifest:
+        """Installs the binary archive to the tmproot.
+        :returns: the manifest of the installed files
+        """
         # TODO: handle nonexisting binary archives
         logger.debug("Fetching binary archive")
         self._fetch_binary_archive()
         logger.debug("Extracting binary archive")
-        self._extract_binary_archive()
+        extracted_files_manifest = self._extract_binary_archive()
 
         logger.debug("Removing conflicting files")
         self._remove_conflicting_files()
 
+        # Prefer the manifest stored next to the archive, it also contains the digests.
+        # Archives created by older orchestra versions do not have it.
+        manifest = self._stored_manifest()
+        return manifest if manifest is not None else extracted_files_manifest
+
+    def _direct_install_manifest(self) -> Optional[Manifest]:
+        """Returns the manifest of the binary archive if it can be extracted directly into the orchestra root, None if
+        it has to go through the temporary root.
+        Direct installs require the manifest stored next to the archive, so conflicts can be checked up front: the files
+        of the archive must not exist in the root, unless they belong to the previously installed build.
+        """
+        if not self.config.direct_binary_archive_install or self.no_merge or self.keep_tmproot:
+            return None
+        if self.config.object_store:
+            # The extracted files would not be added to the object store
+            return None
+
+        manifest = self._stored_manifest()
+        if manifest is None:
+            logger.debug("The binary archive has no manifest, installing through the temporary root")
+            return None
+
+        orchestra_root = self.config.orchestra_root
+        previous_files = set(self._previously_installed_files())
+        skeleton_files = set(SKELETON_FILES)
+        for entry in manifest.entries:
+            if entry.path in skeleton_files or _is_conflicting_path(entry.path):
+                continue
+            path = os.path.join(orchestra_root, entry.path)
+            if entry.type == ENTRY_TYPE_DIR:
+                conflict = os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path))
+            else:
+                conflict = os.path.lexists(path) and entry.path not in previous_files
+            if conflict:
+                logger.debug(f"{entry.path} already exists in the root, installing through the temporary root")
+                return None
+
+        return manifest
+
+    def _stored_manifest(self) -> Optional[Manifest]:
+        """Returns the manifest stored next to the binary archive, None if there is none.
+        Only the manifest is fetched, so it can be used to decide how (and whether) to fetch the archive.
+        """
+        location = self.binary_archive_location()
+        if location is None:
+            return None
+        storage, relative_path = location
+        manifest_path = storage.fetch_manifest(relative_path)
+        return load_manifest(manifest_path) if manifest_path is not None else None
+
+    def _object_store_manifest(self) -> Optional[Manifest]:
+        """Returns the manifest of the binary archive if all its files are available in the object store"""
+        if not self.config.object_store or self.no_merge or self.keep_tmproot:
+            return None
+        manifest = self._stored_manifest()
+        if manifest is None or not self._object_store().contains(manifest):
+            return None
+        return manifest
+
+    def _install_from_object_store(self, manifest: Manifest):
+        """Installs the binary archive by linking its files from the object store, without fetching nor extracting it"""
+        if is_installed(self.config, self.component.name):
+            logger.debug("Uninstalling previously installed build")
+            uninstall(self.component.name, self.config)
+
+        logger.debug("Linking files from the object store")
+        self._object_store().checkout(manifest, self.config.orchestra_root)
+
+    def _object_store(self) -> Optional[ObjectStore]:
+        store = object_store(self.config)
+        if store is not None:
+            store.register_root(self.config.orchestra_root)
+        return store
+
+    @property
+    def _keeps_installed_manifest(self) -> bool:
+        """Returns True if the manifest of the installed files (with digests) must be saved in the root"""
+        return self.config.differential_reinstall or self.config.object_store
+
+    def _install_from_binary_archive_directly(self, manifest: Manifest):
+        """Extracts the binary archive directly into the orchestra root, replacing the previously installed build.
+        The files of the previous build are moved aside first and restored if the extraction fails.
+        """
+        logger.debug("Fetching binary archive")
+        self._fetch_binary_archive()
+
+        orchestra_root = self.config.orchestra_root
+        rollback_dir = os.path.join(orchestra_root, f"{ROLLBACK_DIRNAME_PREFIX}{uuid.uuid4().hex}")
+        logger.debug("Moving previously installed files aside")
+        moved_files = _move_files(self._previously_installed_files(), orchestra_root, rollback_dir)
+
+        # Skeleton entries are already in place, except in a brand new root
+        exclude = CONFLICTING_PATHS + [f for f in SKELETON_FILES if os.path.lexists(os.path.join(orchestra_root, f))]
+        new_dirs = [
+            e.path
+            for e in manifest.entries
+            if e.type == ENTRY_TYPE_DIR and not os.path.lexists(os.path.join(orchestra_root, e.path))
+        ]
+
+        logger.debug("Extracting binary archive into the orchestra root")
+        try:
+            extract_archive(
+                self._binary_archive_content_path(),
+                orchestra_root,
+                exclude=exclude,
+                archive_name=self.locate_binary_archive(),
+            )
+        except BaseException:
+            # Including KeyboardInterrupt, the root must not be left half-installed
+            logger.error("Extracting the binary archive failed, restoring the previously installed files")
+            excluded = set(exclude)
+            for entry in manifest.entries:
+                path = os.path.join(orchestra_root, entry.path)
+                if entry.type != ENTRY_TYPE_DIR and entry.path not in excluded and os.path.lexists(path):
+                    os.unlink(path)
+            for directory in reversed(new_dirs):
+                path = os.path.join(orchestra_root, directory)
+                if os.path.isdir(path) and not os.listdir(path):
+                    os.rmdir(path)
+            _move_files(moved_files, rollback_dir, orchestra_root)
+            remove_tree(rollback_dir)
+            raise
+
+        for directory in sorted({os.path.dirname(f) for f in moved_files}, reverse=True):
+            path = os.path.join(orchestra_root, directory)
+            if directory and os.path.isdir(path) and not os.listdir(path):
+                logger.debug(f"Removing empty directory {path}")
+                os.rmdir(path)
+        discard_tree(self.config, rollback_dir)
+
+        if self.config.compact_path:
+            update_path_shim(self.config, (os.path.join(orchestra_root, f) for f in moved_files))
+
+    def _previously_installed_files(self) -> List[str]:
+        """Returns the files installed by the currently installed build of the component, excluding its metadata"""
+        if not is_installed(self.config, self.component.name):
+            return []
+        metadata_files = {
+            installed_component_file_list_path(self.component.name, self.config),
+            installed_component_metadata_path(self.component.name, self.config),
+        }
+        previous_files = []
+        for path in load_file_list(self.component.name, self.config):
+            path = path.strip().lstrip("/")
+            if os.path.join(self.config.orchestra_root, path) not in metadata_files:
+                previous_files.append(path)
+        return previous_files
+
     def _fetch_binary_archive(self):
-        binary_archive_path = self.locate_binary_archive()
-        assert binary_archive_path is not None
-        binary_archive_path = pathlib.Path(binary_archive_path)
-        binary_archive_root = get_worktree_root(binary_archive_path)
-        binary_archive_relative_path = binary_archive_path.relative_to(binary_archive_root)
-        lfs.fetch(binary_archive_root, include=[binary_archive_relative_path])
-
-    def _extract_binary_archive(self):
+        """Ensures the content of the binary archive is available locally.
+        Archives tracked by git LFS are not checked out: they are extracted directly from the LFS object store, so that
+        their content is not stored (and written) twice.
+        """
+        storage, relative_path = self.binary_archive_location()
+        binary_archive_path = os.path.join(storage.local_path, relative_path)
+        if storage.caches_locally:
+            record_binary_archive_use(self.config, binary_archive_path)
+        if storage.content_path(relative_path) is not None:
+            return
+
+        if not wait_for_prefetch(binary_archive_path) or storage.content_path(relative_path) is None:
+            storage.fetch([relative_path])
+
+    def _binary_archive_content_path(self) -> str:
+        """Returns the path of the file holding the content of the fetched binary archive"""
+        storage, relative_path = self.binary_archive_location()
+        content_path = storage.content_path(relative_path)
+        if content_path is None:
+            raise OrchestraException(f"The binary archive for {self.build.qualified_name} was not fetched")
+        return content_path
+
+    def _extract_binary_archive(self) -> Manifest:
         if not self.binary_archive_exists():
             raise Exception("Binary archive not found!")
 
-        archive_filepath = self.locate_binary_archive()
-        script = dedent(
-            f"""
-            mkdir -p "$TMP_ROOT$ORCHESTRA_ROOT"
-            cd "$TMP_ROOT$ORCHESTRA_ROOT"
-            tar xaf "{archive_filepath}"
-            """
+        return extract_archive(
+            self._binary_archive_content_path(),
+            self._tmp_orchestra_root,
+            exclude=CONFLICTING_PATHS,
+            archive_name=self.locate_binary_archive(),
         )
-        self._run_internal_script(script)
 
     def _implicit_dependencies(self):
         if self.allow_binary_archive and self.binary_archive_exists() or not self.allow_build:
@@ -190,199 +411,267 @@ class InstallAction(ActionForBuild):
     def _implicit_dependencies_for_hash(self):
         return {self.build.configure}
 
-    def _build_and_install(self):
+    def _build_and_install(self) -> TmprootScan:
+        """Runs the install script and the post-install steps.
+        :returns: the scan of the installed files
+        """
         env = self.environment
         env["RUN_TESTS"] = "1" if self.run_tests else "0"
 
         logger.debug("Executing install script")
-        run_user_script(self.script, environment=env)
+        try:
+            run_user_script(self.script, environment=env)
+        finally:
+            self.compiler_cache_stats = collect_stats(self.config, self.tmp_root)
+        if self.compiler_cache_stats is not None:
+            logger.debug(f"Compiler cache: {self.compiler_cache_stats}")
 
         logger.debug("Removing conflicting files")
         self._remove_conflicting_files()
 
+        logger.debug("Scanning installed files")
+        scan = scan_tmproot(self._tmp_orchestra_root)
+
         if self.build.component.skip_post_install:
             logger.debug("Skipping post install")
         else:
-            self._post_install()
-
-    def _post_install(self):
-        logger.debug("Dropping absolute paths from pkg-config")
-        self._drop_absolute_pkgconfig_paths()
+            self._post_install(scan)
+        return scan
 
+    def _post_install(self, scan: TmprootScan):
         logger.debug("Purging libtools' files")
-        self._purge_libtools_files()
+        self._purge_libtools_files(scan)
 
         # TODO: maybe this should be put into the configuration and not in orchestra itself
         logger.debug("Converting hardlinks to symbolic")
-        self._hard_to_symbolic()
+        self._hard_to_symbolic(scan)
 
         # TODO: maybe this should be put into the configuration and not in orchestra itself
         logger.debug("Fixing RPATHs")
-        self._fix_rpath()
-
-        # TODO: this should be put into the configuration and not in orchestra itself
-        logger.debug("Replacing NDEBUG preprocessor statements")
-        self._replace_ndebug(self.build.ndebug)
+        self._fix_rpath(scan)
 
-        # TODO: this should be put into the configuration and not in orchestra itself
-        logger.info("Replacing ASAN preprocessor statements")
-        self._replace_asan(self.build.asan)
+        # TODO: NDEBUG and ASAN replacements should be put into the configuration and not in orchestra itself
+        logger.debug("Dropping absolute paths from pkg-config, replacing NDEBUG and ASAN preprocessor statements")
+        self._rewrite_text_files(scan)
 
         if self.build.component.license:
             logger.debug("Copying license file")
-            source = self.build.component.license
-            destination = installed_component_license_path(self.build.component.name, self.config)
-            script = dedent(
-                f"""
-                DESTINATION_DIR="$TMP_ROOT$(dirname "{destination}")"
-                mkdir -p "$DESTINATION_DIR"
-                for DIR in "$BUILD_DIR" "$SOURCE_DIR"; do
-                  if test -e "$DIR/{source}"; then
-                    cp "$DIR/{source}" "$TMP_ROOT/{destination}"
-                    exit 0
-                  fi
-                done
-                echo "Couldn't find {source}"
-                exit 1
-                """
-            )
-            self._run_internal_script(script)
+            self._copy_license(scan)
+
+    def _copy_license(self, scan: TmprootScan):
+        source = self.build.component.license
+        destination = self.tmp_root + installed_component_license_path(self.build.component.name, self.config)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        for directory in (self.build_dir, self.source_dir):
+            license_path = os.path.join(directory, source)
+            if os.path.exists(license_path):
+                shutil.copy(license_path, destination)
+                scan.add_file(os.path.relpath(destination, self._tmp_orchestra_root))
+                return
+        raise OrchestraException(f"Couldn't find {source}")
 
     def _remove_conflicting_files(self):
-        script = dedent(
-            """
-            if test -d "$TMP_ROOT/$ORCHESTRA_ROOT/share/info"; then
-                rm -rf "$TMP_ROOT/$ORCHESTRA_ROOT/share/info";
-            fi
-            if test -d "$TMP_ROOT/$ORCHESTRA_ROOT/share/locale"; then
-                rm -rf "$TMP_ROOT/$ORCHESTRA_ROOT/share/locale";
-            fi
-            """
-        )
-        self._run_internal_script(script)
-
-    def _drop_absolute_pkgconfig_paths(self):
-        script = dedent(
-            """
-            cd "${TMP_ROOT}${ORCHESTRA_ROOT}"
-            if [ -e lib/pkgconfig ]; then
-                find lib/pkgconfig \\
-                    -name "*.pc" \\
-                    -exec sed -i 's|/*'"$ORCHESTRA_ROOT"'/*|${pcfiledir}/../..|g' {} ';'
-            fi
-            """
-        )
-        self._run_internal_script(script)
-
-    def _purge_libtools_files(self):
-        script = dedent(
-            """
-            find "${TMP_ROOT}${ORCHESTRA_ROOT}" -name "*.la" -type f -delete
-            """
-        )
-        self._run_internal_script(script)
-
-    def _hard_to_symbolic(self):
+        for conflicting_dir in CONFLICTING_PATHS:
+            conflicting_path = os.path.join(self._tmp_orchestra_root, conflicting_dir)
+            if os.path.isdir(conflicting_path):
+                remove_tree(conflicting_path)
+
+    def _purge_libtools_files(self, scan: TmprootScan):
+        libtool_files = scan.files(extension=".la")
+        for entry in libtool_files:
+            os.unlink(os.path.join(scan.root, entry.path))
+        scan.remove(libtool_files)
+
+    def _hard_to_symbolic(self, scan: TmprootScan):
         duplicates = defaultdict(list)
-        for root, dirnames, filenames in os.walk(f'{self.environment["TMP_ROOT"]}{self.environment["ORCHESTRA_ROOT"]}'):
-            for path in filenames:
-                path = os.path.join(root, path)
-                info = os.lstat(path)
-                inode = info.st_ino
-                if inode == 0 or info.st_nlink < 2 or not stat.S_ISREG(info.st_mode):
-                    continue
-
-                duplicates[inode].append(path)
+        for entry in scan.files():
+            if entry.inode == 0 or entry.nlink < 2:
+                continue
+            duplicates[entry.inode].append(entry)
 
         for _, equivalent in duplicates.items():
             base = equivalent.pop()
+            base_path = os.path.join(scan.root, base.path)
             for alternative in equivalent:
-                os.unlink(alternative)
-                os.symlink(os.path.relpath(base, os.path.dirname(alternative)), alternative)
-
-    def _fix_rpath(self):
-        replace_dynstr = os.path.join(os.path.dirname(__file__), "..", "support", "elf-replace-dynstr.py")
-        fix_rpath_script = dedent(
-            f"""
-            cd "$TMP_ROOT$ORCHESTRA_ROOT"
-            # Fix rpath
-            find . -type f -executable | while read EXECUTABLE; do
-                if head -c 4 "$EXECUTABLE" | grep '^.ELF' > /dev/null &&
-                        file "$EXECUTABLE" | grep x86-64 | grep -E '(shared|dynamic)' > /dev/null;
-                then
-                    REPLACE='$'ORIGIN/$(realpath --relative-to="$(dirname "$EXECUTABLE")" ".")
-                    echo "Setting rpath of $EXECUTABLE to $REPLACE"
-                    "{replace_dynstr}" "$EXECUTABLE" "$RPATH_PLACEHOLDER" "$REPLACE" /
-                    "{replace_dynstr}" "$EXECUTABLE" "$ORCHESTRA_ROOT" "$REPLACE" /
-                fi
-            done
-            """
+                alternative_path = os.path.join(scan.root, alternative.path)
+                target = os.path.relpath(base_path, os.path.dirname(alternative_path))
+                os.unlink(alternative_path)
+                os.symlink(target, alternative_path)
+                alternative.convert_to_symlink(target)
+            base.nlink -= len(equivalent)
+
+    def _fix_rpath(self, scan: TmprootScan):
+        orchestra_root = self.config.orchestra_root
+        elf_files = [e.path for e in scan.files() if e.is_elf]
+        patched = fix_rpaths(scan.root, elf_files, RPATH_PLACEHOLDER_PREFIX + orchestra_root, orchestra_root)
+        for path, rpath in patched:
+            logger.debug(f"Set rpath of {path} to {rpath}")
+
+    def _rewrite_text_files(self, scan: TmprootScan):
+        rewritten = rewrite_files(
+            [
+                (
+                    [os.path.join(scan.root, e.path) for e in scan.files(extension=".pc", under="lib/pkgconfig")],
+                    pkgconfig_rules(self.config.orchestra_root),
+                ),
+                (
+                    [os.path.join(scan.root, e.path) for e in scan.files(extension=".h", under="include")],
+                    ndebug_rules(self.build.ndebug) + asan_rules(self.build.asan),
+                ),
+            ]
+        )
+        scan.refresh(os.path.relpath(path, scan.root) for path in rewritten)
+
+    def _previous_install_manifest(self) -> Optional[Manifest]:
+        """Returns the manifest of the installed build of the component if a differential reinstall is possible"""
+        if not self.config.differential_reinstall or not is_installed(self.config, self.component.name):
+            return None
+        manifest = load_manifest(installed_component_manifest_path(self.component.name, self.config))
+        if manifest is None or any(e.type == ENTRY_TYPE_FILE and e.digest is None for e in manifest.entries):
+            return None
+        return manifest
+
+    def _differential_merge(self, previous_manifest: Manifest, manifest: Manifest):
+        """Replaces the installed build with the one in the tmproot, touching only the files that changed.
+        Files whose content, type and mode did not change are left in place (mtime included), changed files are
+        replaced atomically and files that are not part of the new build are deleted.
+        """
+        orchestra_root = self.config.orchestra_root
+        previous_entries = {e.path: e for e in previous_manifest.entries}
+        entries_to_merge = []
+        unchanged_files = 0
+        for entry in manifest.entries:
+            previous_entry = previous_entries.get(entry.path)
+            if (
+                entry.type != ENTRY_TYPE_DIR
+                and previous_entry is not None
+                and self._is_unchanged(previous_entry, entry)
+            ):
+                unchanged_files += 1
+            else:
+                # Directories are always passed, merge_tree skips existing ones
+                entries_to_merge.append(entry)
+
+        # Removing first makes room for entries whose type changed (e.g. a file replaced by a directory)
+        new_files = set(manifest.file_list())
+        skeleton_files = set(SKELETON_FILES)
+        removed_files = [
+            e.path
+            for e in previous_manifest.entries
+            if e.type != ENTRY_TYPE_DIR and e.path not in new_files and e.path not in skeleton_files
+        ]
+        for path in removed_files:
+            path_to_delete = os.path.join(orchestra_root, path)
+            if os.path.isfile(path_to_delete) or os.path.islink(path_to_delete):
+                logger.debug(f"Deleting {path_to_delete}")
+                os.remove(path_to_delete)
+
+        for directory in sorted({os.path.dirname(p) for p in removed_files}, reverse=True):
+            path = os.path.join(orchestra_root, directory)
+            if directory and os.path.isdir(path) and not os.listdir(path):
+                logger.debug(f"Removing empty directory {path}")
+                os.rmdir(path)
+
+        merge_tree(
+            self._tmp_orchestra_root,
+            orchestra_root,
+            Manifest(entries_to_merge),
+            keep_source=self.keep_tmproot,
+            store=self._object_store(),
         )
-        self._run_internal_script(fix_rpath_script)
-
-    def _replace_ndebug(self, disable_debugging):
-        debug, ndebug = ("0", "1") if disable_debugging else ("1", "0")
-        patch_ndebug_script = dedent(
-            rf"""
-            cd "$TMP_ROOT$ORCHESTRA_ROOT"
-            find include/ -name "*.h" \
-                -exec \
-                    sed -i \
-                    -e 's|^\s*#\s*ifndef\s\+NDEBUG|#if {debug}|' \
-                    -e 's|^\s*#\s*ifdef\s\+NDEBUG|#if {ndebug}|' \
-                    -e 's|^\(\s*#\s*if\s\+.*\)!defined(NDEBUG)|\1{debug}|' \
-                    -e 's|^\(\s*#\s*if\s\+.*\)defined(NDEBUG)|\1{ndebug}|' \
-                    {{}} ';'
-            """
+
+        replaced_files = sum(1 for e in entries_to_merge if e.type != ENTRY_TYPE_DIR)
+        logger.debug(f"{unchanged_files} files unchanged, {replaced_files} replaced, {len(removed_files)} removed")
+
+        if self.config.compact_path:
+            update_path_shim(self.config, (os.path.join(orchestra_root, p) for p in removed_files))
+
+    def _is_unchanged(self, previous_entry: ManifestEntry, entry: ManifestEntry) -> bool:
+        """Returns True if the installed file described by `previous_entry` is identical to the one in the tmproot"""
+        if previous_entry.type != entry.type:
+            return False
+        if entry.type == ENTRY_TYPE_SYMLINK:
+            return previous_entry.target == entry.target and os.path.islink(
+                os.path.join(self.config.orchestra_root, entry.path)
+            )
+        if entry.digest is None or previous_entry.digest != entry.digest:
+            return False
+        try:
+            installed_mode = os.lstat(os.path.join(self.config.orchestra_root, entry.path)).st_mode
+        except FileNotFoundError:
+            return False
+        return installed_mode == os.lstat(os.path.join(self._tmp_orchestra_root, entry.path)).st_mode
+
+    def _merge(self, manifest: Manifest):
+        os.makedirs(self.config.orchestra_root, exist_ok=True)
+        merge_tree(
+            self._tmp_orchestra_root,
+            self.config.orchestra_root,
+            manifest,
+            keep_source=self.keep_tmproot,
+            store=self._object_store(),
         )
-        self._run_internal_script(patch_ndebug_script)
-
-    def _replace_asan(self, asan_enabled):
-        replace_with = "1" if asan_enabled else "0"
-        # fmt: off
-        patch_ndebug_script = dedent(rf"""
-            cd "$TMP_ROOT$ORCHESTRA_ROOT"
-            find include/ -name "*.h" \
-                -exec \
-                    sed -i \
-                    -e 's|__has_feature\(address_sanitizer\)|{replace_with}|' \
-                    -e 's|defined\(__SANITIZE_ADDRESS__\)|{replace_with}|' \
-                    {{}} ';'
-            """)
-        # fmt: on
-        self._run_internal_script(patch_ndebug_script)
-
-    def _merge(self):
-        copy_command = f'cp -far --reflink=auto "$TMP_ROOT/$ORCHESTRA_ROOT/." "$ORCHESTRA_ROOT"'
-        self._run_internal_script(copy_command)
-
-    def _create_binary_archive(self):
+
+    def _create_binary_archive(self, manifest: Manifest):
+        """Creates the binary archive of the temporary root.
+        Unless the temporary root is kept, the archive is created in background from a snapshot of the temporary root,
+        so that the actions depending on this one do not wait for the compression.
+        """
+        # Resolved now: the source clone HEAD may move while the archive is being compressed in background, and the
+        # archive must be named after the commit it was built from (the one recorded in the install metadata)
+        relative_path = self.binary_archive_relative_path
+        snapshot_path = None if self.keep_tmproot else snapshot_tree(self.config, self._tmp_orchestra_root, manifest)
+        if snapshot_path is None:
+            self._write_binary_archive(self._tmp_orchestra_root, manifest, relative_path)
+            return
+
+        def create_from_snapshot():
+            try:
+                self._write_binary_archive(snapshot_path, manifest, relative_path)
+                self.update_binary_archive_symlink()
+            finally:
+                discard_tree(self.config, snapshot_path)
+
+        logger.debug("Creating binary archive in background")
+        submit_archive_creation(self, create_from_snapshot)
+
+    def _write_binary_archive(self, source_root, manifest: Manifest, relative_path: str):
+        """Compresses `source_root`, the content of the temporary root, to the binary archive
+        :param relative_path: path of the binary archive, relative to the binary archive repository
+        """
         logger.debug("Creating binary archive")
-        binary_archive_path = self._binary_archive_path()
+        binary_archives_local_path = self.config.binary_archives_local_paths[self._binary_archive_repo_name]
+        binary_archive_path = os.path.join(binary_archives_local_path, relative_path)
         binary_archive_parent_dir = os.path.dirname(binary_archive_path)
-        binary_archive_repo_name = self._binary_archive_repo_name
         absolute_binary_archive_tmp_path = os.path.join(
-            self.config.binary_archives_local_paths[binary_archive_repo_name],
-            f"_tmp_{self.binary_archive_filename}",
-        )
-        script = dedent(
-            f"""
-            mkdir -p "$BINARY_ARCHIVES"
-            cd "$TMP_ROOT$ORCHESTRA_ROOT"
-            rm -f '{absolute_binary_archive_tmp_path}'
-            tar cvaf '{absolute_binary_archive_tmp_path}' --owner=0 --group=0 *
-            mkdir -p '{binary_archive_parent_dir}'
-            mv '{absolute_binary_archive_tmp_path}' '{binary_archive_path}'
-            """
+            binary_archives_local_path,
+            f"_tmp_{self.build.name}_{os.path.basename(relative_path)}",
         )
-        self._run_internal_script(script)
+        os.makedirs(os.path.dirname(absolute_binary_archive_tmp_path), exist_ok=True)
+        if os.path.lexists(absolute_binary_archive_tmp_path):
+            os.unlink(absolute_binary_archive_tmp_path)
+
+        # Same entries a shell `*` glob would expand to
+        entries = sorted(e for e in os.listdir(source_root) if not e.startswith("."))
+        compression = self.binary_archive_compression
+        logger.debug(f"Compressing binary archive using {compression}")
+        create_archive(source_root, absolute_binary_archive_tmp_path, entries, compression)
+
+        os.makedirs(binary_archive_parent_dir, exist_ok=True)
+        shutil.move(absolute_binary_archive_tmp_path, binary_archive_path)
+        self.config.binary_archives_index.add(binary_archive_path)
+
+        # The archive does not contain hidden files at its top level, neither should the manifest
+        archived_entries = (e for e in manifest.entries if not e.path.startswith("."))
+        save_manifest(Manifest(archived_entries), manifest_path_for_archive(binary_archive_path))
 
     def update_binary_archive_symlink(self):
         """Creates/updates convenience symlinks to the binary archives.
-        Symlinks named <component_branch>_<orchestra_branch>.tar.xz point to the binary archives built for the
+        Symlinks named <component_branch>_<orchestra_branch>.tar.<ext> point to the binary archives built for the
         corresponding component and orchestra branches.
         Example: fix-something_master.tar.xz -> abcdef_fedcba.tar.xz would be created if the binary archive
         for component branch fix-something with orchestra configuration on the `master` branch is available.
+        The symlink has the same extension of the archive it points to, symlinks with other extensions are removed.
         """
         logger.debug("Updating binary archive symlink")
 
@@ -391,7 +680,9 @@ class InstallAction(ActionForBuild):
             logger.warning("No binary archive configured")
             return
 
-        orchestra_config_branch = self._try_get_script_output('git -C "$ORCHESTRA_DOTDIR" rev-parse --abbrev-ref HEAD')
+        orchestra_config_branch = self._try_get_subprocess_output(
+            ["git", "-C", self.config.orchestra_dotdir, "rev-parse", "--abbrev-ref", "HEAD"]
+        )
         if orchestra_config_branch is None:
             logger.warning(
                 "Orchestra configuration is not inside a git repository. Defaulting to `master` as branch name"
@@ -404,41 +695,33 @@ class InstallAction(ActionForBuild):
 
         def create_symlink(branch, commit):
             branch = branch.replace("/", "-")
-            target_name = self._binary_archive_filename(commit, self.component.recursive_hash)
-            target_absolute_path = os.path.join(archive_dir_path, target_name)
-            symlink_absolute_path = os.path.join(archive_dir_path, f"{branch}_{orchestra_config_branch}.tar.xz")
-            if os.path.exists(target_absolute_path):
-                if os.path.exists(symlink_absolute_path):
+            for extension in self._binary_archive_extensions():
+                target_name = self._binary_archive_filename(commit, self.component.recursive_hash, extension)
+                if os.path.exists(os.path.join(archive_dir_path, target_name)):
+                    break
+            else:
+                return
+
+            for symlink_extension in ARCHIVE_EXTENSIONS:
+                symlink_name = f"{branch}_{orchestra_config_branch}.tar{symlink_extension}"
+                symlink_absolute_path = os.path.join(archive_dir_path, symlink_name)
+                if os.path.lexists(symlink_absolute_path):
                     os.unlink(symlink_absolute_path)
-                os.symlink(target_name, symlink_absolute_path)
+                if symlink_extension == extension:
+                    os.symlink(target_name, symlink_absolute_path)
 
-        if self.component.clone:
-            for branch, commit in self.component.clone.heads().items():
+        heads = self.component.clone.heads().items() if self.component.clone else [("none", "none")]
+        with _binary_archive_symlinks_lock:
+            for branch, commit in heads:
                 create_symlink(branch, commit)
-        else:
-            create_symlink("none", "none")
-
-    @staticmethod
-    def _index_directory(root_dir_path, relative_to=None):
-        paths = []
-        for current_dir_path, child_dir_names, child_file_names in os.walk(root_dir_path):
-            for child_filename in child_file_names:
-                child_file_path = os.path.join(current_dir_path, child_filename)
-                if relative_to:
-                    child_file_path = os.path.relpath(child_file_path, relative_to)
-                paths.append(child_file_path)
-
-            for child_dir in child_dir_names:
-                child_dir_path = os.path.join(current_dir_path, child_dir)
-                if os.path.islink(child_dir_path):
-                    if relative_to:
-                        child_dir_path = os.path.relpath(child_dir_path, relative_to)
-                    paths.append(child_dir_path)
-
-        return paths
 
     def _cleanup_tmproot(self):
-        self._run_internal_script('rm -rf "$TMP_ROOT"')
+        discard_tree(self.config, self.tmp_root)
+
+    @property
+    def _tmp_orchestra_root(self) -> str:
+        """Returns the path of the orchestra root inside the temporary root"""
+        return self.tmp_root + self.config.orchestra_root
 
     @property
     def _binary_archive_repo_name(self):
@@ -473,11 +756,30 @@ class InstallAction(ActionForBuild):
         to get a path which is unique to a single build
         """
         component_commit = self.component.commit() or "none"
-        return self._binary_archive_filename(component_commit, self.component.recursive_hash)
+        return self._binary_archive_filename(
+            component_commit, self.component.recursive_hash, self.binary_archive_compression.extension
+        )
 
     @staticmethod
-    def _binary_archive_filename(component_commit, component_recursive_hash) -> str:
-        return f"{component_commit}_{component_recursive_hash}.tar.xz"
+    def _binary_archive_filename(component_commit, component_recursive_hash, extension) -> str:
+        return f"{component_commit}_{component_recursive_hash}.tar{extension}"
+
+    @property
+    def binary_archive_compression(self) -> Compression:
+        """Returns the compression settings for new binary archives of the target build.
+        The component setting has priority over the binary archives repository one.
+        """
+        spec = (
+            self.component.binary_archives_compression
+            or self.config.binary_archives_compression.get(self._binary_archive_repo_name)
+            or DEFAULT_COMPRESSION
+        )
+        return Compression(spec)
+
+    def _binary_archive_extensions(self) -> List[str]:
+        """Returns the extensions binary archives can have, the one for the configured compression first"""
+        preferred_extension = self.binary_archive_compression.extension
+        return [preferred_extension] + [e for e in ARCHIVE_EXTENSIONS if e != preferred_extension]
 
     def _binary_archive_path(self) -> str:
         """Returns the absolute path where the binary archive should be created.
@@ -490,31 +792,53 @@ class InstallAction(ActionForBuild):
 
     def locate_binary_archive(self) -> Optional[str]:
         """Returns the absolute path to the binary archive that can be extracted to install the target build.
-        *Note*: the path may be pointing to a git LFS pointer which needs to be downloaded and checked out (smudged)"""
-        binary_archives_path = self.config.binary_archives_dir
-        for name in self.config.binary_archives_remotes:
-            relative_path_without_extension = os.path.splitext(self.binary_archive_relative_path)[0]
-            extensions = [".xz", ".gz", ""]
-            for extension in extensions:
-                try_path = os.path.join(binary_archives_path, name, relative_path_without_extension + extension)
-                if os.path.exists(try_path):
-                    return try_path
-        return None
+        *Note*: the path may be pointing to a git LFS pointer which needs to be downloaded and checked out (smudged), or
+        not exist yet if the archive needs to be downloaded. Use `_fetch_binary_archive` before reading it.
+        """
+        relative_path_without_extension = os.path.splitext(self.binary_archive_relative_path)[0]
+        return self.config.binary_archives_index.locate(
+            relative_path_without_extension, self._binary_archive_extensions()
+        )
+
+    def binary_archive_location(self) -> Optional[Tuple[BinaryArchivesStorage, str]]:
+        """Returns the storage of the binary archive located by `locate_binary_archive` and its path relative to it"""
+        relative_path_without_extension = os.path.splitext(self.binary_archive_relative_path)[0]
+        location = self.config.binary_archives_index.locate_in_repository(
+            relative_path_without_extension, self._binary_archive_extensions()
+        )
+        if location is None:
+            return None
+        name, relative_path = location
+        return self.config.binary_archives_storages[name], relative_path
+
+    def will_fetch_binary_archive(self) -> bool:
+        """Returns True if running the action requires fetching its binary archive"""
+        if not self.allow_binary_archive or not self.binary_archive_exists():
+            return False
+        if self._object_store_manifest() is not None:
+            return False
+        storage, relative_path = self.binary_archive_location()
+        return storage.content_path(relative_path) is None
 
     def binary_archive_exists(self) -> bool:
         """Returns True if the binary archive for the target build exists (cached or downloadable)"""
         return self.locate_binary_archive() is not None
 
-    @property
-    def environment(self) -> "OrderedDict[str, str]":
-        env = super().environment
-        env["DESTDIR"] = self.tmp_root
-        return env
+    def _environment_layers(self) -> "List[OrderedDict[str, str]]":
+        layer = OrderedDict()
+        layer["DESTDIR"] = self.tmp_root
+        layer.update(compiler_cache_install_environment(self.config, self.tmp_root))
+        return super()._environment_layers() + [layer]
 
     @property
     def architecture(self):
         return "linux-x86-64"
 
+    def run_summary(self) -> Optional[str]:
+        if self.compiler_cache_stats is None:
+            return None
+        return f"{self.build.qualified_name}: compiler cache {self.compiler_cache_stats}"
+
     def is_satisfied(self):
         return is_installed(
             self.config,
@@ -522,3 +846,24 @@ class InstallAction(ActionForBuild):
             wanted_build=self.build.name,
             wanted_recursive_hash=self.build.component.recursive_hash,
         )
+
+
+def _is_conflicting_path(path) -> bool:
+    return any(path == p or path.startswith(p + "/") for p in CONFLICTING_PATHS)
+
+
+def _move_files(paths: List[str], source_root, destination_root) -> List[str]:
+    """Moves the files (and symlinks) at `paths`, relative to `source_root`, to the same paths under `destination_root`.
+    Directories and missing paths are skipped.
+    :returns: the moved paths
+    """
+    moved = []
+    for path in paths:
+        source = os.path.join(source_root, path)
+        if not os.path.lexists(source) or (os.path.isdir(source) and not os.path.islink(source)):
+            continue
+        destination = os.path.join(destination_root, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.rename(source, destination)
+        moved.append(path)
+    return moved
@@ -0,0 +1,86 @@
+"""Batched prefetching of the binary archives (git LFS tracked or downloaded from HTTP repositories).
+
+Once the executor knows which binary archives will be extracted, they are grouped by binary archives repository and
+fetched by its storage backend in batches of `_BATCH_SIZE` archives (a single `git lfs fetch` per batch for git LFS
+repositories), in background threads, while the first actions start. Install actions wait for the batch containing
+their archive instead of fetching it on their own.
+"""
+import os
+import threading
+from collections import defaultdict
+from concurrent import futures
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from .binary_archives_storage import BinaryArchivesStorage
+
+# Maximum number of archives fetched by a single `git lfs fetch` invocation, keeps the command line length bounded
+_BATCH_SIZE = 200
+
+# Absolute path of a binary archive -> future of the batch fetching it
+_prefetches: Dict[str, futures.Future] = {}
+_prefetches_lock = threading.Lock()
+
+_pool: Optional[futures.ThreadPoolExecutor] = None
+
+
+def prefetch_binary_archives(archives: Iterable[Tuple[BinaryArchivesStorage, str]]) -> int:
+    """Starts fetching the given binary archives in background.
+    :param archives: storage and relative path of binary archives, as returned by InstallAction.binary_archive_location
+    :returns: the number of archives that were not already being fetched
+    """
+    paths_by_storage: Dict[BinaryArchivesStorage, List[str]] = defaultdict(list)
+    with _prefetches_lock:
+        for storage, relative_path in archives:
+            if os.path.join(storage.local_path, relative_path) in _prefetches:
+                continue
+            paths_by_storage[storage].append(relative_path)
+
+        scheduled = 0
+        for storage, relative_paths in paths_by_storage.items():
+            for i in range(0, len(relative_paths), _BATCH_SIZE):
+                batch = relative_paths[i : i + _BATCH_SIZE]
+                future = _get_pool().submit(_fetch_batch, storage, batch)
+                for relative_path in batch:
+                    _prefetches[os.path.join(storage.local_path, relative_path)] = future
+                scheduled += len(batch)
+    return scheduled
+
+
+def wait_for_prefetch(archive_path) -> bool:
+    """Waits until the batch containing `archive_path` (absolute path, see InstallAction.locate_binary_archive) has been
+    fetched.
+    :returns: True if the archive was prefetched, False if it was never scheduled or its batch failed, in which case the
+              caller should fetch it by itself
+    """
+    with _prefetches_lock:
+        future = _prefetches.get(archive_path)
+    if future is None:
+        return False
+    return future.result()
+
+
+def wait_for_all_prefetches():
+    """Waits for the completion of the scheduled prefetches and forgets about them"""
+    with _prefetches_lock:
+        pending = set(_prefetches.values())
+        _prefetches.clear()
+    futures.wait(pending)
+
+
+def _fetch_batch(storage: BinaryArchivesStorage, relative_paths: List[str]) -> bool:
+    logger.debug(f"Prefetching {len(relative_paths)} binary archives from {storage.name}")
+    try:
+        storage.fetch(relative_paths)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not prefetch binary archives from {storage.name}, they will be fetched one by one: {e}")
+        return False
+
+
+def _get_pool() -> futures.ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = futures.ThreadPoolExecutor(thread_name_prefix="Prefetch")
+    return _pool
@@ -0,0 +1,233 @@
+"""Merges a temporary root into the orchestra root, driven by the manifest of the temporary root.
+
+Each file is moved with the cheapest strategy available:
+- rename: source and destination are on the same filesystem and the source is not needed afterwards. Directories which
+  do not exist in the destination are renamed as a whole.
+- hardlink: same filesystem, but the source must be kept (e.g. --keep-tmproot)
+- reflink: different filesystems supporting copy-on-write clones (e.g. btrfs, XFS)
+- copy: everything else, using copy_file_range so the data does not go through userspace
+
+Existing destination files are replaced atomically. Files are processed by a pool of threads.
+When the object store is enabled regular files are added to it and linked from there instead (see object_store.py).
+"""
+import errno
+import fcntl
+import os
+import shutil
+import stat
+import uuid
+from collections import defaultdict
+from concurrent import futures
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+from ..model.manifest import Manifest, ManifestEntry, ENTRY_TYPE_DIR, ENTRY_TYPE_SYMLINK
+
+STRATEGY_RENAME = "rename"
+STRATEGY_HARDLINK = "hardlink"
+STRATEGY_REFLINK = "reflink"
+STRATEGY_COPY = "copy"
+
+# ioctl request to clone a file (see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+# Number of files handled by a single task submitted to the thread pool
+_CHUNK_SIZE = 64
+
+# copy_file_range and reflinks fail with these errors when the filesystems do not support them
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF}
+
+
+class MergeStats:
+    """Number of files and bytes merged with each strategy"""
+
+    def __init__(self):
+        self.files: Dict[str, int] = defaultdict(int)
+        self.bytes: Dict[str, int] = defaultdict(int)
+
+    def add(self, strategy, size, files=1):
+        self.files[strategy] += files
+        self.bytes[strategy] += size
+
+    def update(self, other: "MergeStats"):
+        for strategy in other.files:
+            self.add(strategy, other.bytes[strategy], other.files[strategy])
+
+    def __str__(self):
+        if not self.files:
+            return "nothing"
+        return ", ".join(
+            f"{self.files[strategy]} files ({self.bytes[strategy]} bytes) by {strategy}"
+            for strategy in (STRATEGY_RENAME, STRATEGY_HARDLINK, STRATEGY_REFLINK, STRATEGY_COPY)
+            if strategy in self.files
+        )
+
+
+def merge_tree(
+    source_root,
+    destination_root,
+    manifest: Manifest,
+    keep_source=False,
+    jobs=None,
+    store=None,
+) -> MergeStats:
+    """Merges the entries of `manifest` from `source_root` into `destination_root`, overwriting existing files.
+    Modes and timestamps are preserved, symlinks are merged as symlinks.
+    :param source_root: the directory described by `manifest`
+    :param destination_root: the directory to merge into
+    :param keep_source: if False the source files may be moved away, leaving `source_root` incomplete
+    :param jobs: number of threads, None to use the ThreadPoolExecutor default
+    :param store: an ObjectStore. If given, regular files with a digest are added to the store and linked from there
+    """
+    same_filesystem = os.stat(source_root).st_dev == os.stat(destination_root).st_dev
+    allow_rename = same_filesystem and not keep_source
+    # Files going through the object store cannot be moved together with their directory
+    allow_directory_rename = allow_rename and store is None
+    stats = MergeStats()
+
+    # Directories are handled sequentially, in manifest order parents come before their content
+    renamed_dirs = set()
+    created_dirs = []
+    for entry in manifest.entries:
+        if entry.type != ENTRY_TYPE_DIR or _is_inside(entry.path, renamed_dirs):
+            continue
+        destination = os.path.join(destination_root, entry.path)
+        if os.path.isdir(destination):
+            continue
+        if allow_directory_rename and not os.path.lexists(destination):
+            os.rename(os.path.join(source_root, entry.path), destination)
+            renamed_dirs.add(entry.path)
+        else:
+            os.makedirs(destination)
+            created_dirs.append(entry.path)
+
+    files = []
+    for entry in manifest.entries:
+        if entry.type == ENTRY_TYPE_DIR:
+            continue
+        if _is_inside(entry.path, renamed_dirs):
+            stats.add(STRATEGY_RENAME, entry.size or 0)
+            continue
+        # Parents might not be listed in the manifest (e.g. manifests of older binary archives)
+        os.makedirs(os.path.dirname(os.path.join(destination_root, entry.path)), exist_ok=True)
+        files.append(entry)
+
+    def merge_chunk(chunk: List[ManifestEntry]) -> MergeStats:
+        chunk_stats = MergeStats()
+        for chunk_entry in chunk:
+            strategy = _merge_entry(chunk_entry, source_root, destination_root, allow_rename, same_filesystem, store)
+            chunk_stats.add(strategy, chunk_entry.size or 0)
+        return chunk_stats
+
+    chunks = [files[i : i + _CHUNK_SIZE] for i in range(0, len(files), _CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        for chunk in chunks:
+            stats.update(merge_chunk(chunk))
+    else:
+        with futures.ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="Merger") as executor:
+            for chunk_stats in executor.map(merge_chunk, chunks):
+                stats.update(chunk_stats)
+
+    # Creating the content changed the timestamps of the new directories, restore them deepest first
+    for directory in reversed(created_dirs):
+        shutil.copystat(os.path.join(source_root, directory), os.path.join(destination_root, directory))
+
+    logger.debug(f"Merged {stats}")
+    return stats
+
+
+def _merge_entry(entry: ManifestEntry, source_root, destination_root, allow_rename, same_filesystem, store) -> str:
+    """Merges a single file or symlink, returns the strategy used"""
+    source = os.path.join(source_root, entry.path)
+    destination = os.path.join(destination_root, entry.path)
+
+    if store is not None and entry.type != ENTRY_TYPE_SYMLINK and entry.digest is not None:
+        if entry.mode is None:
+            entry.mode = stat.S_IMODE(os.lstat(source).st_mode)
+        store.add(source, entry.digest, entry.mode, move=allow_rename)
+        return store.link(entry.digest, entry.mode, destination)
+
+    if allow_rename:
+        try:
+            os.replace(source, destination)
+            return STRATEGY_RENAME
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    def create(temporary_destination):
+        if entry.type == ENTRY_TYPE_SYMLINK:
+            os.symlink(os.readlink(source), temporary_destination)
+            return STRATEGY_COPY
+        strategy = _hardlink(source, temporary_destination) if same_filesystem else None
+        if strategy is None:
+            strategy = clone_file(source, temporary_destination)
+            shutil.copystat(source, temporary_destination, follow_symlinks=False)
+        return strategy
+
+    return replace_atomically(destination, create)
+
+
+def replace_atomically(destination, create: Callable[[str], Optional[str]]) -> Optional[str]:
+    """Replaces `destination` with the file created by `create`, which receives a temporary path in the same directory.
+    :returns: the return value of `create`
+    """
+    temporary_destination = os.path.join(
+        os.path.dirname(destination), f".{os.path.basename(destination)}.{uuid.uuid4().hex[:8]}.orchestra-tmp"
+    )
+    try:
+        result = create(temporary_destination)
+        os.replace(temporary_destination, destination)
+    except BaseException:
+        if os.path.lexists(temporary_destination):
+            os.unlink(temporary_destination)
+        raise
+    return result
+
+
+def _hardlink(source, destination) -> Optional[str]:
+    try:
+        os.link(source, destination, follow_symlinks=False)
+        return STRATEGY_HARDLINK
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED_ERRNOS | {errno.EPERM, errno.EMLINK}:
+            raise
+        return None
+
+
+def clone_file(source, destination) -> str:
+    """Copies `source` to `destination`, using a reflink if the filesystem supports it"""
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            return STRATEGY_REFLINK
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+
+        size = os.fstat(source_file.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                written = os.copy_file_range(source_file.fileno(), destination_file.fileno(), size - copied)
+                if written == 0:
+                    break
+                copied += written
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            # copy_file_range moves the file offsets like read/write would, resume from there
+            shutil.copyfileobj(source_file, destination_file)
+        return STRATEGY_COPY
+
+
+def _is_inside(path, directories) -> bool:
+    """Returns True if `path` is one of `directories` or is contained in one of them"""
+    if not directories:
+        return False
+    while path:
+        if path in directories:
+            return True
+        path = os.path.dirname(path)
+    return False
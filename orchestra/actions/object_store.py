@@ -0,0 +1,186 @@
+"""Content-addressed store of installed files (`object_store` configuration option).
+
+Every regular file merged into the orchestra root is first added to the store, keyed by its sha256 digest and its
+permission bits, and then hardlinked (or reflinked/copied, if the store is on a different filesystem) to its
+destination. Identical files installed by different builds, commits or components share the same object.
+
+When the files of a binary archive are already in the store (its manifest lists their digests) the archive does not
+need to be fetched nor extracted: installing it only requires linking the objects into the root.
+
+Objects are garbage collected (`orc object-store gc`) when none of the roots using the store references them in the
+manifests of its installed components.
+"""
+import errno
+import glob
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Iterable, Optional, Set, Tuple
+
+from loguru import logger
+
+from .merge import STRATEGY_HARDLINK, MergeStats, clone_file, replace_atomically
+from ..model.manifest import Manifest, ENTRY_TYPE_DIR, ENTRY_TYPE_FILE, ENTRY_TYPE_SYMLINK, MANIFEST_SUFFIX
+
+# File listing the orchestra roots whose files are linked to the store
+ROOTS_FILENAME = "roots"
+
+_roots_lock = threading.Lock()
+
+
+class ObjectStore:
+    def __init__(self, path):
+        self.path = path
+
+    def object_path(self, digest, mode) -> str:
+        """Returns the path of the object for a file with the given content digest and permission bits"""
+        return os.path.join(self.path, digest[:2], f"{digest[2:]}-{mode:o}")
+
+    def contains(self, manifest: Manifest) -> bool:
+        """Returns True if all the regular files of `manifest` are in the store"""
+        for entry in manifest.entries:
+            if entry.type != ENTRY_TYPE_FILE:
+                continue
+            if entry.digest is None or entry.mode is None:
+                return False
+            if not os.path.exists(self.object_path(entry.digest, entry.mode)):
+                return False
+        return True
+
+    def add(self, source, digest, mode, move=False) -> str:
+        """Adds the file at `source` to the store, unless an identical object is already there.
+        :param move: if True `source` may be moved into the store
+        :returns: the path of the object
+        """
+        object_path = self.object_path(digest, mode)
+        if os.path.exists(object_path):
+            return object_path
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temporary_path = f"{object_path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            if move:
+                try:
+                    os.rename(source, temporary_path)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    move = False
+            if not move:
+                clone_file(source, temporary_path)
+                shutil.copystat(source, temporary_path)
+            os.chmod(temporary_path, mode)
+            # Concurrent installs may add the same object, the content is the same so the last one wins
+            os.replace(temporary_path, object_path)
+        except BaseException:
+            if os.path.lexists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        return object_path
+
+    def link(self, digest, mode, destination) -> str:
+        """Replaces `destination` with a link to the object, returns the strategy used"""
+        object_path = self.object_path(digest, mode)
+
+        def create(temporary_destination):
+            try:
+                os.link(object_path, temporary_destination)
+                return STRATEGY_HARDLINK
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+                    raise
+            strategy = clone_file(object_path, temporary_destination)
+            shutil.copystat(object_path, temporary_destination)
+            return strategy
+
+        return replace_atomically(destination, create)
+
+    def checkout(self, manifest: Manifest, destination_root) -> MergeStats:
+        """Creates the entries of `manifest` in `destination_root`, linking regular files from the store"""
+        stats = MergeStats()
+        for entry in manifest.entries:
+            destination = os.path.join(destination_root, entry.path)
+            if entry.type == ENTRY_TYPE_DIR:
+                os.makedirs(destination, exist_ok=True)
+            elif entry.type == ENTRY_TYPE_SYMLINK:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                replace_atomically(destination, lambda path: os.symlink(entry.target, path))
+            else:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                stats.add(self.link(entry.digest, entry.mode, destination), entry.size or 0)
+        logger.debug(f"Checked out {stats} from the object store")
+        return stats
+
+    def register_root(self, orchestra_root):
+        """Records that `orchestra_root` links files from the store, so its installed files are considered by the GC"""
+        with _roots_lock:
+            if orchestra_root in self.roots():
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, ROOTS_FILENAME), "a") as f:
+                f.write(f"{orchestra_root}\n")
+
+    def roots(self) -> Set[str]:
+        """Returns the orchestra roots using the store"""
+        roots_path = os.path.join(self.path, ROOTS_FILENAME)
+        if not os.path.exists(roots_path):
+            return set()
+        with open(roots_path) as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def objects(self) -> Iterable[Tuple[str, os.stat_result]]:
+        """Yields the paths and stat results of all the objects"""
+        if not os.path.isdir(self.path):
+            return
+        with os.scandir(self.path) as it:
+            subdirs = [e.path for e in it if e.is_dir(follow_symlinks=False)]
+        for subdir in subdirs:
+            with os.scandir(subdir) as it:
+                for dir_entry in it:
+                    yield dir_entry.path, dir_entry.stat(follow_symlinks=False)
+
+    def gc(self, pretend=False) -> Tuple[int, int]:
+        """Deletes the objects not referenced by any root using the store.
+        Objects still hardlinked somewhere are never deleted, even if unreferenced.
+        :returns: number of deleted objects and freed bytes
+        """
+        referenced = set()
+        for orchestra_root in self.roots():
+            referenced.update(_referenced_objects(self, orchestra_root))
+
+        deleted_objects = 0
+        freed_bytes = 0
+        for object_path, stat_result in self.objects():
+            if object_path in referenced or stat_result.st_nlink > 1:
+                continue
+            logger.debug(f"Deleting {object_path}")
+            if not pretend:
+                os.unlink(object_path)
+            deleted_objects += 1
+            freed_bytes += stat_result.st_size
+        return deleted_objects, freed_bytes
+
+
+def object_store(config) -> Optional[ObjectStore]:
+    """Returns the object store, or None if it is not enabled"""
+    if not config.object_store:
+        return None
+    return ObjectStore(config.object_store_dir)
+
+
+def _referenced_objects(store: ObjectStore, orchestra_root) -> Set[str]:
+    metadata_dir = os.path.join(orchestra_root, "share", "orchestra")
+    referenced = set()
+    for manifest_path in glob.glob(os.path.join(glob.escape(metadata_dir), f"*{MANIFEST_SUFFIX}")):
+        try:
+            with open(manifest_path) as f:
+                serialized_manifest = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning(f"Could not load {manifest_path}: {e}")
+            continue
+        for entry in serialized_manifest.get("entries", []):
+            if entry.get("type") == ENTRY_TYPE_FILE and "digest" in entry and "mode" in entry:
+                referenced.add(store.object_path(entry["digest"], entry["mode"]))
+    return referenced
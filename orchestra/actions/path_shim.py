@@ -0,0 +1,124 @@
+"""The PATH shim is a directory containing symlinks to all the executables found in the `add_to_path` directories.
+When enabled (`compact_path` configuration option) it replaces the `add_to_path` entries in $PATH, so that looking up
+an executable requires inspecting a single directory instead of dozens.
+
+When multiple `add_to_path` directories contain an executable with the same name the link points to the one that would
+have been picked by a PATH lookup: the root configuration entries come first, followed by the components entries in
+configuration order.
+"""
+import os
+from typing import Iterable, List, Optional
+
+from loguru import logger
+
+from ..util import expand_variables
+
+PATH_SHIM_DIRNAME = ".orchestra-path"
+
+# File containing the list of directories the shim was built from, used to detect configuration changes
+SOURCES_FILENAME = ".sources"
+
+
+def path_shim_dir(config) -> str:
+    """Returns the absolute path of the PATH shim directory"""
+    return os.path.join(config.orchestra_root, PATH_SHIM_DIRNAME)
+
+
+def path_shim_source_dirs(config) -> List[str]:
+    """Returns the `add_to_path` directories, expanded and in PATH priority order"""
+    paths = list(config.parsed_yaml.get("add_to_path", []))
+    for component in config.components.values():
+        paths.extend(component.add_to_path)
+
+    environment = config.global_env()
+    source_dirs = []
+    for path in paths:
+        try:
+            expanded_path = os.path.normpath(expand_variables(path, additional_environment=environment))
+        except ValueError as e:
+            logger.warning(f"Not adding {path} to the PATH shim: {e}")
+            continue
+        if expanded_path not in source_dirs:
+            source_dirs.append(expanded_path)
+    return source_dirs
+
+
+def ensure_path_shim(config):
+    """Rebuilds the PATH shim if it does not exist or if the `add_to_path` directories changed"""
+    source_dirs = path_shim_source_dirs(config)
+    sources_path = os.path.join(path_shim_dir(config), SOURCES_FILENAME)
+    if os.path.exists(sources_path):
+        with open(sources_path) as f:
+            if f.read().splitlines() == source_dirs:
+                return
+
+    rebuild_path_shim(config, source_dirs=source_dirs)
+
+
+def rebuild_path_shim(config, source_dirs: Optional[List[str]] = None):
+    """Recreates all the links in the PATH shim directory"""
+    if source_dirs is None:
+        source_dirs = path_shim_source_dirs(config)
+
+    shim_dir = path_shim_dir(config)
+    logger.debug(f"Rebuilding PATH shim {shim_dir}")
+    os.makedirs(shim_dir, exist_ok=True)
+
+    names = set(os.listdir(shim_dir))
+    names.discard(SOURCES_FILENAME)
+    for source_dir in source_dirs:
+        if os.path.isdir(source_dir):
+            names.update(os.listdir(source_dir))
+
+    for name in names:
+        _update_link(shim_dir, name, source_dirs)
+
+    with open(os.path.join(shim_dir, SOURCES_FILENAME), "w") as f:
+        f.writelines(f"{d}\n" for d in source_dirs)
+
+
+def update_path_shim(config, changed_paths: Iterable[str]):
+    """Incrementally updates the PATH shim after files have been installed or removed.
+    Only the links named after a changed file located directly inside one of the `add_to_path` directories are
+    updated.
+    :param changed_paths: absolute paths of the installed or removed files
+    """
+    shim_dir = path_shim_dir(config)
+    if not os.path.exists(os.path.join(shim_dir, SOURCES_FILENAME)):
+        ensure_path_shim(config)
+        return
+
+    source_dirs = path_shim_source_dirs(config)
+    source_dirs_set = set(source_dirs)
+    names = {os.path.basename(p) for p in changed_paths if os.path.dirname(os.path.normpath(p)) in source_dirs_set}
+    for name in names:
+        _update_link(shim_dir, name, source_dirs)
+
+
+def _update_link(shim_dir, name, source_dirs):
+    link_path = os.path.join(shim_dir, name)
+    target = _resolve_executable(name, source_dirs)
+
+    current_target = os.readlink(link_path) if os.path.islink(link_path) else None
+    if target == current_target:
+        return
+
+    if target is None:
+        logger.debug(f"Removing {name} from PATH shim")
+        os.unlink(link_path)
+        return
+
+    # Replace the link atomically, so concurrent lookups never find it missing
+    tmp_link_path = os.path.join(shim_dir, f".{name}.tmp")
+    if os.path.lexists(tmp_link_path):
+        os.unlink(tmp_link_path)
+    os.symlink(target, tmp_link_path)
+    os.replace(tmp_link_path, link_path)
+
+
+def _resolve_executable(name, source_dirs) -> Optional[str]:
+    for source_dir in source_dirs:
+        candidate = os.path.join(source_dir, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
@@ -0,0 +1,177 @@
+"""Post-install fixing of the RPATH/RUNPATH of ELF files.
+
+Components are built with their RPATH set to RPATH_PLACEHOLDER (the orchestra root prefixed by slashes), which
+leaves room to replace it with a path relative to the ELF file ($ORIGIN/...) once installed. This module rewrites
+the dynamic string table of the ELF files like support/elf-replace-dynstr.py does, without starting an interpreter
+per file: files are memory-mapped, checked for the ELF magic and for the orchestra root with a byte scan, and only
+then their program headers are parsed to locate DT_STRTAB/DT_STRSZ.
+"""
+import mmap
+import os
+import struct
+from typing import List, Optional, Tuple
+
+from .util.process_pool import map_chunks
+from ..util import OrchestraException
+
+# RPATH_PLACEHOLDER is the orchestra root prefixed by this string
+RPATH_PLACEHOLDER_PREFIX = "/" * 48
+
+ELF_MAGIC = b"\x7fELF"
+
+# Padding appended to replacements shorter than the string they replace
+RPATH_PADDING = b"/"
+
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+_EM_X86_64 = 62
+_PT_LOAD = 1
+_PT_DYNAMIC = 2
+_DT_NULL = 0
+_DT_STRTAB = 5
+_DT_STRSZ = 10
+
+# Layouts of the ELF structures, by class: (e_phoff, e_phentsize, e_phnum) offsets and formats
+_HEADER_FIELDS = {
+    _ELFCLASS32: ((28, "I"), (42, "H"), (44, "H")),
+    _ELFCLASS64: ((32, "Q"), (54, "H"), (56, "H")),
+}
+# p_type, p_offset, p_vaddr, p_filesz
+_PROGRAM_HEADER_FIELDS = {
+    _ELFCLASS32: ((0, "I"), (4, "I"), (8, "I"), (16, "I")),
+    _ELFCLASS64: ((0, "I"), (8, "Q"), (16, "Q"), (32, "Q")),
+}
+# d_tag, d_val and the size of an entry
+_DYNAMIC_ENTRY_FIELDS = {
+    _ELFCLASS32: ("iI", 8),
+    _ELFCLASS64: ("qQ", 16),
+}
+
+
+def fix_rpaths(root, paths: List[str], rpath_placeholder, orchestra_root) -> List[Tuple[str, str]]:
+    """Replaces `rpath_placeholder` and then `orchestra_root` in the dynamic string table of the ELF files among
+    `paths` with `$ORIGIN/<path of root relative to the file>`. Files that are not x86-64 ELF files or that do not
+    contain the orchestra root are left untouched.
+    :param root: the directory that will be installed as `orchestra_root`
+    :param paths: paths of the files to consider, relative to `root`
+    :returns: the paths of the patched files, with their new RPATH
+    """
+    searches = (os.fsencode(rpath_placeholder), os.fsencode(orchestra_root))
+    return map_chunks(_fix_rpaths_chunk, paths, root, searches)
+
+
+def replace_dynstr(path, replacements: List[Tuple[bytes, bytes]], padding=RPATH_PADDING) -> bool:
+    """Applies `replacements` ((search, replace) pairs, in order) to the dynamic string table of the ELF file at
+    `path`. Replacements shorter than their search string are padded with `padding`.
+    :returns: True if the file was modified
+    :raises OrchestraException: if a string to replace is found but its replacement is longer
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < len(ELF_MAGIC):
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            location = _dynstr_location(mapped)
+            if location is None:
+                return False
+            offset, size = location
+            original = mapped[offset : offset + size]
+
+    patched = original
+    for search, replace in replacements:
+        if search not in patched:
+            continue
+        if len(replace) > len(search):
+            raise OrchestraException(f"Cannot replace {search!r} with the longer {replace!r} in {path}")
+        patched = patched.replace(search, replace + padding * (len(search) - len(replace)))
+
+    if patched == original:
+        return False
+
+    with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0) as mapped:
+        mapped[offset : offset + size] = patched
+        mapped.flush()
+    return True
+
+
+def _fix_rpaths_chunk(paths: List[str], root, searches: Tuple[bytes, bytes]) -> List[Tuple[str, str]]:
+    rpath_placeholder, orchestra_root = searches
+    patched = []
+    for path in paths:
+        absolute_path = os.path.join(root, path)
+        if not _needs_fixing(absolute_path, orchestra_root):
+            continue
+        rpath = os.fsencode("$ORIGIN/" + os.path.relpath(root, os.path.dirname(absolute_path)))
+        if replace_dynstr(absolute_path, [(rpath_placeholder, rpath), (orchestra_root, rpath)]):
+            patched.append((path, os.fsdecode(rpath)))
+    return patched
+
+
+def _needs_fixing(path, orchestra_root: bytes) -> bool:
+    """Fast check: the file is an x86-64 ELF file which contains the orchestra root somewhere"""
+    with open(path, "rb") as f:
+        header = f.read(20)
+        if len(header) < 20 or not header.startswith(ELF_MAGIC):
+            return False
+        byte_order = {_ELFDATA2LSB: "<", _ELFDATA2MSB: ">"}.get(header[5])
+        if byte_order is None or struct.unpack_from(byte_order + "H", header, 18)[0] != _EM_X86_64:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped.find(orchestra_root) != -1
+
+
+def _dynstr_location(elf) -> Optional[Tuple[int, int]]:
+    """Returns the file offset and the size of the dynamic string table, None if `elf` is not a dynamic ELF file"""
+    if elf[:4] != ELF_MAGIC or len(elf) < 64:
+        return None
+    elf_class = elf[4]
+    byte_order = {_ELFDATA2LSB: "<", _ELFDATA2MSB: ">"}.get(elf[5])
+    if elf_class not in _HEADER_FIELDS or byte_order is None:
+        return None
+
+    def read(offset, fmt):
+        return struct.unpack_from(byte_order + fmt, elf, offset)[0]
+
+    phoff, phentsize, phnum = (read(offset, fmt) for offset, fmt in _HEADER_FIELDS[elf_class])
+    if phoff + phentsize * phnum > len(elf):
+        return None
+
+    loads = []
+    dynamic = None
+    for index in range(phnum):
+        header_offset = phoff + index * phentsize
+        p_type, p_offset, p_vaddr, p_filesz = (
+            read(header_offset + offset, fmt) for offset, fmt in _PROGRAM_HEADER_FIELDS[elf_class]
+        )
+        if p_type == _PT_LOAD:
+            loads.append((p_offset, p_vaddr, p_filesz))
+        elif p_type == _PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+    if dynamic is None:
+        return None
+
+    strtab_address = None
+    strtab_size = None
+    entry_format, entry_size = _DYNAMIC_ENTRY_FIELDS[elf_class]
+    dynamic_offset, dynamic_size = dynamic
+    for entry_offset in range(
+        dynamic_offset, min(dynamic_offset + dynamic_size, len(elf)) - entry_size + 1, entry_size
+    ):
+        d_tag, d_val = struct.unpack_from(byte_order + entry_format, elf, entry_offset)
+        if d_tag == _DT_NULL:
+            break
+        if d_tag == _DT_STRTAB:
+            strtab_address = d_val
+        elif d_tag == _DT_STRSZ:
+            strtab_size = d_val
+    if strtab_address is None or strtab_size is None:
+        return None
+
+    # DT_STRTAB is a virtual address, find the loadable segment containing it
+    for p_offset, p_vaddr, p_filesz in loads:
+        if p_vaddr <= strtab_address and strtab_address + strtab_size <= p_vaddr + p_filesz:
+            offset = strtab_address - p_vaddr + p_offset
+            if offset + strtab_size <= len(elf):
+                return offset, strtab_size
+    return None
@@ -0,0 +1,121 @@
+"""Post-install rewriting of text files (pkg-config files and headers).
+
+The rules are the Python translation of the sed commands orchestra used to run on each file (see the `*_rules`
+functions), they produce the same output. All the rules for a file are applied in memory in a single read, files not
+containing the substring a rule needs are skipped without running the regex, and only the files that actually changed
+are written.
+
+Large trees are processed by the shared process pool (see util/process_pool.py).
+"""
+import os
+import re
+import shutil
+import uuid
+from typing import List, Sequence, Tuple
+
+from .util.process_pool import map_chunks
+
+# Whitespace within a line, equivalent to sed's \s (sed never sees the newline)
+_WS = rb"[ \t\r\f\v]"
+
+
+class RewriteRule:
+    """A substitution, equivalent to a sed `s` command"""
+
+    def __init__(self, pattern: bytes, replacement: bytes, needle: bytes):
+        """
+        :param pattern: regular expression, matched in multiline mode
+        :param replacement: replacement template, as accepted by re.sub
+        :param needle: substring every match contains, files without it are skipped
+        """
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        self.replacement = replacement
+        self.needle = needle
+
+    def apply(self, content: bytes) -> bytes:
+        if self.needle not in content:
+            return content
+        return self.pattern.sub(self.replacement, content)
+
+
+def pkgconfig_rules(orchestra_root: str) -> List[RewriteRule]:
+    """Replaces the absolute orchestra root in pkg-config files with a path relative to the .pc file.
+    Equivalent to: sed -i "s|/*$ORCHESTRA_ROOT/*|\\${pcfiledir}/../..|g"
+    """
+    root = os.fsencode(orchestra_root)
+    # sed interprets the path as a regular expression, where `.` and `*` are special
+    root_regex = b"".join(c if c in (b".", b"*") else re.escape(c) for c in (root[i : i + 1] for i in range(len(root))))
+    needle = max(re.split(rb"[.*]", root), key=len)
+    return [RewriteRule(b"/*" + root_regex + b"/*", b"${pcfiledir}/../..", needle)]
+
+
+def ndebug_rules(disable_debugging: bool) -> List[RewriteRule]:
+    """Replaces the NDEBUG checks in headers with constants.
+    Equivalent to:
+        sed -i -e 's|^\\s*#\\s*ifndef\\s\\+NDEBUG|#if $DEBUG|' \\
+               -e 's|^\\s*#\\s*ifdef\\s\\+NDEBUG|#if $NDEBUG|' \\
+               -e 's|^\\(\\s*#\\s*if\\s\\+.*\\)!defined(NDEBUG)|\\1$DEBUG|' \\
+               -e 's|^\\(\\s*#\\s*if\\s\\+.*\\)defined(NDEBUG)|\\1$NDEBUG|'
+    """
+    debug, ndebug = (b"0", b"1") if disable_debugging else (b"1", b"0")
+    return [
+        RewriteRule(rb"^%s*#%s*ifndef%s+NDEBUG" % (_WS, _WS, _WS), b"#if " + debug, b"NDEBUG"),
+        RewriteRule(rb"^%s*#%s*ifdef%s+NDEBUG" % (_WS, _WS, _WS), b"#if " + ndebug, b"NDEBUG"),
+        RewriteRule(rb"^(%s*#%s*if%s+.*)!defined\(NDEBUG\)" % (_WS, _WS, _WS), rb"\g<1>" + debug, b"NDEBUG"),
+        RewriteRule(rb"^(%s*#%s*if%s+.*)defined\(NDEBUG\)" % (_WS, _WS, _WS), rb"\g<1>" + ndebug, b"NDEBUG"),
+    ]
+
+
+def asan_rules(asan_enabled: bool) -> List[RewriteRule]:
+    """Replaces the address sanitizer checks in headers with constants.
+    Equivalent to:
+        sed -i -e 's|__has_feature\\(address_sanitizer\\)|$ASAN|' -e 's|defined\\(__SANITIZE_ADDRESS__\\)|$ASAN|'
+    In basic regular expressions `\\(` and `\\)` delimit a group, so the parentheses are not part of the matched text.
+    Without the `g` flag only the first match in each line is replaced.
+    """
+    replace_with = b"1" if asan_enabled else b"0"
+    rules = []
+    for literal in (b"__has_featureaddress_sanitizer", b"defined__SANITIZE_ADDRESS__"):
+        rules.append(RewriteRule(rb"^(.*?)" + re.escape(literal), rb"\g<1>" + replace_with, literal))
+    return rules
+
+
+def rewrite_files(work: Sequence[Tuple[List[str], List[RewriteRule]]]) -> List[str]:
+    """Applies the rules to the files.
+    :param work: list of (files, rules to apply to those files)
+    :returns: the files that were modified
+    """
+    # Each file refers to its rules by index, so that the rules are sent to the process pool once per chunk
+    files = [(path, rules_index) for rules_index, (paths, _) in enumerate(work) for path in paths]
+    return map_chunks(_rewrite_chunk, files, [rules for _, rules in work])
+
+
+def _rewrite_chunk(files: List[Tuple[str, int]], rule_sets: List[List[RewriteRule]]) -> List[str]:
+    rewritten = []
+    for path, rules_index in files:
+        rules = rule_sets[rules_index]
+        with open(path, "rb") as f:
+            original_content = f.read()
+
+        content = original_content
+        for rule in rules:
+            content = rule.apply(content)
+
+        if content != original_content:
+            _replace_content(path, content)
+            rewritten.append(path)
+    return rewritten
+
+
+def _replace_content(path, content: bytes):
+    # Write a new file like sed -i does, so that other hardlinks to the file are left untouched
+    temporary_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        shutil.copymode(path, temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.lexists(temporary_path):
+            os.unlink(temporary_path)
+        raise
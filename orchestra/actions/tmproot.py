@@ -0,0 +1,214 @@
+"""Lifecycle management of the temporary roots components are installed to before being merged into the orchestra
+root.
+
+Deleting a large temporary root can take a while, so instead of removing it in place the directory is renamed to a
+trash directory (located inside $TMP_ROOTS, so the rename is cheap) and deleted by a background thread.
+Pending deletions are completed before the interpreter exits.
+
+Binary archives are compressed in background from a snapshot of the temporary root (a copy made of hardlinks), so the
+temporary root itself can be merged and discarded right away.
+
+Optionally (`prebuilt_tmproot_skeletons` configuration option) each worker thread keeps a pre-built skeleton ready,
+so preparing a temporary root becomes a single rename and the skeleton for the next install is built in background.
+"""
+import os
+import pathlib
+import shutil
+import threading
+import uuid
+from concurrent import futures
+from typing import Optional
+
+from loguru import logger
+
+from ..model.manifest import ENTRY_TYPE_DIR, ENTRY_TYPE_SYMLINK, Manifest
+from ..util import OrchestraException, remove_tree
+
+TRASH_DIRNAME = ".trash"
+SKELETONS_DIRNAME = ".skeletons"
+SNAPSHOTS_DIRNAME = ".snapshots"
+
+# Directories created in the temporary root before running the install script, relative to the orchestra root
+SKELETON_DIRS = [
+    "include",
+    "lib64",
+    "lib64/include",
+    "lib64/pkgconfig",
+    "bin",
+    "usr/lib",
+    "usr/include",
+    "share/info",
+    "share/doc",
+    "share/man",
+    "share/orchestra",
+    "libexec",
+]
+
+# Non-directory entries of the skeleton, in the format used by the installed files index
+SKELETON_FILES = [
+    "lib",
+    "share/info/dir",
+]
+
+_background_executor: Optional[futures.ThreadPoolExecutor] = None
+_background_executor_lock = threading.Lock()
+
+# Trash directories already emptied by this process
+_emptied_trash_dirs = set()
+
+
+def prepare_tmproot(config, tmp_root):
+    """Creates an empty temporary root containing the standard directory skeleton.
+    The previous content of `tmp_root`, if any, is discarded.
+    :param tmp_root: the temporary root of the build being installed
+    """
+    _empty_trash(config)
+    discard_tree(config, tmp_root)
+
+    if config.prebuilt_tmproot_skeletons and _take_skeleton(config, tmp_root):
+        _submit(_build_spare_skeleton, config, _skeleton_slot_path(config))
+        return
+
+    create_skeleton(tmp_root, config.orchestra_root)
+    if config.prebuilt_tmproot_skeletons:
+        _submit(_build_spare_skeleton, config, _skeleton_slot_path(config))
+
+
+def create_skeleton(tmp_root, orchestra_root):
+    """Creates the standard directory skeleton in `tmp_root`"""
+    root = tmp_root + orchestra_root
+    for directory in SKELETON_DIRS:
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    lib_path = os.path.join(root, "lib")
+    if not os.path.exists(lib_path):
+        os.symlink("lib64", lib_path)
+    if not os.path.islink(lib_path):
+        raise OrchestraException(f"{lib_path} should be a symlink to lib64")
+
+    pathlib.Path(root, "share", "info", "dir").touch()
+
+
+def discard_tree(config, path) -> Optional[futures.Future]:
+    """Removes `path`. Directories are moved to the trash right away and deleted in background.
+    :returns: a future completing when the directory is actually deleted, or None if nothing is left to do
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        remove_tree(path)
+        return None
+
+    trash_dir = os.path.join(config.tmproot, TRASH_DIRNAME)
+    os.makedirs(trash_dir, exist_ok=True)
+    trashed_path = os.path.join(trash_dir, uuid.uuid4().hex)
+    try:
+        os.rename(path, trashed_path)
+    except OSError as e:
+        # Most likely `path` and the trash are on different filesystems
+        logger.debug(f"Could not move {path} to the trash ({e}), removing it synchronously")
+        remove_tree(path)
+        return None
+
+    return _submit(_remove_trashed, trashed_path)
+
+
+def snapshot_tree(config, root, manifest: Manifest) -> Optional[str]:
+    """Creates a copy of `root` made of hardlinks to its files, which stays untouched when `root` is merged or removed.
+    Files must not be modified in place afterwards.
+    :param manifest: the content of `root`
+    :returns: the path of the snapshot (to be removed with `discard_tree`), None if hardlinks are not supported
+    """
+    snapshot_path = os.path.join(config.tmproot, SNAPSHOTS_DIRNAME, uuid.uuid4().hex)
+    os.makedirs(snapshot_path)
+    directories = []
+    try:
+        for entry in manifest.entries:
+            source = os.path.join(root, entry.path)
+            destination = os.path.join(snapshot_path, entry.path)
+            if entry.type == ENTRY_TYPE_DIR:
+                os.mkdir(destination)
+                directories.append((source, destination))
+            elif entry.type == ENTRY_TYPE_SYMLINK:
+                os.symlink(entry.target, destination)
+                source_stat = os.lstat(source)
+                os.utime(destination, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns), follow_symlinks=False)
+            else:
+                os.link(source, destination)
+    except OSError as e:
+        logger.debug(f"Could not snapshot {root} ({e})")
+        discard_tree(config, snapshot_path)
+        return None
+
+    # Children first, creating their entries updated the timestamps of their parent
+    for source, destination in reversed(directories):
+        shutil.copystat(source, destination)
+    return snapshot_path
+
+
+def _empty_trash(config):
+    """Schedules the removal of anything left in the trash by previous (interrupted) orchestra invocations"""
+    trash_dir = os.path.join(config.tmproot, TRASH_DIRNAME)
+    with _background_executor_lock:
+        if trash_dir in _emptied_trash_dirs:
+            return
+        _emptied_trash_dirs.add(trash_dir)
+        leftovers = os.listdir(trash_dir) if os.path.isdir(trash_dir) else []
+
+    for leftover in leftovers:
+        _submit(_remove_trashed, os.path.join(trash_dir, leftover))
+
+
+def _remove_trashed(path):
+    try:
+        remove_tree(path)
+    except FileNotFoundError:
+        # Another orchestra instance is emptying the trash too
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {e}")
+
+
+def _skeleton_slot_path(config) -> str:
+    # Worker threads are long-lived, so the thread name identifies the worker slot
+    return os.path.join(config.tmproot, SKELETONS_DIRNAME, threading.current_thread().name)
+
+
+def _take_skeleton(config, tmp_root) -> bool:
+    """Moves the skeleton pre-built for the current worker slot to `tmp_root`.
+    :returns: True if a valid skeleton was available
+    """
+    slot_path = _skeleton_slot_path(config)
+    if not os.path.exists(os.path.join(slot_path + config.orchestra_root, "share", "info", "dir")):
+        # Either missing or built for a different orchestra root
+        discard_tree(config, slot_path)
+        return False
+
+    os.makedirs(os.path.dirname(tmp_root), exist_ok=True)
+    os.rename(slot_path, tmp_root)
+    return True
+
+
+def _build_spare_skeleton(config, slot_path):
+    # Build the skeleton aside and move it in place atomically, so it is never found half-built
+    building_path = f"{slot_path}.{uuid.uuid4().hex}"
+    try:
+        create_skeleton(building_path, config.orchestra_root)
+        os.rename(building_path, slot_path)
+    except OSError as e:
+        logger.debug(f"Could not prepare a spare tmproot skeleton in {slot_path}: {e}")
+        remove_tree(building_path)
+
+
+def _submit(fn, *args) -> futures.Future:
+    global _background_executor
+    with _background_executor_lock:
+        if _background_executor is None:
+            _background_executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="Tmproot cleaner")
+        return _background_executor.submit(fn, *args)
+
+
+def wait_for_background_tasks():
+    """Blocks until all the pending removals and skeleton builds are completed"""
+    with _background_executor_lock:
+        executor = _background_executor
+    if executor is not None:
+        executor.submit(lambda: None).result()
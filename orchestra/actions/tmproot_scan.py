@@ -0,0 +1,176 @@
+"""Typed scan of a temporary root, shared by the post-install steps and by the indexing of the installed files.
+
+The temporary root is walked once, right after the install script. The post-install steps select the files they work
+on from the scan instead of walking the tree again, and keep it up to date with the changes they make, so at the end
+it can be turned into the manifest of the installed files.
+"""
+import os
+import stat
+from typing import Iterable, List
+
+from ..model.manifest import (
+    ENTRY_TYPE_DIR,
+    ENTRY_TYPE_FILE,
+    ENTRY_TYPE_SYMLINK,
+    Manifest,
+    ManifestEntry,
+    file_digest,
+    walk_directory,
+)
+from .rpath import ELF_MAGIC
+
+
+class ScannedEntry:
+    __slots__ = ("path", "type", "size", "mode", "inode", "nlink", "target", "is_elf")
+
+    def __init__(self, path, type, *, size=None, mode=None, inode=None, nlink=None, target=None, is_elf=False):
+        """
+        :param path: path relative to the root of the scanned directory
+        :param type: one of ENTRY_TYPE_DIR, ENTRY_TYPE_FILE, ENTRY_TYPE_SYMLINK
+        :param size: size of regular files
+        :param mode: permission bits of regular files
+        :param inode: inode number of regular files
+        :param nlink: number of hardlinks of regular files
+        :param target: target of symlinks
+        :param is_elf: True for executable regular files starting with the ELF magic
+        """
+        self.path = path
+        self.type = type
+        self.size = size
+        self.mode = mode
+        self.inode = inode
+        self.nlink = nlink
+        self.target = target
+        self.is_elf = is_elf
+
+    @property
+    def extension(self) -> str:
+        """The part of the file name starting from the last dot (e.g. `.h`), empty if there is no dot"""
+        name = os.path.basename(self.path)
+        dot = name.rfind(".")
+        return name[dot:] if dot != -1 else ""
+
+    @property
+    def is_executable(self) -> bool:
+        return self.type == ENTRY_TYPE_FILE and bool(self.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+
+    def convert_to_symlink(self, target):
+        self.type = ENTRY_TYPE_SYMLINK
+        self.target = target
+        self.size = self.mode = self.inode = self.nlink = None
+        self.is_elf = False
+
+    def update_from_stat(self, stat_result: os.stat_result):
+        self.size = stat_result.st_size
+        self.mode = stat.S_IMODE(stat_result.st_mode)
+        self.inode = stat_result.st_ino
+        self.nlink = stat_result.st_nlink
+
+
+class TmprootScan:
+    def __init__(self, root, entries: Iterable[ScannedEntry]):
+        """
+        :param root: the scanned directory (the orchestra root inside the temporary root)
+        :param entries: the content of `root`, in the same order os.walk would visit it
+        """
+        self.root = root
+        self.entries: List[ScannedEntry] = list(entries)
+
+    def files(self, extension=None, under=None) -> List[ScannedEntry]:
+        """Returns the regular files, optionally filtered.
+        :param extension: only return files with this extension (see ScannedEntry.extension)
+        :param under: only return files contained in this directory, relative to the root. Symlinks in this path are
+                      resolved, like `find <under>` would do
+        """
+        prefix = None
+        if under is not None:
+            resolved = os.path.relpath(os.path.realpath(os.path.join(self.root, under)), os.path.realpath(self.root))
+            if resolved == os.pardir or resolved.startswith(os.pardir + os.sep):
+                return []
+            prefix = "" if resolved == os.curdir else resolved + "/"
+
+        return [
+            e
+            for e in self.entries
+            if e.type == ENTRY_TYPE_FILE
+            and (extension is None or e.extension == extension)
+            and (prefix is None or e.path.startswith(prefix))
+        ]
+
+    def remove(self, removed: Iterable[ScannedEntry]):
+        removed_ids = {id(e) for e in removed}
+        self.entries = [e for e in self.entries if id(e) not in removed_ids]
+
+    def refresh(self, paths: Iterable[str]):
+        """Updates the entries of regular files rewritten after the scan
+        :param paths: the rewritten files, relative to the root
+        """
+        paths = set(paths)
+        for entry in self.entries:
+            if entry.path in paths:
+                entry.update_from_stat(os.lstat(os.path.join(self.root, entry.path)))
+
+    def add_file(self, path):
+        """Adds a regular file created after the scan
+        :param path: relative to the root
+        """
+        entry = ScannedEntry(path, ENTRY_TYPE_FILE)
+        entry.update_from_stat(os.lstat(os.path.join(self.root, path)))
+
+        positions = {e.path: index for index, e in enumerate(self.entries)}
+        if path in positions:
+            self.entries[positions[path]] = entry
+            return
+
+        parent = os.path.dirname(path)
+        if not parent or parent in positions:
+            # Files are listed right after the entry of their directory
+            self.entries.insert(positions[parent] + 1 if parent else 0, entry)
+            return
+
+        # Parents always come before their content
+        missing_dirs = []
+        while parent and parent not in positions:
+            missing_dirs.insert(0, ScannedEntry(parent, ENTRY_TYPE_DIR))
+            parent = os.path.dirname(parent)
+        self.entries.extend(missing_dirs)
+        self.entries.append(entry)
+
+    def to_manifest(self, compute_digests=False) -> Manifest:
+        """Returns the manifest of the scanned directory.
+        :param compute_digests: if True the sha256 of regular files is computed
+        """
+        entries = []
+        for e in self.entries:
+            if e.type == ENTRY_TYPE_FILE:
+                digest = file_digest(os.path.join(self.root, e.path)) if compute_digests else None
+                entries.append(ManifestEntry(e.path, ENTRY_TYPE_FILE, size=e.size, digest=digest, mode=e.mode))
+            elif e.type == ENTRY_TYPE_SYMLINK:
+                entries.append(ManifestEntry(e.path, ENTRY_TYPE_SYMLINK, target=e.target))
+            else:
+                entries.append(ManifestEntry(e.path, ENTRY_TYPE_DIR))
+        return Manifest(entries)
+
+
+def scan_tmproot(root) -> TmprootScan:
+    """Scans `root` with a single os.scandir walk, symlinks are never followed"""
+    entries = []
+    for relative_path, dir_entry in walk_directory(root):
+        if dir_entry.is_symlink():
+            entries.append(ScannedEntry(relative_path, ENTRY_TYPE_SYMLINK, target=os.readlink(dir_entry.path)))
+        elif dir_entry.is_dir():
+            entries.append(ScannedEntry(relative_path, ENTRY_TYPE_DIR))
+        else:
+            entry = ScannedEntry(relative_path, ENTRY_TYPE_FILE)
+            entry.update_from_stat(dir_entry.stat(follow_symlinks=False))
+            entry.is_elf = entry.is_executable and _has_elf_magic(dir_entry.path)
+            entries.append(entry)
+    return TmprootScan(root, entries)
+
+
+def _has_elf_magic(path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(ELF_MAGIC)) == ELF_MAGIC
+    except OSError:
+        return False
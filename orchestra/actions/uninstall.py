@@ -1,57 +1,119 @@
+import errno
 import os
+from concurrent import futures
+from typing import Iterable, List, Set
 
 from loguru import logger
 
+from .path_shim import update_path_shim
 from ..model.install_metadata import (
     load_file_list,
     installed_component_file_list_path,
     installed_component_metadata_path,
 )
 
+# Number of files handled by a single task submitted to the thread pool
+_CHUNK_SIZE = 256
+
 
 def uninstall(component_name, config):
-    index_path = installed_component_file_list_path(component_name, config)
-    metadata_path = installed_component_metadata_path(component_name, config)
+    uninstall_components([component_name], config)
 
-    # Index and metadata files should be removed last,
-    # so an interrupted uninstall can be resumed
-    postpone_removal_paths = [
-        os.path.relpath(index_path, config.orchestra_root),
-        os.path.relpath(metadata_path, config.orchestra_root),
-    ]
 
-    paths = load_file_list(component_name, config)
+def uninstall_components(component_names: Iterable[str], config, jobs=None):
+    """Uninstalls several components at once.
+    The files of all the components are deleted in parallel, then the directories left empty are removed with a single
+    sweep, deepest first. Index and metadata files are removed last, so an interrupted uninstall can be resumed.
+    :param jobs: number of threads deleting files, None to use the ThreadPoolExecutor default
+    """
+    component_names = list(component_names)
+    orchestra_root = config.orchestra_root
 
-    # Ensure depth first visit by reverse-sorting
-    # paths.sort(reverse=True)
-    paths = [path.strip() for path in paths]
+    postponed_removal_paths = []
+    for component_name in component_names:
+        postponed_removal_paths.append(installed_component_file_list_path(component_name, config))
+        postponed_removal_paths.append(installed_component_metadata_path(component_name, config))
+    postponed_relative_paths = {os.path.relpath(p, orchestra_root) for p in postponed_removal_paths}
 
-    for path in paths:
-        # Ensure the path is relative to the root
-        path = path.lstrip("/")
+    paths = []
+    for component_name in component_names:
+        for path in load_file_list(component_name, config):
+            # Ensure the path is relative to the root
+            path = path.strip().lstrip("/")
+            if path and path not in postponed_relative_paths:
+                paths.append(path)
 
-        if path in postpone_removal_paths:
-            continue
+    chunks = [paths[i : i + _CHUNK_SIZE] for i in range(0, len(paths), _CHUNK_SIZE)]
+    deleted_files = 0
+    listed_dirs = set()
+    if len(chunks) <= 1:
+        results = [_delete_files(orchestra_root, chunk) for chunk in chunks]
+    else:
+        with futures.ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="Uninstaller") as executor:
+            results = list(executor.map(lambda chunk: _delete_files(orchestra_root, chunk), chunks))
+    for chunk_deleted_files, chunk_dirs in results:
+        deleted_files += chunk_deleted_files
+        listed_dirs.update(chunk_dirs)
+
+    deleted_dirs = _remove_empty_dirs(orchestra_root, _parent_dirs(paths) | listed_dirs)
+    logger.debug(f"Deleted {deleted_files} files and {deleted_dirs} empty directories")
+
+    if config.compact_path:
+        update_path_shim(config, (os.path.join(orchestra_root, p) for p in paths))
 
-        path_to_delete = os.path.join(config.global_env()["ORCHESTRA_ROOT"], path)
+    for path in postponed_removal_paths:
+        logger.debug(f"Deleting {path}")
+        os.remove(path)
 
-        if os.path.isfile(path_to_delete) or os.path.islink(path_to_delete):
-            logger.debug(f"Deleting {path_to_delete}")
-            os.remove(path_to_delete)
-        elif os.path.isdir(path_to_delete):
-            if os.listdir(path_to_delete):
-                logger.debug(f"Not removing directory {path_to_delete} as it is not empty")
-            else:
-                logger.debug(f"Deleting directory {path_to_delete}")
-                os.rmdir(path_to_delete)
 
-        containing_directory = os.path.dirname(path_to_delete)
-        if os.path.exists(containing_directory) and len(os.listdir(containing_directory)) == 0:
-            logger.debug(f"Removing empty directory {containing_directory}")
-            os.rmdir(containing_directory)
+def _delete_files(orchestra_root, paths: List[str]):
+    """Deletes files and symlinks, returns the number of deleted files and the paths that are directories"""
+    deleted_files = 0
+    dirs = []
+    for path in paths:
+        path_to_delete = os.path.join(orchestra_root, path)
+        try:
+            os.unlink(path_to_delete)
+            deleted_files += 1
+        except FileNotFoundError:
+            # Already deleted by an interrupted uninstall
+            pass
+        except (IsADirectoryError, PermissionError):
+            # Indexes may list directories, unlink(2) fails with EISDIR on Linux and EPERM elsewhere
+            if os.path.islink(path_to_delete) or not os.path.isdir(path_to_delete):
+                raise
+            dirs.append(path)
+    return deleted_files, dirs
+
 
-    logger.debug(f"Deleting index file {index_path}")
-    os.remove(index_path)
+def _parent_dirs(paths: Iterable[str]) -> Set[str]:
+    parents = set()
+    for path in paths:
+        parent = os.path.dirname(path)
+        while parent and parent not in parents:
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+    return parents
 
-    logger.debug(f"Deleting metadata file {metadata_path}")
-    os.remove(metadata_path)
+
+def _remove_empty_dirs(orchestra_root, dirs: Set[str]) -> int:
+    """Removes the directories among `dirs` that are empty, returns how many were removed.
+    `dirs` must contain the parents of each of its elements (the orchestra root excluded).
+    """
+    removed_dirs = 0
+    non_empty_dirs = set()
+    for path in sorted(dirs, key=lambda p: p.count("/"), reverse=True):
+        if path in non_empty_dirs:
+            non_empty_dirs.add(os.path.dirname(path))
+            continue
+        try:
+            os.rmdir(os.path.join(orchestra_root, path))
+            removed_dirs += 1
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                continue
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOTDIR):
+                raise
+            # A directory that is not empty keeps its parents from being empty too
+            non_empty_dirs.add(os.path.dirname(path))
+    return removed_dirs
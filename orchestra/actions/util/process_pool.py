@@ -0,0 +1,52 @@
+"""A pool of processes shared by the CPU-bound post-install steps.
+
+The pool is started from a fork server, so the process being forked is never one running builder threads.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent import futures
+from typing import Callable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Number of items handled by a single task submitted to the process pool
+CHUNK_SIZE = 128
+
+# Below this number of items the work is done in the calling process
+MIN_ITEMS_FOR_PROCESS_POOL = 256
+
+_process_pool: Optional[futures.ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def map_chunks(
+    function: Callable[..., List[R]],
+    items: Sequence[T],
+    *args,
+    chunk_size=CHUNK_SIZE,
+    min_items_for_pool=MIN_ITEMS_FOR_PROCESS_POOL,
+) -> List[R]:
+    """Splits `items` in chunks, calls `function(chunk, *args)` on each of them and returns the concatenation of the
+    results, in order.
+    :param function: a module-level function, so it can be pickled
+    :param min_items_for_pool: with fewer items, or if there is a single CPU, the chunks are processed in the calling
+             process
+    """
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    if len(items) < min_items_for_pool or len(chunks) <= 1 or (os.cpu_count() or 1) == 1:
+        results = [function(chunk, *args) for chunk in chunks]
+    else:
+        results = _get_process_pool().map(function, chunks, *([arg] * len(chunks) for arg in args))
+    return [result for chunk_result in results for result in chunk_result]
+
+
+def _get_process_pool() -> futures.ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["orchestra"])
+            _process_pool = futures.ProcessPoolExecutor(mp_context=context)
+        return _process_pool
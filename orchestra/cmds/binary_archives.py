@@ -4,9 +4,12 @@ from loguru import logger
 
 from . import SubCommandParser
 from .fix_binary_archives_symlinks import handle_fix_binary_archives_symlinks
+from ..actions.binary_archives_cache import evict_binary_archives, parse_size
+from ..actions.binary_archives_storage import GIT_LFS, INDEX_FILENAME, scan_files, write_index
 from ..actions.util import get_script_output
 from ..gitutils import is_root_of_git_repo
 from ..model.configuration import Configuration
+from ..model.manifest import manifest_path_for_archive
 
 
 def install_subcommand(sub_argparser: SubCommandParser):
@@ -33,43 +36,72 @@ def install_subcommand(sub_argparser: SubCommandParser):
         help="Fix symlinks in binary archives",
     )
 
+    write_index_subcmd = cmd_parser.add_subcmd(
+        "write-index",
+        handler=handle_write_index,
+        help="Write the index.json listing the binary archives in a directory, to publish it over HTTP",
+    )
+    write_index_subcmd.add_argument("directory", help="Directory containing the binary archives")
+
     clean_subcmd = cmd_parser.add_subcmd("clean", handler=handle_clean, help="Delete stale binary archives")
     clean_subcmd.add_argument(
         "--pretend",
         action="store_true",
         help="Only print what would be done. Deleted files are printed at DEBUG loglevel",
     )
+    clean_subcmd.add_argument(
+        "--max-size",
+        help="Also evict the least recently used archives until the local cache fits in this size (e.g. 50G). "
+        "Defaults to binary_archives_cache_size",
+    )
 
 
 def handle_clean(args):
     config = Configuration(use_config_cache=args.config_cache)
-    for name, path in config.binary_archives_local_paths.items():
+    for name, storage in config.binary_archives_storages.items():
+        if storage.type != GIT_LFS:
+            continue
+        path = storage.local_path
         if is_root_of_git_repo(path):
             logger.info(f"Cleaning binary archive {name}")
             unneeded_files = find_unreferenced_archives(path)
 
             for file in unneeded_files:
                 abspath = os.path.join(path, file)
-                if os.path.exists(abspath):
-                    logger.debug(f"Deleting {file}")
-                    if not args.pretend:
-                        os.unlink(abspath)
+                for file_to_delete in [abspath, manifest_path_for_archive(abspath)]:
+                    if os.path.exists(file_to_delete):
+                        logger.debug(f"Deleting {os.path.relpath(file_to_delete, path)}")
+                        if not args.pretend:
+                            os.unlink(file_to_delete)
 
         elif os.path.exists(path):
             logger.warning(f"Path {path} is not the root of a git repository, skipping")
 
+    max_size = parse_size(args.max_size) if args.max_size is not None else config.binary_archives_cache_size
+    if max_size is not None:
+        evicted, freed = evict_binary_archives(config, max_size, pretend=args.pretend)
+        action = "Would evict" if args.pretend else "Evicted"
+        logger.info(f"{action} {evicted} binary archives from the local cache ({freed / 1024 ** 2:.1f} MiB)")
+
     return 0
 
 
 def handle_ls(args):
     config = Configuration(use_config_cache=args.config_cache)
-    for name in config.binary_archives_remotes.keys():
-        path = os.path.join(config.binary_archives_dir, name)
+    for path in config.binary_archives_local_paths.values():
         if args.include_non_cloned or os.path.exists(path):
             print(path)
     return 0
 
 
+def handle_write_index(args):
+    files = scan_files(args.directory)
+    files.discard(INDEX_FILENAME)
+    write_index(args.directory, files)
+    logger.info(f"Indexed {len(files)} files")
+    return 0
+
+
 def find_unreferenced_archives(binary_archive_path):
     """Finds archives tracked by git-lfs but not referenced by any symlink
     :param binary_archive_path: path to the binary archive git lfs repository
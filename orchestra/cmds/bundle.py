@@ -0,0 +1,79 @@
+from loguru import logger
+
+from . import SubCommandParser
+from .common import build_options
+from ..actions.archive import Compression
+from ..actions.bundle import DEFAULT_BUNDLE_COMPRESSION, create_bundle, install_bundle
+from ..executor import Executor
+from ..model.configuration import Configuration
+from ..util import OrchestraException
+
+
+def install_subcommand(sub_argparser: SubCommandParser):
+    cmd_parser = sub_argparser.add_subcmd(
+        "bundle",
+        help="Package installed components with their dependencies, to bootstrap a new root at once",
+    )
+
+    create_subcmd = cmd_parser.add_subcmd(
+        "create",
+        handler=handle_create,
+        help="Create a bundle of installed components and of their dependencies",
+        parents=[build_options],
+    )
+    create_subcmd.add_argument("components", nargs="+", help="Name of the components to bundle")
+    create_subcmd.add_argument(
+        "--output",
+        "-o",
+        required=True,
+        help="Path of the bundle, its extension must match the compression (e.g. bundle.tar.zst)",
+    )
+    create_subcmd.add_argument(
+        "--compression",
+        default=DEFAULT_BUNDLE_COMPRESSION,
+        help=f"Compression, in the binary archives format (default: {DEFAULT_BUNDLE_COMPRESSION})",
+    )
+
+    install_subcmd = cmd_parser.add_subcmd(
+        "install",
+        handler=handle_install,
+        help="Install a bundle into an empty orchestra root",
+    )
+    install_subcmd.add_argument("bundle", help="Path of the bundle")
+
+
+def handle_create(args):
+    config = Configuration(
+        fallback_to_build=args.fallback_build,
+        force_from_source=args.from_source,
+        use_config_cache=args.config_cache,
+    )
+
+    actions = set()
+    for component in args.components:
+        build = config.get_build(component)
+        if not build:
+            suggested_component_name = config.get_suggested_component_name(component)
+            logger.error(f"Component {component} not found! Did you mean {suggested_component_name}?")
+            return 1
+        actions.add(build.install)
+
+    install_actions = Executor(actions).solved_install_actions()
+    try:
+        index = create_bundle(config, install_actions, args.output, Compression(args.compression))
+    except OrchestraException as e:
+        logger.error(str(e))
+        return 1
+    logger.info(f"Bundled {len(index['components'])} components ({index['files']} files) in {args.output}")
+    return 0
+
+
+def handle_install(args):
+    config = Configuration(use_config_cache=args.config_cache)
+    try:
+        index = install_bundle(config, args.bundle)
+    except OrchestraException as e:
+        logger.error(str(e))
+        return 1
+    logger.info(f"Installed {len(index['components'])} components from {args.bundle}")
+    return 0
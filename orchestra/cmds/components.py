@@ -115,6 +115,7 @@ def print_json(components, config):
             "hash": component.self_hash,
             "recursive_hash": component.recursive_hash,
             "default_build": component.default_build.name,
+            "compiler_cache_stats": metadata.compiler_cache_stats if metadata else None,
             "builds": {},
         }
 
@@ -0,0 +1,38 @@
+from loguru import logger
+
+from . import SubCommandParser
+from .common import build_options
+from ..executor import Executor
+from ..model.configuration import Configuration
+
+
+def install_subcommand(sub_argparser: SubCommandParser):
+    cmd_parser = sub_argparser.add_subcmd(
+        "fetch",
+        handler=handle_fetch,
+        help="Fetch the binary archives needed to install components, without installing them",
+        parents=[build_options],
+    )
+    cmd_parser.add_argument("components", nargs="+", help="Name of the components to fetch")
+    cmd_parser.add_argument("--no-force", action="store_true", help="Don't fetch archives of installed components")
+    cmd_parser.add_argument("--no-deps", action="store_true", help="Only fetch the requested components")
+
+
+def handle_fetch(args):
+    config = Configuration(
+        fallback_to_build=args.fallback_build,
+        force_from_source=args.from_source,
+        use_config_cache=args.config_cache,
+    )
+
+    actions = set()
+    for component in args.components:
+        build = config.get_build(component)
+        if not build:
+            suggested_component_name = config.get_suggested_component_name(component)
+            logger.error(f"Component {component} not found! Did you mean {suggested_component_name}?")
+            return 1
+        actions.add(build.install)
+
+    executor = Executor(actions, no_deps=args.no_deps, no_force=args.no_force)
+    return 0 if executor.fetch_binary_archives() else 1
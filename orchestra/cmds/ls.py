@@ -38,8 +38,7 @@ def handle_ls(args):
 
             print(source_path)
     elif args.binary_archives:
-        for name in config.binary_archives_remotes.keys():
-            path = os.path.join(config.binary_archives_dir, name)
+        for path in config.binary_archives_local_paths.values():
             if os.path.exists(path):
                 print(path)
 
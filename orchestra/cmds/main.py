@@ -2,16 +2,19 @@ import argparse
 
 from . import SubCommandParser
 from . import binary_archives
+from . import bundle
 from . import clean
 from . import clone
 from . import components
 from . import configure
 from . import inspect
 from . import environment
+from . import fetch
 from . import fix_binary_archives_symlinks
 from . import graph
 from . import install
 from . import ls
+from . import object_store
 from . import shell
 from . import uninstall
 from . import update
@@ -53,6 +56,8 @@ subcommands = [
     clone,
     configure,
     install,
+    fetch,
+    bundle,
     uninstall,
     clean,
     update,
@@ -63,6 +68,7 @@ subcommands = [
     fix_binary_archives_symlinks,
     inspect,
     binary_archives,
+    object_store,
     version,
 ]
 
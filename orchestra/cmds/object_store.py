@@ -0,0 +1,27 @@
+from loguru import logger
+
+from . import SubCommandParser
+from ..actions.object_store import ObjectStore
+from ..model.configuration import Configuration
+
+
+def install_subcommand(sub_argparser: SubCommandParser):
+    cmd_parser = sub_argparser.add_subcmd(
+        "object-store",
+        help="Manipulate the store of installed files",
+    )
+    gc_subcmd = cmd_parser.add_subcmd("gc", handler=handle_gc, help="Delete objects not used by any orchestra root")
+    gc_subcmd.add_argument(
+        "--pretend",
+        action="store_true",
+        help="Only print what would be done. Deleted objects are printed at DEBUG loglevel",
+    )
+
+
+def handle_gc(args):
+    config = Configuration(use_config_cache=args.config_cache)
+    store = ObjectStore(config.object_store_dir)
+    deleted_objects, freed_bytes = store.gc(pretend=args.pretend)
+    action = "Would delete" if args.pretend else "Deleted"
+    logger.info(f"{action} {deleted_objects} objects ({freed_bytes / 1024 ** 2:.1f} MiB)")
+    return 0
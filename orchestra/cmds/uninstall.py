@@ -1,7 +1,7 @@
 from loguru import logger
 
 from . import SubCommandParser
-from ..actions.install import uninstall
+from ..actions.uninstall import uninstall_components
 from ..model.configuration import Configuration
 from ..model.install_metadata import is_installed
 from ..util import parse_component_name
@@ -23,8 +23,8 @@ def handle_uninstall(args):
         else:
             component_names_to_uninstall.add(component_name)
 
-    for component_name in component_names_to_uninstall:
+    for component_name in sorted(component_names_to_uninstall):
         logger.info(f"Uninstalling {component_name}")
-        uninstall(component_name, config)
+    uninstall_components(sorted(component_names_to_uninstall), config)
 
     return 0
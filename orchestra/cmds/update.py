@@ -6,8 +6,10 @@ from tqdm import tqdm
 
 from . import SubCommandParser
 from ..model.configuration import Configuration
-from ..actions.util import run_internal_subprocess, try_run_internal_subprocess
+from ..actions.binary_archives_storage import GIT_LFS
+from ..actions.util import try_run_internal_subprocess
 from ..gitutils import is_root_of_git_repo
+from ..model.install_metadata import is_installed
 
 
 def install_subcommand(sub_argparser: SubCommandParser):
@@ -20,6 +22,7 @@ def handle_update(args):
     config = Configuration(use_config_cache=args.config_cache)
     failed_pulls = []
     failed_clones = []
+    failed_updates = []
 
     if not args.no_config:
         logger.info("Updating orchestra configuration")
@@ -28,18 +31,19 @@ def handle_update(args):
 
     logger.info("Updating binary archives")
     os.makedirs(config.binary_archives_dir, exist_ok=True)
-    progress_bar = tqdm(config.binary_archives_remotes.items(), unit="archives")
-    for name, url in progress_bar:
-        binary_archive_path = os.path.join(config.binary_archives_dir, name)
+    progress_bar = tqdm(config.binary_archives_storages.items(), unit="archives")
+    for name, storage in progress_bar:
         progress_bar.set_postfix_str(f"{name}")
-        if os.path.exists(binary_archive_path):
-            logger.debug(f"Pulling binary archive {name}")
-            if not pull_binary_archive(name, config):
-                failed_pulls.append(f"Binary archive {name} ({os.path.join(config.binary_archives_dir, name)})")
+        cloned = os.path.exists(storage.local_path)
+        if storage.update():
+            continue
+        if storage.type != GIT_LFS:
+            failed_updates.append(f"Binary archive {name} ({storage.url})")
+        elif cloned:
+            failed_pulls.append(f"Binary archive {name} ({storage.local_path})")
         else:
-            logger.info(f"Trying to clone binary archive from remote {name} ({url})")
-            if not clone_binary_archive(name, url, config):
-                failed_clones.append(f"Binary archive {name} ({url})!")
+            failed_clones.append(f"Binary archive {name} ({storage.url})!")
+    config.binary_archives_index.invalidate()
 
     logger.info("Resetting ls-remote cached info")
     ls_remote_cache = os.path.join(config.orchestra_dotdir, "remote_refs_cache.json")
@@ -75,6 +79,18 @@ def handle_update(args):
             if not git_pull(source_path):
                 failed_pulls.append(f"Repository {component.name}")
 
+    # Commits might have changed either because a repository was pulled or because the remote HEADs cache was updated
+    changed_components = config.update_hashes(c for c in config.components.values() if c.clone)
+    outdated_components = [
+        c.name
+        for c in changed_components
+        if is_installed(config, c.name) and not is_installed(config, c.name, wanted_recursive_hash=c.recursive_hash)
+    ]
+    if outdated_components:
+        formatted_outdated_components = "\n".join(f"  - {name}" for name in sorted(outdated_components))
+        logger.info(f"The following installed components are outdated:\n{formatted_outdated_components}")
+        logger.info("Run `orc upgrade` to update them")
+
     if failed_pulls:
         formatted_failed_pulls = "\n".join([f"  - {repo}" for repo in failed_pulls])
         # Note: f-strings don't account for indentation, using a template is more practical
@@ -109,48 +125,27 @@ def handle_update(args):
         failed_git_clone_suggestion = failed_git_clone_template.format(formatted_failed_clones=formatted_failed_clones)
         logger.error(failed_git_clone_suggestion)
 
-    if failed_pulls or failed_clones:
+    if failed_updates:
+        formatted_failed_updates = "\n".join([f"  - {repo}" for repo in failed_updates])
+        failed_update_template = dedent(
+            """
+            Could not update the following binary archives:
+            {formatted_failed_updates}
+
+            Suggestions:
+                - check your network connection
+                - check that the directory is mounted, or that the HTTP server serves an index.json
+            """
+        )
+        failed_update_suggestion = failed_update_template.format(formatted_failed_updates=formatted_failed_updates)
+        logger.error(failed_update_suggestion)
+
+    if failed_pulls or failed_clones or failed_updates:
         return 1
     else:
         return 0
 
 
-def clone_binary_archive(name, url, config):
-    """Clones a binary archive. Returns a boolean value representing the operation success."""
-    binary_archive_path = os.path.join(config.binary_archives_dir, name)
-    env = os.environ.copy()
-    env["GIT_SSH_COMMAND"] = "ssh -oControlPath=~/.ssh/ssh-mux-%r@%h:%p -oControlMaster=auto -o ControlPersist=10"
-    env["GIT_LFS_SKIP_SMUDGE"] = "1"
-    returncode = try_run_internal_subprocess(
-        ["git", "clone", url, binary_archive_path],
-        environment=env,
-    )
-    return returncode == 0
-
-
-def pull_binary_archive(name, config):
-    binary_archive_path = os.path.join(config.binary_archives_dir, name)
-    # This check is to ensure we are called with the path of an existing binary archive
-    # and don't clean/reset orchestra configuration
-    if not is_root_of_git_repo(binary_archive_path):
-        raise Exception(f"{binary_archive_path} is not the root of a git repo, aborting")
-    # clean removes untracked files
-    git_clean(binary_archive_path)
-    # reset restores tracked files to their committed version
-    git_reset_hard(binary_archive_path, ref="origin/master")
-    return git_pull(binary_archive_path)
-
-
-def git_clean(directory):
-    return run_internal_subprocess(["git", "clean", "-d", "--force"], cwd=directory)
-
-
-def git_reset_hard(directory, ref="master"):
-    env = os.environ.copy()
-    env["GIT_LFS_SKIP_SMUDGE"] = "1"
-    return run_internal_subprocess(["git", "reset", "--hard", ref], cwd=directory, environment=env)
-
-
 def git_pull(directory):
     """Runs git pull --ff-only on the given directory.
     Returns a boolean value representing the operation success."""
@@ -7,7 +7,7 @@ import time
 from collections import defaultdict
 from concurrent import futures
 from itertools import permutations, product
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 import enlighten
 import networkx as nx
@@ -16,6 +16,10 @@ from loguru import logger
 
 from .actions import AnyOfAction, InstallAction
 from .actions.action import Action, ActionForBuild
+from .actions.archive_queue import wait_for_archive_creations
+from .actions.binary_archives_cache import evict_binary_archives
+from .actions.binary_archives_storage import BinaryArchivesStorage
+from .actions.lfs_prefetch import prefetch_binary_archives, wait_for_all_prefetches, wait_for_prefetch
 from .util import set_terminal_title, OrchestraException
 
 DUMMY_ROOT = "Dummy root"
@@ -34,6 +38,7 @@ class Executor:
         self._queued_actions: Dict[futures.Future, Action] = {}
         self._running_actions: List[Action] = []
         self._failed_actions: List[Action] = []
+        self._completed_actions: List[Action] = []
         self._stop_the_world = False
 
         self._total_remaining = None
@@ -47,6 +52,10 @@ class Executor:
 
         self._verify_binary_archives_exist(dependency_graph)
 
+        if not self.pretend:
+            self._evict_binary_archives(dependency_graph)
+            prefetch_binary_archives(self._binary_archives_to_fetch(dependency_graph))
+
         self._init_toposorter(dependency_graph)
 
         try:
@@ -97,14 +106,43 @@ class Executor:
                         logger.error(f"An unexpected exception occurred while running {action}")
                         logger.error(exception)
                 else:
+                    self._completed_actions.append(action)
                     self._toposorter.done(action)
 
         assert len(self._queued_actions) == 0 and len(self._running_actions) == 0
 
         self._stop_display_update()
+        wait_for_all_prefetches()
+        self._failed_actions.extend(wait_for_archive_creations())
+
+        summary = [line for line in (a.run_summary() for a in self._completed_actions) if line is not None]
+        if summary:
+            logger.info("Summary:\n" + "\n".join(summary))
 
         return list(self._failed_actions)
 
+    def fetch_binary_archives(self) -> bool:
+        """Fetches the binary archives that running the actions would extract, without running them
+        :returns: True if all the archives were fetched
+        """
+        archives = self._binary_archives_to_fetch(self._create_dependency_graph())
+        logger.info(f"Fetching {len(archives)} binary archives")
+        prefetch_binary_archives(archives)
+        success = all(
+            wait_for_prefetch(os.path.join(storage.local_path, relative_path)) for storage, relative_path in archives
+        )
+        wait_for_all_prefetches()
+        return success
+
+    def solved_install_actions(self) -> List[InstallAction]:
+        """Returns the install actions of the solved dependency graph, installed ones included, dependencies first"""
+        dependency_graph = self._create_dependency_graph(remove_satisfied=False)
+        return [
+            action
+            for action in reversed(list(nx.topological_sort(dependency_graph)))
+            if isinstance(action, InstallAction)
+        ]
+
     def _create_dependency_graph(
         self,
         remove_unreachable=True,
@@ -417,6 +455,30 @@ class Executor:
                     Try `orc update` or run `orc install` with `-b`."""
                 )
 
+    @staticmethod
+    def _evict_binary_archives(dependency_graph):
+        """Keeps the binary archives available locally within the configured size, without evicting the ones that
+        will be installed
+        """
+        install_actions = [a for a in dependency_graph.nodes if isinstance(a, InstallAction)]
+        if not install_actions or install_actions[0].config.binary_archives_cache_size is None:
+            return
+        config = install_actions[0].config
+        needed_archives = [
+            a.locate_binary_archive() for a in install_actions if a.allow_binary_archive and a.binary_archive_exists()
+        ]
+        evicted, freed = evict_binary_archives(config, config.binary_archives_cache_size, keep=needed_archives)
+        if evicted:
+            logger.info(f"Evicted {evicted} binary archives from the local cache ({freed / 1024 ** 2:.1f} MiB)")
+
+    @staticmethod
+    def _binary_archives_to_fetch(dependency_graph) -> List[Tuple[BinaryArchivesStorage, str]]:
+        return [
+            action.binary_archive_location()
+            for action in dependency_graph.nodes
+            if isinstance(action, InstallAction) and action.will_fetch_binary_archive()
+        ]
+
     def _init_toposorter(self, dependency_graph):
         for action in dependency_graph.nodes:
             dependencies = dependency_graph.successors(action)
@@ -47,6 +47,37 @@ def current_branch_info(repo_path):
         return None, None
 
 
+def upstream_commit(repo_path) -> Optional[str]:
+    """Returns the commit of the upstream branch of the branch checked out in `repo_path`, None if it has none"""
+    output = try_get_subprocess_output(["git", "rev-parse", "--verify", "--quiet", "@{upstream}"], cwd=repo_path)
+    if output is None:
+        return None
+    return output.strip() or None
+
+
+def head_fingerprint(repo_path) -> Optional[tuple]:
+    """Returns a value which changes whenever the branch or the commit checked out in `repo_path` changes, without
+    invoking git. Returns None if it cannot be determined (e.g. `.git` is not a directory).
+    """
+    git_dir = os.path.join(repo_path, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+
+    fingerprint = [head]
+    if head.startswith("ref: "):
+        # Refs are updated by renaming a new file over the old one
+        for ref_path in (os.path.join(git_dir, head[len("ref: ") :]), os.path.join(git_dir, "packed-refs")):
+            try:
+                ref_stat = os.stat(ref_path)
+                fingerprint.append((ref_stat.st_ino, ref_stat.st_mtime_ns, ref_stat.st_size))
+            except FileNotFoundError:
+                fingerprint.append(None)
+    return tuple(fingerprint)
+
+
 def is_root_of_git_repo(path):
     """Returns true if the given path is the root of a git repository (it contains a .git directory)"""
     return os.path.exists(path) and ".git" in os.listdir(path)
@@ -1,9 +1,23 @@
+import os
+import re
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from . import run_git
+from . import get_worktree_root, run_git
+from ..actions.util import try_get_subprocess_output
 from ..util import OrchestraException
 
+POINTER_VERSION_LINE = b"version https://git-lfs.github.com/spec/v1"
+
+# Pointer files are tiny, anything larger is the actual content
+_MAX_POINTER_SIZE = 1024
+
+_pointer_oid_regex = re.compile(rb"^oid sha256:([0-9a-f]{64})$", re.MULTILINE)
+_pointer_size_regex = re.compile(rb"^size ([0-9]+)$", re.MULTILINE)
+
+# Set once `git lfs` has been found to work, so it is not invoked again for every fetch
+_lfs_installed = False
+
 
 def fetch(
     workdir,
@@ -34,19 +48,80 @@ def fetch(
     if not checkout:
         return
 
-    checkout_cmd = [
-        "lfs",
-        "checkout",
-    ]
-    for include_file in include:
-        checkout_cmd.append(str(include_file))
-    run_git(*checkout_cmd, workdir=workdir)
+    checkout_files(workdir, include)
+
+
+def checkout_files(workdir, include: List[Union[str, Path]]):
+    """Replaces the pointer files in `include` with their content, which must have been fetched already"""
+    run_git("lfs", "checkout", *(str(i) for i in include), workdir=workdir)
+
+
+def ls_files(workdir, ref: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """Returns the files tracked through LFS in `ref` (the checked out tree if None), as a dictionary mapping their path
+    relative to the repository root to the oid (sha256) of their content.
+    Returns None if they cannot be listed (e.g. git lfs is not installed).
+    """
+    ls_files_cmd = ["git", "lfs", "ls-files", "--long"]
+    if ref is not None:
+        ls_files_cmd.append(ref)
+    output = try_get_subprocess_output(ls_files_cmd, cwd=workdir)
+    if output is None:
+        return None
+    files = {}
+    for line in output.splitlines():
+        # <oid> <* if checked out, - if pointer> <path>
+        oid, _, path = line.split(" ", 2)
+        files[path] = oid
+    return files
+
+
+def read_pointer(path) -> Optional[Tuple[str, int]]:
+    """Returns the oid (sha256) and the size of the object referenced by the git LFS pointer file `path`, None if
+    `path` is not a pointer file (e.g. its content was checked out)
+    """
+    with open(path, "rb") as f:
+        content = f.read(_MAX_POINTER_SIZE + 1)
+    if len(content) > _MAX_POINTER_SIZE or not content.startswith(POINTER_VERSION_LINE):
+        return None
+    oid_match = _pointer_oid_regex.search(content)
+    size_match = _pointer_size_regex.search(content)
+    if oid_match is None or size_match is None:
+        return None
+    return oid_match.group(1).decode("ascii"), int(size_match.group(1))
+
+
+def object_path(worktree_root, oid) -> str:
+    """Returns the path where git LFS stores the object with the given oid for the repository at `worktree_root`"""
+    return os.path.join(worktree_root, ".git", "lfs", "objects", oid[0:2], oid[2:4], oid)
+
+
+def resolve(path) -> Optional[str]:
+    """Returns the path of a file holding the content of the LFS tracked file `path`: the object in the local LFS store
+    if `path` is a pointer file, `path` itself if its content is checked out.
+    Returns None if the object has not been fetched yet.
+    :param path: absolute path of a file inside a canonical clone (see get_worktree_root)
+    """
+    pointer = read_pointer(path)
+    if pointer is None:
+        return str(path)
+    oid, size = pointer
+    local_object_path = object_path(get_worktree_root(os.path.realpath(path)), oid)
+    try:
+        if os.stat(local_object_path).st_size == size:
+            return local_object_path
+    except FileNotFoundError:
+        pass
+    return None
 
 
 def assert_lfs_installed():
     """Checks whether git-lfs is installed and raises an OrchestraException if it is not"""
+    global _lfs_installed
+    if _lfs_installed:
+        return True
     try:
         run_git("lfs")
+        _lfs_installed = True
         return True
     except Exception:
         raise OrchestraException("Could not invoke `git lfs`, is it installed?")
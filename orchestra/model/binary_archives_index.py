@@ -0,0 +1,68 @@
+import os
+import threading
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+
+class BinaryArchivesIndex:
+    """In-memory index of the files provided by the binary archives repositories.
+    The files of each repository are listed by its storage backend once, the first time a binary archive is looked up
+    (scanning the local clone or directory, or reading the index of an HTTP repository), so that locating binary
+    archives does not require probing the filesystem (or the network) for every repository and extension.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # Repository name -> paths of the files it contains (relative to the repository root)
+        self._files: Optional[Dict[str, Set[str]]] = None
+        self._lock = threading.Lock()
+
+    def locate(self, relative_path_without_extension, extensions: Iterable[str]) -> Optional[str]:
+        """Returns the absolute path of the first binary archive found, trying each repository (in priority order) and
+        each extension (in the given order). None if none exists.
+        """
+        location = self.locate_in_repository(relative_path_without_extension, extensions)
+        if location is None:
+            return None
+        name, relative_path = location
+        return os.path.join(self.config.binary_archives_local_paths[name], relative_path)
+
+    def locate_in_repository(
+        self, relative_path_without_extension, extensions: Iterable[str]
+    ) -> Optional[Tuple[str, str]]:
+        """Like `locate`, but returns the name of the repository and the path relative to it"""
+        files = self._scanned_files()
+        extensions = list(extensions)
+        for name in self.config.binary_archives_remotes:
+            repository_files = files.get(name)
+            if not repository_files:
+                continue
+            for extension in extensions:
+                relative_path = relative_path_without_extension + extension
+                if relative_path in repository_files:
+                    return name, relative_path
+        return None
+
+    def add(self, path):
+        """Records a file created in a binary archives repository
+        :param path: absolute path of the file
+        """
+        with self._lock:
+            if self._files is None:
+                return
+            for name, repository_path in self.config.binary_archives_local_paths.items():
+                if path.startswith(repository_path + os.sep):
+                    self._files.setdefault(name, set()).add(os.path.relpath(path, repository_path))
+                    return
+
+    def invalidate(self):
+        """Discards the index, the repositories will be scanned again on the next lookup"""
+        with self._lock:
+            self._files = None
+
+    def _scanned_files(self) -> Dict[str, Set[str]]:
+        with self._lock:
+            if self._files is None:
+                self._files = {
+                    name: storage.list_files() for name, storage in self.config.binary_archives_storages.items()
+                }
+            return self._files
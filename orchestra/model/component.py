@@ -1,4 +1,6 @@
-from typing import Dict, Set, Union
+from typing import Dict, FrozenSet, Iterable, Set, Union
+
+import networkx as nx
 
 from . import build as bld
 from ._hash import hash
@@ -13,10 +15,12 @@ class Component:
         self.skip_post_install = serialized_component.get("skip_post_install", False)
         self.license = serialized_component.get("license")
         self.binary_archives = serialized_component.get("binary_archives")
+        self.binary_archives_compression = serialized_component.get("binary_archives_compression")
         self.build_from_source = serialized_component.get("build_from_source", False)
         self.add_to_path = serialized_component.get("add_to_path", [])
         self.repository = serialized_component.get("repository")
         self._recursive_hash = None
+        self._transitive_dependencies_set: Union[FrozenSet["Component"], None] = None
         self._resolve_dependencies_called = False
 
         self.clone: Union[clone.CloneAction, None] = None
@@ -69,6 +73,7 @@ class Component:
         serialized_component = {
             "license": self.license,
             "binary_archives": self.binary_archives,
+            "binary_archives_compression": self.binary_archives_compression,
             "build_from_source": self.build_from_source,
             "skip_post_install": self.skip_post_install,
             "add_to_path": self.add_to_path,
@@ -100,16 +105,9 @@ class Component:
 
     def _transitive_dependencies(self) -> Set["Component"]:
         """Returns all the Components on which any build of this component depends on, directly or indirectly"""
-        dependency_actions = set()
-        for build in self.builds.values():
-            collect_dependencies(build.install, dependency_actions)
-
-        dependency_components = set()
-        for action in dependency_actions:
-            if isinstance(action, any_of.AnyOfAction):
-                continue
-            dependency_components.add(action.component)
-        return dependency_components
+        if self._transitive_dependencies_set is None:
+            self._transitive_dependencies_set = compute_transitive_dependencies([self])[self]
+        return set(self._transitive_dependencies_set)
 
     def _recursive_hash_material(self) -> str:
         """Returns the string that is hashed to compute recursive_hash"""
@@ -127,6 +125,25 @@ class Component:
             hash_material = self._recursive_hash_material()
             self._recursive_hash = hash(hash_material)
 
+    def update_self_hash(self) -> bool:
+        """Recomputes self_hash, e.g. after the source commit has changed.
+        Note: the recursive_hash of this component and the ones depending on it is *not* updated, see
+        `Configuration.update_hashes`
+        :returns: True if self_hash changed
+        """
+        old_self_hash = self.self_hash
+        self.self_hash = self._compute_self_hash()
+        return old_self_hash != self.self_hash
+
+    def update_recursive_hash(self) -> bool:
+        """Recomputes recursive_hash reusing the already computed set of transitive dependencies.
+        :returns: True if recursive_hash changed
+        """
+        old_recursive_hash = self._recursive_hash
+        self._recursive_hash = None
+        self.compute_recursive_hash()
+        return old_recursive_hash != self._recursive_hash
+
     def __str__(self):
         return f"Component {self.name}"
 
@@ -137,10 +154,40 @@ class Component:
         return s
 
 
-def collect_dependencies(root_action, collected_actions):
-    if root_action in collected_actions:
-        return
-
-    collected_actions.add(root_action)
-    for d in root_action.dependencies_for_hash:
-        collect_dependencies(d, collected_actions)
+def compute_transitive_dependencies(components: Iterable[Component]) -> Dict[Component, FrozenSet[Component]]:
+    """Computes the transitive dependencies of the given components (see `Component._transitive_dependencies`).
+    The graph of the actions reachable from the components is visited only once, in reverse topological order, so the
+    set of dependencies of each action is built reusing the sets already computed for its dependencies.
+    Cycles (e.g. toolchain bootstrap via AnyOf alternatives) are handled by collapsing strongly connected components.
+    :returns: a dictionary mapping each of the given components to the set of components it depends on
+    """
+    components = list(components)
+
+    graph = nx.DiGraph()
+    to_visit = [build.install for component in components for build in component.builds.values()]
+    graph.add_nodes_from(to_visit)
+    while to_visit:
+        action = to_visit.pop()
+        for dependency in action.dependencies_for_hash:
+            if dependency not in graph:
+                to_visit.append(dependency)
+            graph.add_edge(action, dependency)
+
+    condensed_graph = nx.algorithms.condensation(graph)
+    members = nx.get_node_attributes(condensed_graph, "members")
+    mapping = condensed_graph.graph["mapping"]
+
+    scc_dependencies: Dict[int, FrozenSet[Component]] = {}
+    for scc in reversed(list(nx.topological_sort(condensed_graph))):
+        dependency_components = {a.component for a in members[scc] if not isinstance(a, any_of.AnyOfAction)}
+        for successor in condensed_graph.successors(scc):
+            dependency_components.update(scc_dependencies[successor])
+        scc_dependencies[scc] = frozenset(dependency_components)
+
+    result = {}
+    for component in components:
+        dependency_components = set()
+        for build in component.builds.values():
+            dependency_components.update(scc_dependencies[mapping[build.install]])
+        result[component] = frozenset(dependency_components)
+    return result
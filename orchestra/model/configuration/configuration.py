@@ -3,15 +3,21 @@ import re
 from collections import OrderedDict
 from tempfile import TemporaryDirectory
 from textwrap import dedent
-from typing import Dict
+from types import MappingProxyType
+from typing import Dict, Iterable, Set
 
 from fuzzywuzzy import fuzz
 from loguru import logger
 from pkg_resources import parse_version
 
 from ._generate import generate_yaml_configuration, validate_configuration_schema
-from ..component import Component
+from ..binary_archives_index import BinaryArchivesIndex
+from ..component import Component, compute_transitive_dependencies
 from ..remote_cache import RemoteHeadsCache
+from ...actions.binary_archives_cache import parse_size
+from ...actions.binary_archives_storage import GIT_LFS, create_storage
+from ...actions.rpath import RPATH_PLACEHOLDER_PREFIX
+from ...actions.path_shim import ensure_path_shim, path_shim_dir
 from ...actions.util import try_run_internal_subprocess, try_get_subprocess_output
 from ...util import parse_component_name, expand_variables
 from ...version import __version__, __parsed_version__
@@ -63,16 +69,50 @@ class Configuration:
 
         self.remotes = self._get_remotes()
         self.binary_archives_remotes = self._get_binary_archives_remotes()
+        # Binary archives repository name -> compression used for new archives (see actions/archive.py)
+        self.binary_archives_compression = self.parsed_yaml.get("binary_archives_compression", {})
+        # Binary archives repository name -> storage backend type (see actions/binary_archives_storage.py)
+        self.binary_archives_storage_types = self.parsed_yaml.get("binary_archives_storage", {})
         self.branches = self._get_branches()
 
         self._user_paths = self.parsed_yaml.get("paths", {})
 
+        # Replaces the add_to_path entries in PATH with a single directory of symlinks (see actions/path_shim.py)
+        self.compact_path = self.parsed_yaml.get("compact_path", False)
+
+        # Keeps a tmproot skeleton ready for each worker (see actions/tmproot.py)
+        self.prebuilt_tmproot_skeletons = self.parsed_yaml.get("prebuilt_tmproot_skeletons", False)
+
+        # Extracts binary archives directly into the orchestra root, skipping the tmproot when possible
+        self.direct_binary_archive_install = self.parsed_yaml.get("direct_binary_archive_install", False)
+
+        # Reinstalls only replace the files that changed, an installed files manifest is kept for each component
+        self.differential_reinstall = self.parsed_yaml.get("differential_reinstall", False)
+
+        # Installed files are hardlinked from a content-addressed store (see actions/object_store.py)
+        self.object_store = self.parsed_yaml.get("object_store", False)
+
+        # Maximum bytes used by the binary archives available locally, None if unbounded (see
+        # actions/binary_archives_cache.py)
+        binary_archives_cache_size = self.parsed_yaml.get("binary_archives_cache_size")
+        self.binary_archives_cache_size = (
+            parse_size(str(binary_archives_cache_size)) if binary_archives_cache_size is not None else None
+        )
+
+        # Builds use ccache or sccache, None to disable (see actions/compiler_cache.py)
+        self.compiler_cache = self.parsed_yaml.get("compiler_cache")
+
         remote_heads_cache_path = os.path.join(self.orchestra_dotdir, "remote_refs_cache.json")
         self.remote_heads_cache = RemoteHeadsCache(self, remote_heads_cache_path)
 
+        self._global_env_layer = None
+
         self._initialize_paths()
         self._parse_components()
 
+        # Lookup of binary archives in the local binary archives repositories
+        self.binary_archives_index = BinaryArchivesIndex(self)
+
     def _initialize_paths(self):
         """Initialized various paths used by orchestra and passed to the user scripts.
         The paths are guaranteed to be absolute
@@ -85,6 +125,10 @@ class Configuration:
         self.binary_archives_dir = self._get_user_path("binary_archives", "binary-archives")
         # Directory containing temporary roots
         self.tmproot = self._get_user_path("tmproot", "tmproot")
+        # Directory containing the content-addressed store of installed files
+        self.object_store_dir = self._get_user_path("object_store", "objects")
+        # Directory containing the compiler caches and the compiler wrappers
+        self.compiler_cache_dir = self._get_user_path("compiler_cache", "compiler-cache")
         # Directory containing the source directories
         self.sources_dir = self._get_user_path("sources_dir", os.path.join("..", "sources"))
         # Directory containing the build directories
@@ -92,9 +136,15 @@ class Configuration:
         # Directory containing metadata for the installed components
         self.installed_component_metadata_dir = os.path.join(self.orchestra_root, "share", "orchestra")
 
-        # Dictionary of binary archive name -> local path where the binary archive repo is cloned
+        # Dictionary of binary archive name -> storage backend
+        self.binary_archives_storages = OrderedDict(
+            (name, create_storage(name, url, self.binary_archives_storage_types.get(name, GIT_LFS), self))
+            for name, url in self.binary_archives_remotes.items()
+        )
+        # Dictionary of binary archive name -> local path where the binary archives are available (e.g. where the binary
+        # archive repo is cloned)
         self.binary_archives_local_paths = {
-            name: os.path.join(self.binary_archives_dir, name) for name in self.binary_archives_remotes
+            name: storage.local_path for name, storage in self.binary_archives_storages.items()
         }
 
     def get_build(self, comp_spec):
@@ -109,6 +159,19 @@ class Configuration:
         return build
 
     def global_env(self) -> "OrderedDict[str, str]":
+        """Returns a copy of the global environment, which can be freely modified"""
+        return OrderedDict(self.global_env_layer)
+
+    @property
+    def global_env_layer(self) -> "MappingProxyType[str, str]":
+        """Returns a read-only view of the global environment. It is computed once, after all components are parsed"""
+        if self._global_env_layer is None:
+            self._global_env_layer = MappingProxyType(self._compute_global_env())
+            if self.compact_path:
+                ensure_path_shim(self)
+        return self._global_env_layer
+
+    def _compute_global_env(self) -> "OrderedDict[str, str]":
         env = OrderedDict()
         env["ORCHESTRA_DOTDIR"] = self.orchestra_dotdir
         env["ORCHESTRA_ROOT"] = self.orchestra_root
@@ -117,7 +180,7 @@ class Configuration:
         env["SOURCES_DIR"] = self.sources_dir
         env["BUILDS_DIR"] = self.builds_dir
         env["TMP_ROOTS"] = self.tmproot
-        env["RPATH_PLACEHOLDER"] = "////////////////////////////////////////////////$ORCHESTRA_ROOT"
+        env["RPATH_PLACEHOLDER"] = f"{RPATH_PLACEHOLDER_PREFIX}$ORCHESTRA_ROOT"
         env["GIT_ASKPASS"] = "/bin/true"
 
         # TODO: the order of the variables stays the same even if the user overrides an
@@ -127,11 +190,14 @@ class Configuration:
             for k, v in env_dict.items():
                 env[k] = v
 
-        path = ":".join(self.parsed_yaml.get("add_to_path", []))
+        if self.compact_path:
+            path = path_shim_dir(self)
+        else:
+            path = ":".join(self.parsed_yaml.get("add_to_path", []))
 
-        for component in self.components.values():
-            for additional_path in component.add_to_path:
-                path += f":{additional_path}"
+            for component in self.components.values():
+                for additional_path in component.add_to_path:
+                    path += f":{additional_path}"
 
         path += "${PATH:+:${PATH}}"
         env["PATH"] = path
@@ -159,9 +225,33 @@ class Configuration:
             component.resolve_dependencies(self)
 
         # Third pass: compute recursive hash
+        transitive_dependencies = compute_transitive_dependencies(self.components.values())
+        self._transitive_dependents: Dict[Component, Set[Component]] = {c: set() for c in self.components.values()}
+        for component, dependencies in transitive_dependencies.items():
+            component._transitive_dependencies_set = dependencies
+            for dependency in dependencies:
+                self._transitive_dependents[dependency].add(component)
+
         for component in self.components.values():
             component.compute_recursive_hash()
 
+        # PATH depends on all the components, make sure an environment computed while parsing is not reused
+        self._global_env_layer = None
+
+    def update_hashes(self, changed_components: Iterable[Component]) -> Set[Component]:
+        """Updates the hashes after the source commit of some components changed (e.g. after pulling a repository).
+        Only the recursive hashes of the components depending on a component whose self_hash actually changed are
+        recomputed.
+        :param changed_components: components whose commit might have changed
+        :returns: the set of components whose recursive_hash changed
+        """
+        to_update = set()
+        for component in changed_components:
+            if component.update_self_hash():
+                to_update.update(self._transitive_dependents[component])
+
+        return {c for c in to_update if c.update_recursive_hash()}
+
     def _check_minimum_version(self):
         min_version = self.parsed_yaml.get("min_orchestra_version")
         if min_version:
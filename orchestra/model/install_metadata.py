@@ -18,6 +18,7 @@ class InstallMetadata:
         manually_installed=None,
         install_time=None,
         binary_archive_path=None,
+        compiler_cache_stats=None,
     ):
         self.component_name = component_name
         self.build_name = build_name
@@ -27,6 +28,8 @@ class InstallMetadata:
         self.manually_installed = manually_installed
         self.install_time = install_time
         self.binary_archive_path = binary_archive_path
+        # Hits and misses of the compiler cache while building, None if not built from source with the compiler cache
+        self.compiler_cache_stats = compiler_cache_stats
 
     def serialize(self):
         if any(
@@ -40,7 +43,11 @@ class InstallMetadata:
         ):
             raise Exception("Trying to serialize incomplete metadata")
 
-        return self.__dict__
+        serialized = dict(self.__dict__)
+        # Optional properties are only stored when set
+        if serialized["compiler_cache_stats"] is None:
+            del serialized["compiler_cache_stats"]
+        return serialized
 
 
 def _deserialize_metadata(serialized_metadata) -> InstallMetadata:
@@ -53,6 +60,7 @@ def _deserialize_metadata(serialized_metadata) -> InstallMetadata:
         manually_installed=serialized_metadata.get("manually_installed"),
         install_time=serialized_metadata.get("install_time"),
         binary_archive_path=serialized_metadata.get("binary_archive_path"),
+        compiler_cache_stats=serialized_metadata.get("compiler_cache_stats"),
     )
 
 
@@ -141,6 +149,11 @@ def installed_component_metadata_path(component_name: str, config: "configuratio
     return os.path.join(config.installed_component_metadata_dir, component_name.replace("/", "_") + ".json")
 
 
+def installed_component_manifest_path(component_name: str, config: "configuration.Configuration") -> str:
+    """Returns the path of the manifest (including digests) of the installed files of a component"""
+    return os.path.join(config.installed_component_metadata_dir, component_name.replace("/", "_") + ".manifest.json")
+
+
 def installed_component_license_path(component_name: str, config: "configuration.Configuration") -> str:
     """Returns the path of the file containing the license of an installed component"""
     return os.path.join(config.installed_component_metadata_dir, component_name.replace("/", "_") + ".license")
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import re
+import stat
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+MANIFEST_VERSION = 2
+# Version 1 manifests lack file modes, they can still be loaded
+SUPPORTED_MANIFEST_VERSIONS = {1, MANIFEST_VERSION}
+
+# Manifests are stored next to the binary archive they describe, replacing the .tar.* extension with this suffix
+MANIFEST_SUFFIX = ".manifest.json"
+
+ENTRY_TYPE_DIR = "dir"
+ENTRY_TYPE_FILE = "file"
+ENTRY_TYPE_SYMLINK = "symlink"
+
+_archive_extension_regex = re.compile(r"\.tar(\.[a-z0-9]+)?$")
+
+
+class ManifestEntry:
+    __slots__ = ("path", "type", "size", "digest", "target", "mode")
+
+    def __init__(self, path, type, *, size=None, digest=None, target=None, mode=None):
+        """
+        :param path: path relative to the root of the described directory tree
+        :param type: one of ENTRY_TYPE_DIR, ENTRY_TYPE_FILE, ENTRY_TYPE_SYMLINK
+        :param size: size of regular files
+        :param digest: sha256 of the content of regular files, if computed
+        :param target: target of symlinks
+        :param mode: permission bits of regular files
+        """
+        self.path = path
+        self.type = type
+        self.size = size
+        self.digest = digest
+        self.target = target
+        self.mode = mode
+
+    def serialize(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if getattr(self, slot) is not None}
+
+    def __eq__(self, other):
+        return isinstance(other, ManifestEntry) and all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def __repr__(self):
+        return f"ManifestEntry({self.serialize()})"
+
+
+class Manifest:
+    """Describes the content of a directory tree (usually a temporary root or a binary archive).
+    Entries are listed in the same order os.walk would visit them.
+    """
+
+    def __init__(self, entries: Iterable[ManifestEntry]):
+        self.entries: List[ManifestEntry] = list(entries)
+
+    def file_list(self) -> List[str]:
+        """Returns the paths of all the entries that are not directories (symlinks to directories are included),
+        in the same format and order of the installed files index
+        """
+        return [e.path for e in self.entries if e.type != ENTRY_TYPE_DIR]
+
+    def serialize(self):
+        return {
+            "version": MANIFEST_VERSION,
+            "entries": [e.serialize() for e in self.entries],
+        }
+
+
+def scan_directory(root_dir_path, compute_digests=False) -> Manifest:
+    """Builds the manifest of a directory tree using a single os.scandir walk.
+    Symlinks are never followed.
+    :param root_dir_path: the directory to scan
+    :param compute_digests: if True the sha256 of regular files is computed
+    """
+    entries = []
+    for relative_path, dir_entry in walk_directory(root_dir_path):
+        if dir_entry.is_symlink():
+            entries.append(ManifestEntry(relative_path, ENTRY_TYPE_SYMLINK, target=os.readlink(dir_entry.path)))
+        elif dir_entry.is_dir():
+            entries.append(ManifestEntry(relative_path, ENTRY_TYPE_DIR))
+        else:
+            stat_result = dir_entry.stat(follow_symlinks=False)
+            digest = file_digest(dir_entry.path) if compute_digests else None
+            entries.append(
+                ManifestEntry(
+                    relative_path,
+                    ENTRY_TYPE_FILE,
+                    size=stat_result.st_size,
+                    digest=digest,
+                    mode=stat.S_IMODE(stat_result.st_mode),
+                )
+            )
+    return Manifest(entries)
+
+
+def walk_directory(root_dir_path, relative_dir_path="") -> Iterator[Tuple[str, os.DirEntry]]:
+    """Yields the path relative to `root_dir_path` and the os.DirEntry of everything in a directory tree, in the same
+    order os.walk would visit them. Symlinks are never followed.
+    """
+    files = []
+    symlinked_dirs = []
+    subdirs = []
+    with os.scandir(os.path.join(root_dir_path, relative_dir_path)) as it:
+        for dir_entry in it:
+            if dir_entry.is_symlink():
+                # os.walk lists symlinks to directories together with directories, keep the same order
+                if dir_entry.is_dir():
+                    symlinked_dirs.append(dir_entry)
+                else:
+                    files.append(dir_entry)
+            elif dir_entry.is_dir():
+                subdirs.append(dir_entry)
+            else:
+                files.append(dir_entry)
+
+    for dir_entry in files + symlinked_dirs:
+        yield relative_dir_path + dir_entry.name, dir_entry
+    for subdir in subdirs:
+        relative_path = relative_dir_path + subdir.name
+        yield relative_path, subdir
+        yield from walk_directory(root_dir_path, relative_path + "/")
+
+
+def compute_missing_digests(manifest: Manifest, root_dir_path):
+    """Computes the digests of the regular files of `manifest` which do not have one, reading them from `root_dir_path`"""
+    for entry in manifest.entries:
+        if entry.type == ENTRY_TYPE_FILE and entry.digest is None:
+            entry.digest = file_digest(os.path.join(root_dir_path, entry.path))
+
+
+def file_digest(path) -> str:
+    """Returns the hex sha256 of the content of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path_for_archive(archive_path) -> str:
+    """Returns the path of the manifest describing the given binary archive"""
+    return _archive_extension_regex.sub("", archive_path) + MANIFEST_SUFFIX
+
+
+def save_manifest(manifest: Manifest, path):
+    """Writes a manifest to disk atomically"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest.serialize(), f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_manifest(path) -> Optional[Manifest]:
+    """Loads a manifest from disk.
+    Returns None if the manifest does not exist or cannot be used (e.g. it is a git LFS pointer or it was written by
+    an incompatible orchestra version)
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path) as f:
+            serialized_manifest = json.load(f)
+    except (IOError, ValueError) as e:
+        logger.warning(f"Could not load manifest {path}: {e}")
+        return None
+
+    if (
+        not isinstance(serialized_manifest, dict)
+        or serialized_manifest.get("version") not in SUPPORTED_MANIFEST_VERSIONS
+    ):
+        logger.warning(f"Ignoring manifest {path}: unsupported version")
+        return None
+
+    return Manifest(ManifestEntry(**e) for e in serialized_manifest["entries"])
@@ -1,5 +1,6 @@
 import os
 import re
+import shutil
 import sys
 from collections import OrderedDict
 
@@ -49,7 +50,7 @@ def expand_variables(string: str, additional_environment: "OrderedDict[str, str]
     # Two groups are needed to match $VAR and ${VAR} forms
     # fmt: off
     var_regex = re.compile(
-        r"\$(?P<name1>[a-zA-Z_][a-zA-Z0-9_])*"
+        r"\$(?P<name1>[a-zA-Z_][a-zA-Z0-9_]*)"
         r"|\${(?P<name2>[a-zA-Z_][a-zA-Z0-9_]*)}"
     )
     # fmt: on
@@ -65,6 +66,16 @@ def expand_variables(string: str, additional_environment: "OrderedDict[str, str]
     return expanded_string
 
 
+def remove_tree(path):
+    """Removes `path` whatever its type, like `rm -rf` would. Symlinks are removed, not followed.
+    Does nothing if `path` does not exist.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
 def set_terminal_title(title):
     if sys.stdout.isatty():
         sys.stdout.write(f"\x1b]2;{title}\x07")
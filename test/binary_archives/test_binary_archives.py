@@ -1,7 +1,26 @@
+import functools
+import hashlib
+import http.server
+import os
+import socket
 import subprocess
+import threading
 from textwrap import dedent
 
+import pytest
+
+from orchestra.actions import InstallAction
+from orchestra.actions import binary_archives_cache
+from orchestra.actions import binary_archives_storage
+from orchestra.actions import install as install_module
+from orchestra.actions.binary_archives_cache import record_binary_archive_use
+from orchestra.actions.object_store import ObjectStore
+from orchestra.actions.tmproot import SNAPSHOTS_DIRNAME, wait_for_background_tasks
+from orchestra.gitutils import lfs
+from orchestra.model.component import Component
 from orchestra.model import install_metadata
+from orchestra.model.manifest import load_manifest, manifest_path_for_archive
+from orchestra.util import OrchestraException
 from ..conftest import OrchestraShim
 
 
@@ -68,6 +87,111 @@ def test_binary_archives_creation(orchestra: OrchestraShim):
     assert files == expected_files
 
 
+def test_binary_archive_manifest(orchestra: OrchestraShim):
+    """Checks that a manifest describing the content of the binary archive is created next to it"""
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    action = orchestra.configuration.components["component_A"].builds["build0"].install
+    binary_archive_abs_path = action._binary_archive_path()
+    manifest = load_manifest(manifest_path_for_archive(binary_archive_abs_path))
+    assert manifest is not None
+
+    archived_files = subprocess.check_output(["tar", "tf", binary_archive_abs_path], encoding="utf-8").splitlines()
+    assert sorted(e.path for e in manifest.entries) == sorted(f.rstrip("/") for f in archived_files)
+
+    entries = {e.path: e for e in manifest.entries}
+    assert entries["lib"].type == "symlink" and entries["lib"].target == "lib64"
+    assert entries["bin"].type == "dir"
+    file_entry = entries["component_A_file"]
+    assert file_entry.type == "file"
+    assert file_entry.size == 0
+    assert file_entry.digest == hashlib.sha256(b"").hexdigest()
+
+
+def test_binary_archive_compression(orchestra: OrchestraShim):
+    """Checks that the binary archives compression can be configured, that the archive and its symlinks get the
+    corresponding extension and that they can be installed
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            ---
+            binary_archives_compression:
+              origin: zstd:3
+            """
+        )
+    )
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    action = orchestra.configuration.components["component_A"].builds["build0"].install
+    binary_archive_abs_path = action._binary_archive_path()
+    assert binary_archive_abs_path.endswith(".tar.zst")
+    assert action.locate_binary_archive() == binary_archive_abs_path
+    subprocess.check_call(["zstd", "--test", "--quiet", binary_archive_abs_path])
+
+    archive_dir = os.path.dirname(binary_archive_abs_path)
+    symlinks = [f for f in os.listdir(archive_dir) if os.path.islink(os.path.join(archive_dir, f))]
+    assert symlinks and all(s.endswith(".tar.zst") for s in symlinks)
+
+    orchestra.clean_root()
+    orchestra("install", "component_A")
+    metadata = install_metadata.load_metadata("component_A", orchestra.configuration)
+    assert metadata.source == "binary archives"
+
+
+def test_object_store(orchestra: OrchestraShim, capsys):
+    """Checks that with the object_store option installed files are hardlinked from the store, that binary archives
+    whose files are all in the store are installed without extracting them and that unused objects are garbage collected
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            ---
+            object_store: true
+            """
+        )
+    )
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    config = orchestra.configuration
+    store = ObjectStore(config.object_store_dir)
+    installed_file = orchestra.orchestra_root / "component_A_file"
+    object_path = store.object_path(hashlib.sha256(b"").hexdigest(), os.stat(installed_file).st_mode & 0o7777)
+    assert os.path.samefile(installed_file, object_path)
+    assert str(orchestra.orchestra_root) in store.roots()
+
+    # The archive is not needed anymore, extracting it would fail
+    action = config.components["component_A"].builds["build0"].install
+    with open(action.locate_binary_archive(), "wb") as f:
+        f.write(b"not a valid archive")
+
+    orchestra.loglevel = "DEBUG"
+    orchestra("install", "component_A")
+    out, err = capsys.readouterr()
+    assert "Linking files from the object store" in out
+    assert os.path.samefile(installed_file, object_path)
+    metadata = install_metadata.load_metadata("component_A", config)
+    assert metadata.source == "binary archives"
+
+    orchestra("object-store", "gc")
+    assert os.path.exists(object_path)
+
+    orchestra("uninstall", "component_A")
+    orchestra("object-store", "gc")
+    assert not os.path.exists(object_path)
+    assert list(store.objects()) == []
+
+
 def test_remote_heads_cache_poisoning_works(orchestra: OrchestraShim):
     """Checks that the mechanism for poisoning the remote HEADs cache works"""
     fake_commit = "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
@@ -76,3 +200,399 @@ def test_remote_heads_cache_poisoning_works(orchestra: OrchestraShim):
     component = orchestra.configuration.components["component_C"]
     assert component.commit() == fake_commit
     assert component.branch() == fake_branch
+
+
+def replace_with_lfs_pointers(archive_paths):
+    """Replaces the given binary archives with git LFS pointer files, like a clone which did not fetch them would have.
+    Returns a dict oid -> content of the archive.
+    """
+    contents = {}
+    for path in archive_paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        oid = hashlib.sha256(content).hexdigest()
+        contents[oid] = content
+        with open(path, "w") as f:
+            f.write(f"version https://git-lfs.github.com/spec/v1\noid sha256:{oid}\nsize {len(content)}\n")
+    return contents
+
+
+def store_lfs_object(repo_path, oid, content):
+    object_path = lfs.object_path(repo_path, oid)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    with open(object_path, "wb") as f:
+        f.write(content)
+
+
+def fake_lfs_fetch(archive_contents, fetched):
+    """Returns a replacement for lfs.fetch which stores the objects referenced by the included pointer files in the LFS
+    object store, taking their content from `archive_contents` (oid -> content). The includes are appended to `fetched`
+    """
+
+    def fetch(workdir, checkout=True, include=None):
+        fetched.append(sorted(str(i) for i in include))
+        for path in include:
+            oid, _ = lfs.read_pointer(os.path.join(workdir, path))
+            store_lfs_object(workdir, oid, archive_contents[oid])
+
+    return fetch
+
+
+def test_lfs_fetch_checks_out_by_default(monkeypatch):
+    """Checks that lfs.fetch, called with its default arguments, fetches and then checks out the included files"""
+    commands = []
+    monkeypatch.setattr(lfs, "_lfs_installed", True)
+    monkeypatch.setattr(lfs, "run_git", lambda *args, workdir=None: commands.append(list(args)))
+
+    lfs.fetch("/workdir", include=["a.tar.xz", "b.tar.xz"])
+
+    assert commands == [
+        ["lfs", "fetch", "--include", "a.tar.xz,b.tar.xz"],
+        ["lfs", "checkout", "a.tar.xz", "b.tar.xz"],
+    ]
+
+
+def test_binary_archives_are_prefetched_in_batch(orchestra: OrchestraShim, monkeypatch):
+    """Checks that the binary archives needed by an install are fetched with a single batched `git lfs fetch` per
+    binary archives repository, both by `orc fetch` and by `orc install`, and that they are extracted from the LFS
+    object store without being checked out
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_C")
+    orchestra.clean_root()
+
+    components = orchestra.configuration.components
+    install_actions = [components[name].builds["build0"].install for name in ("component_B", "component_C")]
+    archive_paths = [action.locate_binary_archive() for action in install_actions]
+    archive_contents = replace_with_lfs_pointers(archive_paths)
+    expected_includes = sorted(action.binary_archive_relative_path for action in install_actions)
+
+    fetched = []
+    monkeypatch.setattr(lfs, "fetch", fake_lfs_fetch(archive_contents, fetched))
+
+    orchestra("fetch", "component_C")
+    assert fetched == [expected_includes]
+    assert not (orchestra.orchestra_root / "share/orchestra/component_C.json").exists()
+
+    fetched.clear()
+    orchestra("install", "component_C")
+    assert fetched == []
+    assert (orchestra.orchestra_root / "share/orchestra/component_C.json").exists()
+    for path in archive_paths:
+        assert lfs.read_pointer(path) is not None, "binary archives must not be checked out"
+
+    for oid in archive_contents:
+        os.remove(lfs.object_path(orchestra.binary_archives_dir / "origin", oid))
+    orchestra.clean_root()
+    orchestra("install", "component_C")
+    assert fetched == [expected_includes]
+    assert (orchestra.orchestra_root / "share/orchestra/component_C.json").exists()
+
+
+def fake_lfs_ls_files(pushed_archives):
+    """Returns a replacement for lfs.ls_files for a repository whose upstream branch tracks `pushed_archives`, with their
+    current content (and the checked out tree nothing else)
+    """
+
+    pushed_oids = {}
+    for path in pushed_archives:
+        with open(path, "rb") as f:
+            pushed_oids[path] = hashlib.sha256(f.read()).hexdigest()
+
+    def ls_files(workdir, ref=None):
+        if ref is None:
+            return {}
+        return {os.path.relpath(path, workdir): oid for path, oid in pushed_oids.items()}
+
+    return ls_files
+
+
+def test_binary_archives_cache_eviction(orchestra: OrchestraShim, monkeypatch):
+    """Checks that the least recently used binary archives are evicted (their LFS object deleted and their worktree
+    file reset to a pointer) when the local cache exceeds its size, except the ones needed by the current install
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A", "component_C")
+    orchestra.clean_root()
+
+    components = orchestra.configuration.components
+    archive_a, archive_b, archive_c = (
+        components[name].builds["build0"].install.locate_binary_archive()
+        for name in ("component_A", "component_B", "component_C")
+    )
+    # component_A is left checked out, the others are only in the LFS object store
+    repo_path = orchestra.binary_archives_dir / "origin"
+    archive_contents = replace_with_lfs_pointers([archive_b, archive_c])
+    for oid, content in archive_contents.items():
+        store_lfs_object(repo_path, oid, content)
+
+    for timestamp, archive_path in enumerate([archive_a, archive_b, archive_c]):
+        record_binary_archive_use(orchestra.configuration, archive_path)
+        os.utime(archive_path, (timestamp, timestamp))
+    archive_c_size = lfs.read_pointer(archive_c)[1]
+    with open(archive_a, "rb") as f:
+        archive_a_content = f.read()
+    monkeypatch.setattr(lfs, "ls_files", fake_lfs_ls_files([archive_a]))
+    monkeypatch.setattr(binary_archives_cache, "upstream_commit", lambda repo_path: "upstream")
+
+    orchestra("binary-archives", "clean", "--max-size", str(archive_c_size))
+    assert lfs.read_pointer(archive_a)[0] == hashlib.sha256(archive_a_content).hexdigest()
+    assert lfs.resolve(archive_b) is None
+    assert lfs.resolve(archive_c) is not None
+
+    # Archives needed by the install are never evicted
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            ---
+            binary_archives_cache_size: 1
+            """
+        )
+    )
+    fetched = []
+    monkeypatch.setattr(lfs, "fetch", fake_lfs_fetch(archive_contents, fetched))
+    orchestra("install", "component_C")
+    assert fetched == [[os.path.relpath(archive_b, repo_path)]]
+    assert lfs.resolve(archive_b) is not None
+    assert lfs.resolve(archive_c) is not None
+    assert (orchestra.orchestra_root / "share/orchestra/component_C.json").exists()
+
+
+def test_unpushed_binary_archives_are_not_evicted(orchestra: OrchestraShim, monkeypatch):
+    """Checks that archives checked out in the worktree are not evicted unless the upstream branch tracks them through
+    LFS with the same content, since they could not be fetched again
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+    archive_path = orchestra.configuration.components["component_A"].builds["build0"].install.locate_binary_archive()
+    with open(archive_path, "rb") as f:
+        archive_content = f.read()
+
+    monkeypatch.setattr(binary_archives_cache, "upstream_commit", lambda repo_path: "upstream")
+    monkeypatch.setattr(lfs, "ls_files", fake_lfs_ls_files([]))
+    orchestra("binary-archives", "clean", "--max-size", "0")
+    with open(archive_path, "rb") as f:
+        assert f.read() == archive_content
+
+    # Pushed with a different content
+    monkeypatch.setattr(lfs, "ls_files", fake_lfs_ls_files([archive_path]))
+    with open(archive_path, "ab") as f:
+        f.write(b"modified")
+    orchestra("binary-archives", "clean", "--max-size", "0")
+    assert lfs.read_pointer(archive_path) is None
+
+
+def test_binary_archives_created_in_background(orchestra: OrchestraShim, monkeypatch):
+    """Checks that binary archives are compressed in background from a snapshot of the temporary root, while the
+    actions depending on the archived component run, and that the run waits for them
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+
+    dependent_started = threading.Event()
+    dependent_started_during_compression = []
+    original_build_and_install = InstallAction._build_and_install
+    original_create_archive = install_module.create_archive
+
+    def build_and_install(action):
+        if action.component.name == "component_C":
+            dependent_started.set()
+        return original_build_and_install(action)
+
+    def create_archive(source_dir, archive_path, entries, compression):
+        if "component_B_file" in entries:
+            dependent_started_during_compression.append(dependent_started.wait(timeout=10))
+        return original_create_archive(source_dir, archive_path, entries, compression)
+
+    monkeypatch.setattr(InstallAction, "_build_and_install", build_and_install)
+    monkeypatch.setattr(install_module, "create_archive", create_archive)
+    orchestra("install", "-b", "--create-binary-archives", "component_C")
+    assert dependent_started_during_compression == [True]
+
+    for name in ("component_B", "component_C"):
+        action = orchestra.configuration.components[name].builds["build0"].install
+        binary_archive_path = action._binary_archive_path()
+        assert load_manifest(manifest_path_for_archive(binary_archive_path)) is not None
+        archived_files = subprocess.check_output(["tar", "tf", binary_archive_path], encoding="utf-8").splitlines()
+        assert f"{name}_file" in archived_files
+        archive_dir = os.path.dirname(binary_archive_path)
+        assert any(os.path.islink(os.path.join(archive_dir, f)) for f in os.listdir(archive_dir))
+
+    wait_for_background_tasks()
+    snapshots_dir = os.path.join(orchestra.configuration.tmproot, SNAPSHOTS_DIRNAME)
+    assert os.listdir(snapshots_dir) == []
+
+
+def test_binary_archive_symlinks_concurrent_updates(orchestra: OrchestraShim):
+    """Checks that the binary archive symlinks can be updated concurrently, as done by the install actions and by the
+    threads creating binary archives in background
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+    action = orchestra.configuration.components["component_A"].builds["build0"].install
+
+    errors = []
+
+    def update_symlinks():
+        try:
+            for _ in range(50):
+                action.update_binary_archive_symlink()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=update_symlinks) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_background_binary_archive_named_after_built_commit(orchestra: OrchestraShim, monkeypatch):
+    """Checks that a binary archive compressed in background is named after the commit it was built from, even if the
+    component commit changes during the compression
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+
+    original_create_archive = install_module.create_archive
+
+    def create_archive(source_dir, archive_path, entries, compression):
+        monkeypatch.setattr(Component, "commit", lambda self: "moved")
+        return original_create_archive(source_dir, archive_path, entries, compression)
+
+    monkeypatch.setattr(install_module, "create_archive", create_archive)
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    metadata = install_metadata.load_metadata("component_A", orchestra.configuration)
+    assert not os.path.basename(metadata.binary_archive_path).startswith("moved_")
+    binary_archive_path = orchestra.binary_archives_dir / "origin" / metadata.binary_archive_path
+    assert binary_archive_path.exists()
+    assert load_manifest(manifest_path_for_archive(binary_archive_path)) is not None
+
+
+def test_binary_archives_index(orchestra: OrchestraShim):
+    """Checks that binary archives are located through the index of the binary archives repositories, which is scanned
+    once and updated when archives are created
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    config = orchestra.configuration
+    action = config.components["component_A"].builds["build0"].install
+    binary_archive_path = action._binary_archive_path()
+    assert action.locate_binary_archive() == binary_archive_path
+
+    # Files appearing behind the index back are only found once it is invalidated
+    os.rename(binary_archive_path, binary_archive_path + ".moved")
+    other_archive_path = os.path.splitext(binary_archive_path)[0] + ".zst"
+    os.rename(binary_archive_path + ".moved", other_archive_path)
+    assert action.locate_binary_archive() == binary_archive_path
+    config.binary_archives_index.invalidate()
+    assert action.locate_binary_archive() == other_archive_path
+
+    config.binary_archives_index.add(binary_archive_path)
+    assert action.locate_binary_archive() == binary_archive_path
+
+
+def test_binary_archives_storage_backends(orchestra: OrchestraShim, capsys):
+    """Checks that binary archives can be created in and installed from a directory, and installed from a static HTTP
+    server exposing the same layout with an index, downloading only the archives that are needed. The manifests of
+    the archives are downloaded before the archives, so they can be extracted directly into the root.
+    """
+    archives_dir = orchestra.test_data_mgr.newdir("binary_archives_directory")
+    directory_overlay = orchestra.add_overlay(
+        dedent(
+            f"""
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all
+            ---
+            #@overlay/match missing_ok=True
+            binary_archives:
+              #@overlay/append
+              - shared: {archives_dir}
+            #@overlay/match missing_ok=True
+            binary_archives_storage:
+              shared: directory
+            """
+        )
+    )
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A", "component_C")
+    config = orchestra.configuration
+    assert not os.path.exists(os.path.join(config.binary_archives_dir, "shared"))
+
+    component_a_action, component_c_action = (
+        config.components[name].builds["build0"].install for name in ("component_A", "component_C")
+    )
+    component_c_archive_path = os.path.join(archives_dir, component_c_action.binary_archive_relative_path)
+    assert component_c_action.locate_binary_archive() == component_c_archive_path
+    orchestra.clean_root()
+    orchestra("install", "component_C")
+    assert (orchestra.orchestra_root / "share/orchestra/component_C.json").exists()
+
+    orchestra("binary-archives", "write-index", str(archives_dir))
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(archives_dir))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        orchestra.remove_overlay(directory_overlay)
+        orchestra.add_overlay(
+            dedent(
+                f"""
+                #@ load("@ytt:overlay", "overlay")
+                #@overlay/match by=overlay.all
+                ---
+                #@overlay/match missing_ok=True
+                binary_archives:
+                  #@overlay/append
+                  - mirror: http://127.0.0.1:{server.server_address[1]}/
+                #@overlay/match missing_ok=True
+                binary_archives_storage:
+                  mirror: http
+                #@overlay/match missing_ok=True
+                direct_binary_archive_install: true
+                """
+            )
+        )
+        orchestra("update")
+        orchestra.clean_root()
+        capsys.readouterr()
+        orchestra.loglevel = "DEBUG"
+        orchestra("install", "component_C")
+        out, err = capsys.readouterr()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert (orchestra.orchestra_root / "share/orchestra/component_C.json").exists()
+    mirror_path = os.path.join(orchestra.configuration.binary_archives_dir, "mirror")
+    downloaded_archive_path = os.path.join(mirror_path, component_c_action.binary_archive_relative_path)
+    assert os.path.isfile(downloaded_archive_path)
+    assert load_manifest(manifest_path_for_archive(downloaded_archive_path)) is not None
+    assert not os.path.exists(os.path.join(mirror_path, component_a_action.binary_archive_relative_path))
+    assert "installing through the temporary root" not in out
+    assert "Moving previously installed files aside" in out
+
+
+def test_http_storage_times_out(orchestra: OrchestraShim, monkeypatch):
+    """Checks that downloads from an HTTP binary archives repository which accepts connections but never answers fail
+    instead of hanging
+    """
+    monkeypatch.setattr(binary_archives_storage, "_DOWNLOAD_TIMEOUT", 0.5)
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        url = f"http://127.0.0.1:{server.getsockname()[1]}/"
+        storage = binary_archives_storage.HttpStorage("mirror", url, orchestra.configuration)
+
+        assert storage.update() is False
+        with pytest.raises(OrchestraException):
+            storage.fetch(["x86-64/component_A/build0/none_hash.tar.xz"])
@@ -35,6 +35,7 @@ def test_component_serialize(orchestra: OrchestraShim):
     expected_value = {
         "license": component.license,
         "binary_archives": component.binary_archives,
+        "binary_archives_compression": component.binary_archives_compression,
         "build_from_source": component.build_from_source,
         "skip_post_install": component.skip_post_install,
         "add_to_path": component.add_to_path,
@@ -100,3 +101,22 @@ def test_component_recursive_hash(orchestra: OrchestraShim):
     config = orchestra.configuration
     component = config.components["component_C"]
     assert hash(component._recursive_hash_material()) == component.recursive_hash
+
+
+def test_update_hashes(orchestra: OrchestraShim):
+    """Checks that Configuration.update_hashes recomputes only the hashes affected by a commit change"""
+    orchestra("update")
+    config = orchestra.configuration
+    component_A = config.components["component_A"]
+    component_C = config.components["component_C"]
+    initial_component_A_recursive_hash = component_A.recursive_hash
+    initial_component_C_recursive_hash = component_C.recursive_hash
+
+    assert config.update_hashes([component_C]) == set(), "no commit changed, no hash should change"
+
+    config.remote_heads_cache.set_entry("component_C", "master", "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa")
+    assert config.update_hashes([component_C]) == {component_C}
+
+    assert component_A.recursive_hash == initial_component_A_recursive_hash
+    assert component_C.recursive_hash != initial_component_C_recursive_hash
+    assert component_C.recursive_hash == hash(component_C._recursive_hash_material())
@@ -0,0 +1,32 @@
+import os
+
+from orchestra.actions.bundle import read_bundle_index
+from orchestra.model.install_metadata import is_installed, load_file_list
+from ..orchestra_shim import OrchestraShim
+
+
+def test_bundle(orchestra: OrchestraShim, tmp_path):
+    """Checks that `orc bundle create` packages the installed dependency closure of a component, and that
+    `orc bundle install` restores its files and metadata into an empty root
+    """
+    orchestra("install", "-b", "component_C")
+    bundle_path = str(tmp_path / "bundle.tar.zst")
+
+    orchestra("bundle", "create", "-o", str(tmp_path / "bundle.tar.xz"), "component_C", should_fail=True)
+    orchestra("bundle", "create", "-o", bundle_path, "component_C")
+    index = read_bundle_index(bundle_path)
+    assert [c["component"] for c in index["components"]] == ["component_A", "component_C"]
+
+    config = orchestra.configuration
+    expected_file_lists = {name: load_file_list(name, config) for name in ("component_A", "component_C")}
+
+    # Bundles are only installed into empty roots
+    orchestra("bundle", "install", bundle_path, should_fail=True)
+
+    orchestra.clean_root()
+    orchestra("bundle", "install", bundle_path)
+    for name, file_list in expected_file_lists.items():
+        component = config.components[name]
+        assert is_installed(config, name, wanted_build="build0", wanted_recursive_hash=component.recursive_hash)
+        assert load_file_list(name, config) == file_list
+        assert os.path.exists(orchestra.orchestra_root / f"{name}_file")
@@ -200,6 +200,25 @@ def test_install_environment(orchestra: OrchestraShim, monkeypatch):
     assert_script_succeeds_in_action_context(action, check_script, monkeypatch)
 
 
+def test_action_environment_is_isolated(orchestra: OrchestraShim):
+    """Checks that modifying the environment returned by an action does not affect the environment of the other
+    actions or the global environment
+    """
+    config = orchestra.configuration
+    install_action = config.components["component_A"].default_build.install
+    configure_action = config.components["component_A"].default_build.configure
+
+    install_env = install_action.environment
+    install_env["ORCHESTRA_ROOT"] = "/modified"
+    install_env["SOME_NEW_VARIABLE"] = "value"
+
+    assert install_action.environment["ORCHESTRA_ROOT"] == config.orchestra_root
+    assert "SOME_NEW_VARIABLE" not in install_action.environment
+    assert configure_action.environment["ORCHESTRA_ROOT"] == config.orchestra_root
+    assert config.global_env()["ORCHESTRA_ROOT"] == config.orchestra_root
+    assert list(install_action.environment)[-1] == "DESTDIR", "action-specific variables must be exported last"
+
+
 def test_shell_environment(orchestra: OrchestraShim, monkeypatch):
     """Checks that the scripts executed by `orchestra shell` have the expected environment"""
     config = orchestra.configuration
@@ -1,3 +1,5 @@
+from textwrap import dedent
+
 from test.orchestra_shim import OrchestraShim
 
 
@@ -31,3 +33,39 @@ def test_configure_retriggers_on_failure(orchestra: OrchestraShim, capsys, monke
     out, err = capsys.readouterr()
     assert "Configure successful" in out
     assert "Installing" in out
+
+
+def test_configure_invalidated_when_inputs_change(orchestra: OrchestraShim, capsys):
+    """Checks that configure is not rerun when its inputs are unchanged, and that it is rerun reporting the reason when
+    a dependency changes
+    """
+    orchestra.loglevel = "DEBUG"
+    orchestra("install", "-b", "component_B")
+    out, err = capsys.readouterr()
+    assert "Executing Action configure of component_B@build0" in out
+
+    orchestra("uninstall", "component_B")
+    orchestra("install", "-b", "component_B")
+    out, err = capsys.readouterr()
+    assert "Executing Action configure of component_B@build0" not in out
+    assert "Executing install script" in out
+
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all
+            ---
+            components:
+              component_A:
+                builds:
+                  build0:
+                    install: |
+                      touch "$TMP_ROOT$ORCHESTRA_ROOT/component_A_new_file"
+            """
+        )
+    )
+    orchestra("uninstall", "component_B")
+    orchestra("install", "-b", "component_B")
+    out, err = capsys.readouterr()
+    assert "Rerunning configure script: dependency component_A changed" in out
@@ -1,7 +1,11 @@
+import json
 import os
 import pytest
 from textwrap import dedent
 
+from orchestra.actions.tmproot import wait_for_background_tasks
+from orchestra.model.manifest import manifest_path_for_archive
+
 from ..orchestra_shim import OrchestraShim
 from ..utils.json import load_json
 from ..utils.filelist import compare_root_tree
@@ -116,6 +120,21 @@ def test_install_from_binary_archives(orchestra: OrchestraShim, capsys):
     assert_component_A_installed_properly(orchestra, metadata_overrides={"source": "binary archives"})
 
 
+def test_install_from_binary_archives_without_manifest(orchestra: OrchestraShim):
+    """Checks that binary archives without a manifest (created by older orchestra versions) can be installed, taking
+    the file list from the extracted archive
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+    action = orchestra.configuration.components["component_A"].default_build.install
+    os.unlink(manifest_path_for_archive(action.locate_binary_archive()))
+
+    orchestra.clean_root()
+    orchestra("install", "component_A")
+    assert_component_A_installed_properly(orchestra, metadata_overrides={"source": "binary archives"})
+
+
 def test_install_fails_if_no_binary_archives_configured(orchestra: OrchestraShim):
     """Checks that installation fails and no actions are executed if no binary archives are configured"""
     with pytest.raises(Exception):
@@ -167,3 +186,279 @@ def test_keep_tmproot(orchestra: OrchestraShim):
     """Checks that the --keep-tmproot option works"""
     orchestra("install", "-b", "--keep-tmproot", "component_A")
     assert os.path.exists(orchestra.configuration.components["component_A"].default_build.install.tmp_root)
+
+
+def test_merge_strategies(orchestra: OrchestraShim, capsys):
+    """Checks that files are renamed into the root, or hardlinked when the tmproot must be kept, and that reinstalling
+    replaces the existing files
+    """
+    orchestra.loglevel = "DEBUG"
+    orchestra("install", "-b", "component_A")
+    out, err = capsys.readouterr()
+    assert "by rename" in out and "by hardlink" not in out
+    assert_component_A_installed_properly(orchestra)
+
+    orchestra("install", "-b", "--keep-tmproot", "component_A")
+    out, err = capsys.readouterr()
+    assert "by hardlink" in out
+    tmp_root = orchestra.configuration.components["component_A"].default_build.install.tmp_root
+    assert os.path.exists(tmp_root + str(orchestra.orchestra_root / "some_file"))
+    assert_component_A_installed_properly(orchestra)
+
+
+def test_tmproot_is_removed_in_background(orchestra: OrchestraShim):
+    """Checks that the temporary root is moved out of the way after installing and deleted in background"""
+    orchestra("install", "-b", "component_A")
+    config = orchestra.configuration
+    assert not os.path.exists(config.components["component_A"].default_build.install.tmp_root)
+
+    wait_for_background_tasks()
+    trash_dir = os.path.join(config.tmproot, ".trash")
+    assert not os.path.exists(trash_dir) or os.listdir(trash_dir) == []
+
+
+def test_prebuilt_tmproot_skeletons(orchestra: OrchestraShim):
+    """Checks that with the prebuilt_tmproot_skeletons option a spare skeleton is prepared for the next install and
+    that installing from it gives the same result
+    """
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            ---
+            prebuilt_tmproot_skeletons: true
+            """
+        )
+    )
+    orchestra("install", "-b", "component_A")
+    wait_for_background_tasks()
+    skeletons_dir = os.path.join(orchestra.configuration.tmproot, ".skeletons")
+    assert len(os.listdir(skeletons_dir)) == 1
+
+    orchestra("uninstall", "component_A")
+    orchestra("install", "-b", "component_A")
+    assert_component_A_installed_properly(orchestra)
+
+
+def test_compact_path(orchestra: OrchestraShim):
+    """Checks that with the compact_path option the executables found in add_to_path directories are linked in the PATH
+    shim directory, and that the links are updated when installing and uninstalling components
+    """
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            #@overlay/match-child-defaults missing_ok=True
+            ---
+            compact_path: true
+            add_to_path:
+              #@overlay/append
+              - $ORCHESTRA_ROOT/bin
+            """
+        )
+    )
+    config = orchestra.configuration
+    shim_dir = orchestra.orchestra_root / ".orchestra-path"
+    assert config.global_env()["PATH"].startswith(f"{shim_dir}$")
+
+    orchestra("install", "-b", "component_with_executable")
+    shim_link = shim_dir / "some_executable"
+    assert shim_link.is_symlink()
+    assert os.readlink(shim_link) == str(orchestra.orchestra_root / "bin" / "some_executable")
+
+    orchestra("uninstall", "component_with_executable")
+    assert not os.path.lexists(shim_link)
+
+
+DIRECT_BINARY_ARCHIVE_INSTALL_OVERLAY = dedent(
+    """
+    #@ load("@ytt:overlay", "overlay")
+    #@overlay/match by=overlay.all, missing_ok=True
+    ---
+    direct_binary_archive_install: true
+    """
+)
+
+
+def test_direct_binary_archive_install(orchestra: OrchestraShim, capsys):
+    """Checks that with the direct_binary_archive_install option binary archives are extracted directly into the root,
+    both in an empty root and replacing a previously installed build
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra.add_overlay(DIRECT_BINARY_ARCHIVE_INSTALL_OVERLAY)
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    orchestra.loglevel = "DEBUG"
+    orchestra.clean_root()
+    orchestra("install", "component_A")
+    out, err = capsys.readouterr()
+    assert "Extracting binary archive into the orchestra root" in out
+    assert "Preparing temporary root directory" not in out
+    assert_component_A_installed_properly(orchestra, metadata_overrides={"source": "binary archives"})
+
+    orchestra("install", "component_A")
+    out, err = capsys.readouterr()
+    assert "Extracting binary archive into the orchestra root" in out
+    assert_component_A_installed_properly(orchestra, metadata_overrides={"source": "binary archives"})
+
+
+def test_direct_binary_archive_install_conflict(orchestra: OrchestraShim, capsys):
+    """Checks that a direct binary archive install falls back to the tmproot if a file of the archive already exists
+    in the root and does not belong to the installed build
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra.add_overlay(DIRECT_BINARY_ARCHIVE_INSTALL_OVERLAY)
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    orchestra.loglevel = "DEBUG"
+    orchestra("uninstall", "component_A")
+    (orchestra.orchestra_root / "some_file").write_text("not owned by component_A")
+    orchestra("install", "component_A")
+    out, err = capsys.readouterr()
+    assert "some_file already exists in the root" in out
+    assert "Extracting binary archive into the orchestra root" not in out
+    assert_component_A_installed_properly(orchestra, metadata_overrides={"source": "binary archives"})
+
+
+def test_direct_binary_archive_install_rollback(orchestra: OrchestraShim):
+    """Checks that if extracting a binary archive directly into the root fails the previously installed build is
+    restored
+    """
+    orchestra.add_binary_archive("origin")
+    orchestra.add_overlay(DIRECT_BINARY_ARCHIVE_INSTALL_OVERLAY)
+    orchestra("update")
+    orchestra("install", "-b", "--create-binary-archives", "component_A")
+
+    action = orchestra.configuration.components["component_A"].default_build.install
+    with open(action.locate_binary_archive(), "wb") as f:
+        f.write(b"not a valid archive")
+
+    orchestra("install", "component_A", should_fail=True)
+    assert_component_A_installed_properly(orchestra)
+
+
+def test_differential_reinstall(orchestra: OrchestraShim):
+    """Checks that with the differential_reinstall option reinstalling a component leaves unchanged files untouched,
+    replaces changed files and removes files which are not part of the new build
+    """
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            ---
+            differential_reinstall: true
+            """
+        )
+    )
+    orchestra("install", "-b", "component_B@build0")
+    some_file = orchestra.orchestra_root / "some_file"
+    manifest_path = orchestra.orchestra_root / "share/orchestra/component_B.manifest.json"
+    assert manifest_path.exists()
+    os.utime(some_file, (1000000000, 1000000000))
+    inode = os.stat(some_file).st_ino
+
+    orchestra("install", "-b", "component_B@build0")
+    assert os.stat(some_file).st_ino == inode
+    assert os.stat(some_file).st_mtime == 1000000000
+
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all
+            ---
+            components:
+              component_B:
+                builds:
+                  build0:
+                    install: |
+                      echo "new content" > "$TMP_ROOT$ORCHESTRA_ROOT/some_file"
+            """
+        )
+    )
+    orchestra("install", "-b", "component_B@build0")
+    assert some_file.read_text() == "new content\n"
+
+    orchestra("install", "-b", "component_B@build1")
+    assert not some_file.exists()
+    assert (orchestra.orchestra_root / "some_other_file").exists()
+    with open(orchestra.orchestra_root / "share/orchestra/component_B.idx") as f:
+        index = f.read().splitlines()
+    assert "some_other_file" in index and "share/orchestra/component_B.manifest.json" in index
+
+    orchestra("uninstall", "component_B")
+    assert not manifest_path.exists()
+
+
+def test_compiler_cache(orchestra: OrchestraShim, tmp_path, monkeypatch, capsys):
+    """Checks that with the compiler_cache option builds invoke the compiler through the cache wrappers, and that the
+    cache hits and misses are recorded in the install metadata and reported by `orc components --json`
+    """
+    fake_bin = tmp_path / "fake_bin"
+    fake_bin.mkdir()
+    fake_ccache = fake_bin / "ccache"
+    fake_ccache.write_text(
+        dedent(
+            """\
+            #!/bin/sh
+            echo "# $(basename "$0") $*" >> "$CCACHE_STATSLOG"
+            if [ -e "$CCACHE_DIR/cached" ]; then echo cache_hit >> "$CCACHE_STATSLOG"; else echo cache_miss >> "$CCACHE_STATSLOG"; fi
+            echo "$CCACHE_MAXSIZE" > "$CCACHE_DIR/max_size"
+            """
+        )
+    )
+    fake_ccache.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fake_bin}:{os.environ['PATH']}")
+
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all, missing_ok=True
+            ---
+            compiler_cache:
+              tool: ccache
+              max_size: 1G
+            """
+        )
+    )
+    orchestra.add_overlay(
+        dedent(
+            """
+            #@ load("@ytt:overlay", "overlay")
+            #@overlay/match by=overlay.all
+            ---
+            components:
+              component_B:
+                builds:
+                  build0:
+                    install: |
+                      mkdir -p "$CCACHE_DIR"
+                      cc -c a.c
+                      c++ -c b.cpp
+                      touch "$CCACHE_DIR/cached"
+                      gcc -c c.c
+                      touch "$TMP_ROOT$ORCHESTRA_ROOT/some_file"
+            """
+        )
+    )
+    orchestra("update")
+    orchestra("install", "-b", "component_B@build0")
+    out, err = capsys.readouterr()
+    assert "component_B@build0: compiler cache 1 hits, 2 misses (33% hit rate)" in out
+
+    expected_stats = {"tool": "ccache", "hits": 1, "misses": 2}
+    metadata = load_json(orchestra.orchestra_root / "share/orchestra/component_B.json")
+    assert metadata["compiler_cache_stats"] == expected_stats
+    with open(os.path.join(orchestra.configuration.compiler_cache_dir, "shared", "max_size")) as f:
+        assert f.read() == "1G\n"
+
+    orchestra("components", "--json", "component_B")
+    out, err = capsys.readouterr()
+    components = json.loads(out)
+    assert components[0]["compiler_cache_stats"] == expected_stats
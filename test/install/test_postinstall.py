@@ -1,6 +1,19 @@
+import os
 import re
 import subprocess
-
+import sys
+from pathlib import Path
+
+import orchestra as orchestra_module
+from orchestra.actions.rpath import RPATH_PLACEHOLDER_PREFIX, fix_rpaths
+from orchestra.actions.text_rewriter import asan_rules, ndebug_rules, pkgconfig_rules, rewrite_files
+from orchestra.actions.tmproot import SKELETON_FILES
+from orchestra.model.install_metadata import (
+    installed_component_file_list_path,
+    installed_component_metadata_path,
+    load_file_list,
+)
+from orchestra.model.manifest import scan_directory
 from ..orchestra_shim import OrchestraShim
 
 
@@ -71,3 +84,123 @@ def test_skip_post_install(orchestra: OrchestraShim):
     file2 = orchestra.orchestra_root / "file2"
     assert not file1.is_symlink(), "postinstall run and transformed a hardlink into a synlink"
     assert not file2.is_symlink(), "postinstall run and transformed a hardlink into a synlink"
+
+
+HEADER_SAMPLE = (
+    b"#ifdef NDEBUG\n"
+    b"  #  ifndef\tNDEBUG\n"
+    b"\n"
+    b"#ifdef NDEBUG_EXTRA\n"
+    b"#if defined(NDEBUG) && !defined(NDEBUG) || defined(NDEBUG)\n"
+    b"#elif defined(NDEBUG)\n"
+    b"# if   !defined(NDEBUG)\r\n"
+    b"int ndebug = defined(NDEBUG);\n"
+    b"#if __has_feature(address_sanitizer) || __has_feature(address_sanitizer)\n"
+    b"#if __has_featureaddress_sanitizer || defined__SANITIZE_ADDRESS__ || defined__SANITIZE_ADDRESS__\n"
+    b"#if defined(__SANITIZE_ADDRESS__)\n"
+    b"\xff\xfe invalid utf-8 #ifdef NDEBUG\n"
+    b"#ifndef NDEBUG"
+)
+
+
+def test_postinstall_text_rewrites_match_sed(orchestra: OrchestraShim, tmp_path):
+    """Checks that the pkg-config and header rewrites produce the same output as the sed commands they replaced"""
+    orchestra_root = str(orchestra.orchestra_root)
+    root = orchestra_root.encode("utf-8")
+    pkgconfig_sample = (
+        b"prefix=" + root + b"/usr\n"
+        b"libdir=//" + root + b"//lib " + root + b"\n"
+        b"other=" + root.replace(b"/", b"_") + b"\n"
+        b"includedir=${prefix}/include"
+    )
+
+    def sed(path, *expressions):
+        argv = ["sed", "-i"]
+        for expression in expressions:
+            argv += ["-e", expression]
+        subprocess.check_call(argv + [str(path)])
+
+    for disable_debugging in (True, False):
+        for asan_enabled in (True, False):
+            debug, ndebug = ("0", "1") if disable_debugging else ("1", "0")
+            asan = "1" if asan_enabled else "0"
+            expected_header = tmp_path / "expected.h"
+            actual_header = tmp_path / "actual.h"
+            for path in (expected_header, actual_header):
+                path.write_bytes(HEADER_SAMPLE)
+
+            sed(
+                expected_header,
+                rf"s|^\s*#\s*ifndef\s\+NDEBUG|#if {debug}|",
+                rf"s|^\s*#\s*ifdef\s\+NDEBUG|#if {ndebug}|",
+                rf"s|^\(\s*#\s*if\s\+.*\)!defined(NDEBUG)|\1{debug}|",
+                rf"s|^\(\s*#\s*if\s\+.*\)defined(NDEBUG)|\1{ndebug}|",
+            )
+            sed(
+                expected_header,
+                rf"s|__has_feature\(address_sanitizer\)|{asan}|",
+                rf"s|defined\(__SANITIZE_ADDRESS__\)|{asan}|",
+            )
+            rewrite_files([([str(actual_header)], ndebug_rules(disable_debugging) + asan_rules(asan_enabled))])
+            assert actual_header.read_bytes() == expected_header.read_bytes()
+
+    expected_pc = tmp_path / "expected.pc"
+    actual_pc = tmp_path / "actual.pc"
+    for path in (expected_pc, actual_pc):
+        path.write_bytes(pkgconfig_sample)
+    sed(expected_pc, f"s|/*{orchestra_root}/*|${{pcfiledir}}/../..|g")
+    rewrite_files([([str(actual_pc)], pkgconfig_rules(orchestra_root))])
+    assert actual_pc.read_bytes() == expected_pc.read_bytes()
+
+
+def test_postinstall_fix_rpath_matches_elf_replace_dynstr(orchestra: OrchestraShim, test_data_mgr, tmp_path):
+    """Checks that fixing RPATHs in-process produces the same files as support/elf-replace-dynstr.py"""
+    orchestra_root = str(orchestra.orchestra_root)
+    rpath_placeholder = RPATH_PLACEHOLDER_PREFIX + orchestra_root
+    replace_dynstr = Path(orchestra_module.__file__).parent / "support" / "elf-replace-dynstr.py"
+    source = str(test_data_mgr.copy("sources") / "test.c")
+
+    paths = ["bin/test", "lib/test/libtest.so", "bin/script"]
+    for root in ("expected", "actual"):
+        for path in paths:
+            (tmp_path / root / path).parent.mkdir(parents=True, exist_ok=True)
+        rpath = f"{rpath_placeholder}:{orchestra_root}/lib:/usr/lib"
+        subprocess.check_call(
+            ["gcc", "-o", tmp_path / root / "bin/test", "-Wl,--enable-new-dtags", f"-Wl,-rpath={rpath}", source]
+        )
+        subprocess.check_call(
+            ["gcc", "-shared", "-o", tmp_path / root / "lib/test/libtest.so", f"-Wl,-rpath={rpath}", source]
+        )
+        script = tmp_path / root / "bin/script"
+        script.write_text(f"#!/bin/sh\n{orchestra_root}/bin/test\n")
+        script.chmod(0o755)
+
+    for path in paths[:2]:
+        elf_path = tmp_path / "expected" / path
+        replace = "$ORIGIN/" + os.path.relpath(tmp_path / "expected", elf_path.parent)
+        for search in (rpath_placeholder, orchestra_root):
+            subprocess.check_call([sys.executable, replace_dynstr, elf_path, search, replace, "/"])
+
+    patched = fix_rpaths(str(tmp_path / "actual"), paths, rpath_placeholder, orchestra_root)
+
+    assert sorted(patched) == [("bin/test", "$ORIGIN/.."), ("lib/test/libtest.so", "$ORIGIN/../..")]
+    for path in paths:
+        assert (tmp_path / "actual" / path).read_bytes() == (tmp_path / "expected" / path).read_bytes()
+
+
+def test_postinstall_scan_matches_tmproot(orchestra: OrchestraShim):
+    """Checks that the installed files index, built from the scan shared by the post-install steps, matches the
+    content of the temporary root after the post-install steps changed it
+    """
+    orchestra("install", "-b", "--keep-tmproot", "component_that_tests_postinstall")
+
+    config = orchestra.configuration
+    tmp_root = config.components["component_that_tests_postinstall"].default_build.install.tmp_root
+    expected_files = set(scan_directory(tmp_root + config.orchestra_root).file_list()) - set(SKELETON_FILES)
+    metadata_files = {
+        os.path.relpath(path("component_that_tests_postinstall", config), config.orchestra_root)
+        for path in (installed_component_file_list_path, installed_component_metadata_path)
+    }
+    installed_files = set(load_file_list("component_that_tests_postinstall", config)) - metadata_files
+    assert installed_files == expected_files
+    assert "usr/lib/test.la" not in installed_files
@@ -35,3 +35,23 @@ def test_ls_remote_without_local_clone(orchestra: OrchestraShim):
 
     assert component.branch() == current_branch_name
     assert component.commit() == current_commit
+
+
+def test_local_clone_branch_info_follows_head(orchestra: OrchestraShim):
+    """Checks that the branch name and commit hash of a local clone are up to date after committing and switching
+    branches, even though they are cached
+    """
+    orchestra("clone", "component_A")
+
+    component = orchestra.configuration.components["component_A"]
+    repo_path = component.clone.environment["SOURCE_DIR"]
+    initial_branch = component.branch()
+    assert component.commit() == git.rev_parse(repo_path, "HEAD")
+
+    git.run(repo_path, "commit", "--allow-empty", "-m", "Empty commit")
+    assert component.branch() == initial_branch
+    assert component.commit() == git.rev_parse(repo_path, "HEAD")
+
+    git.run(repo_path, "checkout", "-b", "another-branch", "HEAD~1")
+    assert component.branch() == "another-branch"
+    assert component.commit() == git.rev_parse(repo_path, "HEAD")
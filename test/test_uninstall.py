@@ -15,3 +15,27 @@ def test_uninstall(orchestra: OrchestraShim):
         "./share/orchestra/component_B.json",
     }
     assert compare_root_tree(orchestra.orchestra_root, expected_file_list)
+
+
+def test_uninstall_multiple_components(orchestra: OrchestraShim):
+    """Checks that uninstalling several components at once removes all their files and the directories left empty"""
+    orchestra("install", "-b", "component_A")
+    orchestra("install", "-b", "component_B")
+    orchestra("install", "-b", "component_C")
+
+    # Add a nested file to the index of component_A
+    nested_file = orchestra.orchestra_root / "share" / "component_A" / "nested" / "file"
+    nested_file.parent.mkdir(parents=True)
+    nested_file.touch()
+    with open(orchestra.orchestra_root / "share" / "orchestra" / "component_A.idx", "a") as f:
+        f.write("share/component_A/nested/file\n")
+
+    orchestra("uninstall", "component_A", "component_B")
+
+    expected_file_list = {
+        "./component_C_file",
+        "./component_C_build0_file",
+        "./share/orchestra/component_C.idx",
+        "./share/orchestra/component_C.json",
+    }
+    assert compare_root_tree(orchestra.orchestra_root, expected_file_list)